@@ -1,35 +1,71 @@
 # GCP_Video_AI/chunk_and_annotate.py
 
 import os
+import sys
+import time
 import subprocess
+from pathlib import Path
 from google.cloud import videointelligence_v1 as vi
 from google.protobuf.json_format import MessageToDict
 import json
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repo root
+from stage_cache import cache, cached_files, make_key
+
+FEATURES = [
+    vi.Feature.SPEECH_TRANSCRIPTION,
+    vi.Feature.LABEL_DETECTION,
+    vi.Feature.PERSON_DETECTION
+]
+
 def split_video(input_path, output_dir, chunk_length=60):
     os.makedirs(output_dir, exist_ok=True)
     output_template = os.path.join(output_dir, "chunk_%03d.mp4")
     command = [
-        "ffmpeg", "-i", input_path,
+        "ffmpeg", "-y", "-i", input_path,
         "-c", "copy", "-map", "0",
         "-f", "segment", "-segment_time", str(chunk_length),
         output_template
     ]
-    subprocess.run(command, check=True)
-    return sorted([os.path.join(output_dir, f) for f in os.listdir(output_dir) if f.endswith(".mp4")])
-
-def annotate_chunk(video_path):
-    client = vi.VideoIntelligenceServiceClient()
-    features = [
-        vi.Feature.SPEECH_TRANSCRIPTION,
-        vi.Feature.LABEL_DETECTION,
-        vi.Feature.PERSON_DETECTION
-    ]
+
+    def run():
+        subprocess.run(command, check=True)
+        return sorted([os.path.join(output_dir, f) for f in os.listdir(output_dir) if f.endswith(".mp4")])
+
+    return cached_files("ffmpeg_split", run, output_dir,
+                        params={"chunk_length": chunk_length}, files=[input_path])
+
+ANNOTATE_PARAMS = {"features": [f.name for f in FEATURES], "language_code": "en-US"}
+MAX_IN_FLIGHT = int(os.getenv("GCP_VIDEO_AI_MAX_IN_FLIGHT", "8"))
+POLL_SECONDS = 5
+OPERATION_TIMEOUT = 300
+
+def make_client():
+    """
+    One VideoIntelligenceServiceClient for the whole job.  Set
+    GCP_VIDEO_AI_ENDPOINT=host:port to talk to a local fake of the annotate
+    endpoint over an insecure channel instead of the real API.
+    """
+    endpoint = os.getenv("GCP_VIDEO_AI_ENDPOINT")
+    if not endpoint:
+        return vi.VideoIntelligenceServiceClient()
+    import grpc
+    from google.cloud.videointelligence_v1.services.video_intelligence_service.transports import (
+        VideoIntelligenceServiceGrpcTransport,
+    )
+    transport = VideoIntelligenceServiceGrpcTransport(channel=grpc.insecure_channel(endpoint))
+    return vi.VideoIntelligenceServiceClient(transport=transport)
+
+def _to_dict(result):
+    # ✅ Guaranteed conversion (fakes may hand back plain dicts)
+    return result if isinstance(result, dict) else MessageToDict(result._pb)
+
+def _submit(client, video_path):
     with open(video_path, "rb") as f:
         input_content = f.read()
-    operation = client.annotate_video(
+    return client.annotate_video(
         request={
-            "features": features,
+            "features": FEATURES,
             "input_content": input_content,
             "video_context": {
                 "speech_transcription_config": {
@@ -39,11 +75,9 @@ def annotate_chunk(video_path):
             }
         }
     )
-    print(f"⏳ Annotating {video_path}...")
-    result = operation.result(timeout=300)
 
-    # ✅ Guaranteed conversion
-    return MessageToDict(result._pb)
+def _cache_key(video_path):
+    return make_key("gcp_annotate", "videointelligence_v1", ANNOTATE_PARAMS, files=[video_path])
 
 def merge_annotations(results):
     merged = {
@@ -53,19 +87,81 @@ def merge_annotations(results):
         merged["annotationResults"].extend(r.get("annotationResults", []))
     return merged
 
-def process_long_video(video_path, chunk_dir):
-    chunks = split_video(video_path, chunk_dir)
-    results = []
+def _chunk_json_path(chunk):
+    base_name = os.path.splitext(os.path.basename(chunk))[0]
+    return os.path.join(os.path.dirname(chunk), f"{base_name}.json")
+
+def _save_chunk(chunk, result):
+    # ✅ Save raw annotation for inspection (and for resuming)
+    with open(_chunk_json_path(chunk), "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+def annotate_chunks(chunks, client=None, max_in_flight=MAX_IN_FLIGHT,
+                    poll_seconds=POLL_SECONDS, timeout=OPERATION_TIMEOUT):
+    """
+    Annotate <chunks> with one shared client and up to <max_in_flight>
+    long-running operations at a time, polling them together.  Chunks whose
+    chunk_XXX.json already exists (or that are in the stage cache) are not
+    resubmitted, so an interrupted job resumes where it stopped.  Returns
+    results in chunk order; a chunk whose operation failed is None.
+    """
+    results = [None] * len(chunks)
+    todo = []
+    for i, chunk in enumerate(chunks):
+        json_path = _chunk_json_path(chunk)
+        if os.path.exists(json_path):
+            with open(json_path, "r", encoding="utf-8") as f:
+                results[i] = json.load(f)
+            print(f"⏭️  {os.path.basename(chunk)} already annotated, skipping")
+            continue
+        cached = cache.get_json(_cache_key(chunk))
+        if cached is not None:
+            print(f"♻️  [cache] gcp_annotate hit for {os.path.basename(chunk)}")
+            results[i] = cached
+            _save_chunk(chunk, cached)
+            continue
+        todo.append(i)
+
+    if not todo:
+        return results
 
-    for chunk in chunks:
-        print(f"⏳ Annotating {chunk}...")
-        result = annotate_chunk(chunk)
-        results.append(result)
+    client = client or make_client()
+    in_flight = {}                          # chunk index -> (operation, submitted_at)
+    while todo or in_flight:
+        while todo and len(in_flight) < max_in_flight:
+            i = todo.pop(0)
+            print(f"⏳ Submitting {os.path.basename(chunks[i])}...")
+            in_flight[i] = (_submit(client, chunks[i]), time.monotonic())
 
-        # ✅ Save raw annotation for inspection
-        base_name = os.path.splitext(os.path.basename(chunk))[0]
-        json_path = os.path.join(chunk_dir, f"{base_name}.json")
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(result, f, indent=2)
+        finished = False
+        for i, (operation, submitted) in list(in_flight.items()):
+            if operation.done():
+                del in_flight[i]
+                finished = True
+                try:
+                    result = _to_dict(operation.result())
+                except Exception as e:
+                    print(f"❌ Annotation failed for {chunks[i]}: {e}")
+                    continue
+                results[i] = result
+                _save_chunk(chunks[i], result)
+                cache.put_json(_cache_key(chunks[i]), result)
+                print(f"✅ Annotated {os.path.basename(chunks[i])}")
+            elif time.monotonic() - submitted > timeout:
+                del in_flight[i]
+                finished = True
+                print(f"❌ Annotation timed out for {chunks[i]} after {timeout}s")
+
+        if in_flight and not finished:
+            time.sleep(poll_seconds)
+
+    return results
+
+def process_long_video(video_path, chunk_dir, client=None, max_in_flight=MAX_IN_FLIGHT):
+    chunks = split_video(video_path, chunk_dir)
+    results = annotate_chunks(chunks, client=client, max_in_flight=max_in_flight)
 
-    return merge_annotations(results)
\ No newline at end of file
+    missing = [os.path.basename(c) for c, r in zip(chunks, results) if r is None]
+    if missing:
+        print(f"⚠️  {len(missing)} chunk(s) not annotated, re-run to retry: {missing}")
+    return merge_annotations([r for r in results if r is not None])
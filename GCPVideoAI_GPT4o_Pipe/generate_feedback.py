@@ -1,9 +1,14 @@
 # GCP_Video_AI/generate_feedback.py
 
 import os
+import sys
+from pathlib import Path
 from openai import OpenAI
 from openai.types.chat import ChatCompletion
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repo root
+from stage_cache import cached_chat
+
 # === Init OpenAI client ===
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
@@ -35,7 +40,8 @@ Return your evaluation as:
         f.write(data['transcript'])
 
     # === GPT-4o call ===
-    response = client.chat.completions.create(
+    return cached_chat(
+        client,
         model="gpt-4o",
         messages=[
             {"role": "system", "content": "You are an expert classroom evaluator."},
@@ -43,5 +49,3 @@ Return your evaluation as:
         ],
         temperature=0
     )
-
-    return response.choices[0].message.content
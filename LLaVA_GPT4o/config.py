@@ -1,5 +1,5 @@
 FPS = 1/10  # Frames per second to extract
-FRAME_SIZE = (224, 224)  # Resize frames for LLaVA
+FRAME_SIZE = (336, 336)  # LLaVA input (CLIP ViT-L/14-336): short side scaled to 336, then centre-cropped
 ANALYSIS_PROMPTS = [
         {
             "name": "setup",
@@ -27,3 +27,29 @@ ANALYSIS_PROMPTS = [
         },
     ]
 OPENAI_MODEL = "gpt-4o"
+
+# LLaVA batching
+LLAVA_BATCH_SIZE = 8  # (frame, prompt) pairs per generate() call
+LLAVA_MAX_NEW_TOKENS = 90
+GPU_MEM_HIGH_WATERMARK = 0.85  # only empty the CUDA cache above this fraction of device memory
+CPU_SHARED_VISION = True  # on CPU, run the vision tower once per frame and reuse it across prompts
+LLAVA_BACKEND = "torch"  # torch | torch-bf16 | torch-int8 (CPU runtimes, see inference_backends.py); env LLAVA_BACKEND overrides
+
+# Near-duplicate frame skipping (frame_dedup.py)
+DEDUP_ENABLED = True
+DEDUP_HASH_SIZE = 16  # dHash / thumbnail side
+DEDUP_THRESHOLD = 0.12  # frames closer than this to the last captioned frame reuse its captions
+DEDUP_MAX_GAP_S = 60  # always re-caption at least this often, even on a static shot
+
+# Adaptive sampling: decode densely, keep 1/FPS baseline plus frames at scene changes
+ADAPTIVE_FPS = 1
+SCENE_THRESHOLD = 0.25
+MIN_SCENE_GAP_S = 2
+
+# In-memory frame streaming (frame_extractor.stream_frames)
+FRAME_QUEUE_SIZE = 32  # decoded frames buffered ahead of inference
+
+# Caption compression before GPT-4o (caption_cluster.py)
+CAPTION_EMBEDDER = "hashed-tf"  # or a sentence-transformers model, e.g. "all-MiniLM-L6-v2"
+CAPTION_MERGE_THRESHOLD = 0.63  # cosine similarity to the run centroid needed to join a run (hashed tf; ~0.75 for sentence-transformers)
+CAPTION_MAX_RUN = 30  # frames per ranged entry at most (30 = 5 min at FPS 1/10), keeps the timeline readable
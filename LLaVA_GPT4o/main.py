@@ -1,32 +1,53 @@
 import sys
 import os
+import argparse
 
 # Add utils/ directory to Python path
 sys.path.append(os.path.join(os.path.dirname(__file__), "utils"))
 
 from frame_extractor import extract_frames
-from llava_inference import run_llava_on_frames
+from llava_inference import run_llava_on_frames, run_llava_on_video
 from gpt4o_feedback import generate_feedback
 from video_utils import prepare_output_dir
+from config import FPS, ADAPTIVE_FPS, DEDUP_ENABLED
+from pipeline_metrics import add_cli_args, metrics
 
 
-def main(video_path):
+def main(video_path, adaptive=False, dedup=DEDUP_ENABLED, from_disk=False, save_frames=False,
+         output_root="outputs"):
     video_name = os.path.splitext(os.path.basename(video_path))[0]
-    output_dir = prepare_output_dir(video_name)
+    output_dir = prepare_output_dir(video_name, output_root)
 
-    print("🔹 Extracting frames...")
-    frame_dir = extract_frames(video_path, output_dir)
+    # adaptive mode decodes densely and lets scene changes decide which frames to keep
+    fps = ADAPTIVE_FPS if adaptive else FPS
+    if from_disk:
+        print("🔹 Extracting frames...")
+        frame_dir = extract_frames(video_path, output_dir, fps=fps)
 
-    print("🔹 Running LLaVA on frames...")
-    llava_json_path = run_llava_on_frames(frame_dir, output_dir)
+        print("🔹 Running LLaVA on frames...")
+        llava_json_path = run_llava_on_frames(frame_dir, output_dir, fps=fps, dedup=dedup, adaptive=adaptive)
+    else:
+        print("🔹 Streaming frames into LLaVA...")
+        llava_json_path = run_llava_on_video(video_path, output_dir, fps=fps, dedup=dedup,
+                                             adaptive=adaptive, save_frames=save_frames)
 
     print("🔹 Generating GPT-4o feedback...")
     generate_feedback(llava_json_path, output_dir)
 
     print(f"✅ Done. Check output in {output_dir}")
+    return llava_json_path
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 main.py <video_path>")
-        sys.exit(1)
-    main(sys.argv[1])
+    parser = argparse.ArgumentParser(description="LLaVA frame captions + GPT-4o feedback")
+    parser.add_argument("video_path", help="Path to input MP4 video")
+    parser.add_argument("--adaptive", action="store_true",
+                        help=f"Decode at {ADAPTIVE_FPS} fps and sample more densely around scene changes")
+    parser.add_argument("--no-dedup", action="store_true", help="Caption every frame, even near-duplicates")
+    parser.add_argument("--save-frames", action="store_true", help="Also write the streamed frames as JPEGs")
+    parser.add_argument("--from-disk", action="store_true",
+                        help="Old path: extract JPEGs with ffmpeg first, then caption them")
+    add_cli_args(parser)
+    args = parser.parse_args()
+    metrics.configure(args.metrics, args.metrics_port)
+    main(args.video_path, adaptive=args.adaptive, dedup=DEDUP_ENABLED and not args.no_dedup,
+         from_disk=args.from_disk, save_frames=args.save_frames)
@@ -0,0 +1,156 @@
+# caption_cluster.py
+# Merge runs of similar LLaVA captions into ranged entries before GPT-4o.
+#
+# LLaVA rarely repeats itself word for word, so run-length compression of
+# identical captions almost never fires.  Here every caption of a prompt is
+# embedded (sublinear term counts over a hashed vocabulary in NumPy, or a
+# small sentence-transformers model when CAPTION_EMBEDDER names one), and
+# walking the frames in order, a caption joins the current run when its
+# cosine similarity to the run's centroid is at least CAPTION_MERGE_THRESHOLD.
+# Each run becomes one entry, "first–last [prompt]: <the caption closest to
+# the centroid>", so chronology and duration survive while near-repeats cost
+# tokens once.
+#
+# Both embedders look at one caption at a time (no idf fitted on the whole
+# lesson) and runs only depend on earlier frames, so appending minutes
+# leaves every entry but each prompt's last one unchanged, and the packed
+# GPT-4o chunks before it keep hitting the stage cache.
+
+import re
+import sys
+import zlib
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # LLaVA_GPT4o, for config when run directly
+from config import CAPTION_EMBEDDER, CAPTION_MERGE_THRESHOLD, CAPTION_MAX_RUN
+
+_WORD = re.compile(r"[a-z][a-z']+")
+HASH_DIM = 4096                     # hashed vocabulary size (a lesson uses ~1k distinct words)
+STOPWORDS = frozenset("""
+a an and are as at be been being but by can could do does for from has have he her his i in into is it its
+may might more most of on or our she so some such than that the their them then there these they this those
+to very was we were what which while who will with would you your appears appear seems seem image scene
+""".split())
+
+_model = None
+
+
+def _tokens(text: str) -> list[str]:
+    return [w for w in _WORD.findall(text.lower()) if w not in STOPWORDS]
+
+
+def hashed_tf(texts: list[str], dim: int = HASH_DIM) -> np.ndarray:
+    """[len(texts), dim] L2-normalised sublinear term counts; each row depends on its own text only."""
+    x = np.zeros((len(texts), dim), dtype=np.float32)
+    for r, text in enumerate(texts):
+        for w, c in Counter(_tokens(text)).items():
+            x[r, zlib.crc32(w.encode()) % dim] += 1.0 + np.log(c)   # crc32: stable across processes
+    return x / (np.linalg.norm(x, axis=1, keepdims=True) + 1e-8)
+
+
+def embed(texts: list[str], embedder: str = CAPTION_EMBEDDER) -> np.ndarray:
+    """Unit-length caption embeddings: hashed tf, or sentence-transformers model <embedder> if installed."""
+    global _model
+    if embedder != "hashed-tf":
+        try:
+            from sentence_transformers import SentenceTransformer
+            if _model is None or _model[0] != embedder:
+                _model = (embedder, SentenceTransformer(embedder, device="cpu"))
+            return _model[1].encode(texts, normalize_embeddings=True, batch_size=64)
+        except ImportError:
+            print(f"⚠️  sentence-transformers not installed; using hashed tf instead of {embedder}")
+    return hashed_tf(texts)
+
+
+def merge_runs(vectors: np.ndarray, threshold: float = CAPTION_MERGE_THRESHOLD,
+               max_run: int = CAPTION_MAX_RUN) -> list[tuple[int, int, int]]:
+    """
+    (first, last, representative) row indices of consecutive runs: a row
+    extends the run while its similarity to the run centroid is >= threshold
+    and the run is shorter than <max_run> rows.
+    """
+    runs = []
+    first, total = 0, None
+    for i, v in enumerate(vectors):
+        if total is not None and i - first < max_run:
+            centroid = total / (np.linalg.norm(total) + 1e-8)
+            if float(v @ centroid) >= threshold:
+                total = total + v
+                continue
+        if total is not None:
+            runs.append((first, i - 1))
+        first, total = i, np.array(v, dtype=np.float32)
+    if total is not None:
+        runs.append((first, len(vectors) - 1))
+
+    out = []
+    for a, b in runs:
+        centroid = vectors[a:b + 1].sum(0)
+        out.append((a, b, a + int(np.argmax(vectors[a:b + 1] @ centroid))))
+    return out
+
+
+def compress_captions(frames, prompts: list[str], threshold: float = CAPTION_MERGE_THRESHOLD,
+                      embedder: str = CAPTION_EMBEDDER, max_run: int = CAPTION_MAX_RUN) -> list[dict]:
+    """
+    frames: [(frame_name, {prompt: caption})] in time order.  Returns ranged
+    entries {"first", "last", "frames", "prompt", "text"} in chronological
+    order (by first frame, then by the order of <prompts>).
+    """
+    order = {p: i for i, p in enumerate(prompts)}
+    entries = []
+    for prompt in sorted({p for _, caps in frames for p in caps}, key=lambda p: order.get(p, len(order))):
+        rows = [(i, name, caps[prompt]) for i, (name, caps) in enumerate(frames) if caps.get(prompt)]
+        if not rows:
+            continue
+        vectors = embed([text for _, _, text in rows], embedder)
+        for a, b, rep in merge_runs(vectors, threshold, max_run):
+            entries.append({"first": rows[a][1], "last": rows[b][1], "frames": b - a + 1, "prompt": prompt,
+                            "text": rows[rep][2], "_pos": (rows[a][0], order.get(prompt, len(order)))})
+    entries.sort(key=lambda e: e.pop("_pos"))
+    return entries
+
+
+def format_entry(entry: dict) -> str:
+    span = entry["first"] if entry["first"] == entry["last"] else f"{entry['first']}–{entry['last']}"
+    return f"{span} [{entry['prompt']}]: {entry['text']}"
+
+
+def leading_entries_stable(frames, prompts: list[str], n: int, **kwargs) -> bool:
+    """True if compressing frames[:n] and all <frames> agree on every entry but each prompt's last."""
+    short = compress_captions(frames[:n], prompts, **kwargs)
+    last = {e["prompt"]: i for i, e in enumerate(short)}
+    full = compress_captions(frames, prompts, **kwargs)
+    return all(e in full for i, e in enumerate(short) if i != last[e["prompt"]])
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from config import ANALYSIS_PROMPTS
+
+    parser = argparse.ArgumentParser(description="Compress a llava_responses.json and check append stability")
+    parser.add_argument("llava_json")
+    parser.add_argument("--threshold", type=float, default=CAPTION_MERGE_THRESHOLD)
+    parser.add_argument("--embedder", default=CAPTION_EMBEDDER)
+    args = parser.parse_args()
+
+    with open(args.llava_json) as f:
+        raw = json.load(f)
+    prompts = [p["name"] for p in ANALYSIS_PROMPTS] + ["description"]
+    frames = [(name, {k: v for k, v in item.items() if k in prompts and v} if isinstance(item, dict)
+               else {"description": str(item)}) for name, item in raw.items()]
+    opts = {"threshold": args.threshold, "embedder": args.embedder}
+    entries = compress_captions(frames, prompts, **opts)
+    before = sum(len(f"{name} [{p}]: {c}\n") for name, caps in frames for p, c in caps.items())
+    after = sum(len(format_entry(e) + "\n") for e in entries)
+    print(f"🗜️  {sum(len(c) for _, c in frames)} caption(s) → {len(entries)} entries, "
+          f"{before / max(1, after):.1f}× fewer characters")
+    cuts = range(1, len(frames), max(1, len(frames) // 20))
+    unstable = [n for n in cuts if not leading_entries_stable(frames, prompts, n, **opts)]
+    print(f"✅ leading entries stable for all {len(cuts)} prefixes" if not unstable
+          else f"❌ leading entries change when frames are appended after frame {unstable[0]}")
+    raise SystemExit(1 if unstable else 0)
@@ -0,0 +1,165 @@
+# frame_dedup.py
+# Skip near-identical frames before LLaVA and sample densely around scene changes.
+#
+# Every frame is reduced to a small grayscale thumbnail.  Distances between
+# thumbnails combine the dHash Hamming fraction (structure) with the
+# earth mover's distance between 32-bin intensity histograms (lighting /
+# content, but tolerant of small exposure drift), both computed for all
+# frames at once in NumPy.
+
+import numpy as np
+from PIL import Image
+from config import (
+    DEDUP_HASH_SIZE, DEDUP_THRESHOLD, DEDUP_MAX_GAP_S,
+    SCENE_THRESHOLD, MIN_SCENE_GAP_S,
+)
+
+HIST_BINS = 32
+
+
+def frame_signature(img: Image.Image, size: int = DEDUP_HASH_SIZE) -> np.ndarray:
+    """(size, size+1) grayscale thumbnail – all the dedup stage keeps of a frame."""
+    if img.format == "JPEG":
+        img.draft("L", (size * 8, size * 8))        # let libjpeg downscale while decoding
+    return np.asarray(img.convert("L").resize((size + 1, size), Image.BILINEAR), dtype=np.float32)
+
+
+def load_signature(path: str, size: int = DEDUP_HASH_SIZE) -> np.ndarray | None:
+    try:
+        with Image.open(path) as img:
+            return frame_signature(img, size)
+    except Exception as err:
+        print(f"❌  Corrupted image skipped: {path} ({err})")
+        return None
+
+
+def _features(sigs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """dHash bits [N, size*size] and cumulative normalised histograms [N, HIST_BINS]."""
+    n = len(sigs)
+    bits = (sigs[:, :, 1:] > sigs[:, :, :-1]).reshape(n, -1)
+    bins = np.clip((sigs.reshape(n, -1) * (HIST_BINS / 256.0)).astype(np.int64), 0, HIST_BINS - 1)
+    flat = (bins + np.arange(n)[:, None] * HIST_BINS).ravel()
+    hist = np.bincount(flat, minlength=n * HIST_BINS).reshape(n, HIST_BINS).astype(np.float32)
+    hist /= bins.shape[1]
+    return bits, np.cumsum(hist, axis=1)
+
+
+def _distance(bits, cdf, i, j) -> np.ndarray:
+    """Distance in [0, 1] between frames i and j (broadcasts over index arrays)."""
+    hamming = np.count_nonzero(bits[i] != bits[j], axis=-1) / bits.shape[1]
+    emd = np.abs(cdf[i] - cdf[j]).sum(axis=-1) / HIST_BINS
+    return np.maximum(hamming, emd)
+
+
+def scene_scores(sigs: np.ndarray) -> np.ndarray:
+    """Distance of every frame to its predecessor (first frame scores 1.0)."""
+    bits, cdf = _features(sigs)
+    scores = np.ones(len(sigs), dtype=np.float32)
+    if len(sigs) > 1:
+        idx = np.arange(1, len(sigs))
+        scores[1:] = _distance(bits, cdf, idx, idx - 1)
+    return scores
+
+
+def select_adaptive(times: np.ndarray, sigs: np.ndarray, base_interval: float,
+                    scene_threshold: float = SCENE_THRESHOLD,
+                    min_gap: float = MIN_SCENE_GAP_S) -> np.ndarray:
+    """
+    From densely decoded frames keep the regular 1/FPS baseline plus every
+    frame that starts a scene change (at most one per <min_gap> seconds).
+    Returns the kept indices.
+    """
+    scores = scene_scores(sigs)
+    keep = []
+    last = -np.inf
+    t0 = times[0] if len(times) else 0.0
+    next_base = t0
+    for i, t in enumerate(times):
+        on_base = t >= next_base - 1e-6
+        on_cut = scores[i] >= scene_threshold and t - last >= min_gap
+        if on_base or on_cut:
+            keep.append(i)
+            last = t
+        if on_base:
+            next_base = t0 + (np.floor((t - t0) / base_interval + 1e-6) + 1) * base_interval
+    return np.asarray(keep, dtype=np.int64)
+
+
+def select_keyframes(times: np.ndarray, sigs: np.ndarray, groups=None,
+                     threshold: float = DEDUP_THRESHOLD,
+                     max_gap: float = DEDUP_MAX_GAP_S) -> np.ndarray:
+    """
+    For each frame, the index of the frame whose captions it should use
+    (itself for keyframes).  A frame becomes a keyframe when it differs from
+    the last keyframe by more than <threshold>, when <max_gap> seconds have
+    passed, or when its prompt group (set of applicable prompts) changes.
+    """
+    n = len(sigs)
+    rep = np.arange(n)
+    if n == 0:
+        return rep
+    bits, cdf = _features(sigs)
+    groups = np.zeros(n) if groups is None else np.asarray(groups)
+    key = 0
+    for i in range(1, n):
+        if (groups[i] != groups[key]
+                or times[i] - times[key] >= max_gap
+                or _distance(bits, cdf, i, key) > threshold):
+            key = i
+        rep[i] = key
+    return rep
+
+
+class StreamDedup:
+    """
+    Online version of select_adaptive + select_keyframes for frames that
+    arrive one at a time (stream_frames): same rules, O(1) state.
+    """
+
+    def __init__(self, base_interval: float, adaptive: bool = False, dedup: bool = True,
+                 threshold: float = DEDUP_THRESHOLD, max_gap: float = DEDUP_MAX_GAP_S,
+                 scene_threshold: float = SCENE_THRESHOLD, min_gap: float = MIN_SCENE_GAP_S):
+        self.base_interval = base_interval
+        self.adaptive = adaptive
+        self.dedup = dedup
+        self.threshold = threshold
+        self.max_gap = max_gap
+        self.scene_threshold = scene_threshold
+        self.min_gap = min_gap
+        self._prev = None               # features of the previous decoded frame
+        self._key = None                # (features, time, group) of the current keyframe
+        self._t0 = None
+        self._next_base = None
+        self._last_sample = -np.inf
+
+    @staticmethod
+    def _dist(a, b) -> float:
+        bits = np.stack([a[0], b[0]])
+        cdf = np.stack([a[1], b[1]])
+        return float(_distance(bits, cdf, 0, 1))
+
+    def observe(self, t: float, sig: np.ndarray, group=None) -> tuple[bool, bool]:
+        """(sampled, is_keyframe) for a frame at <t> seconds with signature <sig>."""
+        bits, cdf = _features(sig[None])
+        feats = (bits[0], cdf[0])
+
+        if self.adaptive:
+            if self._t0 is None:
+                self._t0 = self._next_base = t
+            score = 1.0 if self._prev is None else self._dist(feats, self._prev)
+            self._prev = feats
+            on_base = t >= self._next_base - 1e-6
+            on_cut = score >= self.scene_threshold and t - self._last_sample >= self.min_gap
+            if on_base:
+                self._next_base = self._t0 + (np.floor((t - self._t0) / self.base_interval + 1e-6) + 1) * self.base_interval
+            if not (on_base or on_cut):
+                return False, False
+            self._last_sample = t
+
+        if (not self.dedup or self._key is None
+                or group != self._key[2]
+                or t - self._key[1] >= self.max_gap
+                or self._dist(feats, self._key[0]) > self.threshold):
+            self._key = (feats, t, group)
+            return True, True
+        return True, False
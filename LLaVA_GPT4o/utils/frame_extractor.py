@@ -1,14 +1,111 @@
 import os
+import sys
+import queue
+import subprocess
+import threading
 import ffmpeg
-from config import FPS
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from config import FPS, FRAME_SIZE, FRAME_QUEUE_SIZE
 
-def extract_frames(video_path, output_dir):
+sys.path.append(str(Path(__file__).resolve().parents[2]))  # repo root
+from pipeline_metrics import stage
+
+@stage("frame extraction")
+def extract_frames(video_path, output_dir, fps=FPS):
     frame_dir = os.path.join(output_dir, "frames")
     (
         ffmpeg
         .input(video_path)
-        .filter('fps', fps=FPS)
+        .filter('fps', fps=fps)
         .output(os.path.join(frame_dir, 'frame_%04d.jpg'), start_number=0)
         .run(overwrite_output=True)
     )
     return frame_dir
+
+def stream_frames(video_path, fps=FPS, size=FRAME_SIZE, save_dir=None):
+    """
+    Yield (fname, time_s, HxWx3 uint8 RGB array) piped straight out of ffmpeg
+    at <fps> and <size> – no JPEG round-trip.  Frames are scaled to cover
+    <size> and centre-cropped, like the CLIP processor, so 16:9 video isn't
+    squashed.  fname follows extract_frames' frame_%04d.jpg naming so
+    downstream JSON stays the same; with <save_dir> each frame is also
+    written there as a JPEG.
+    """
+    w, h = size
+    proc = (
+        ffmpeg
+        .input(video_path)
+        .filter('fps', fps=fps)
+        .filter('scale', w, h, force_original_aspect_ratio='increase')
+        .filter('crop', w, h)
+        .output('pipe:', format='rawvideo', pix_fmt='rgb24')
+        .global_args('-loglevel', 'error')
+        .run_async(pipe_stdout=True)
+    )
+    frame_bytes = w * h * 3
+    idx = 0
+    eof = False
+    try:
+        while True:
+            buf = proc.stdout.read(frame_bytes)
+            if len(buf) < frame_bytes:
+                eof = True
+                break
+            frame = np.frombuffer(buf, dtype=np.uint8).reshape(h, w, 3)
+            fname = f"frame_{idx:04d}.jpg"
+            if save_dir:
+                Image.fromarray(frame).save(os.path.join(save_dir, fname))
+            yield fname, idx / fps, frame
+            idx += 1
+    finally:
+        proc.stdout.close()
+        if not eof:                 # consumer stopped early: don't wait for the rest of the video
+            proc.kill()
+        proc.wait()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, "ffmpeg")
+
+def prefetch(iterable, maxsize=FRAME_QUEUE_SIZE):
+    """
+    Drain <iterable> on a background thread into a bounded queue, so frame
+    decoding overlaps with inference while at most <maxsize> frames are held.
+    """
+    q = queue.Queue(maxsize)
+    done = object()
+    stop = threading.Event()
+    errors = []
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put(item):
+                    break
+        except BaseException as err:
+            errors.append(err)
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+            put(done)
+
+    threading.Thread(target=producer, daemon=True).start()
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                break
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
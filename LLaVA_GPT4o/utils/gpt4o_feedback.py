@@ -6,43 +6,46 @@ descriptions *without* breaching GPT‑4o’s 30 k TPM rate‑limit tier.
 
 Core features
 ─────────────
-1.  **Run‑length compression** of consecutive, identical descriptions
-    (e.g. `F041–F057: children colouring at table`) → keeps chronology *and*
-    duration info while saving tokens.
+1.  **Semantic run compression** (caption_cluster.py) of consecutive,
+    similar descriptions per prompt (e.g. `F041–F057 [props]: children
+    colouring at table`) → keeps chronology *and* duration info while saving
+    tokens, even though LLaVA never repeats itself verbatim.
 
 2.  **Adaptive chunking** based on the org’s TPM limit so every API call
     stays safely below the quota (input + output + buffer ≤ 30 000 tokens).
 
 3.  **Two‑stage summarisation**
-      • per‑chunk feedback  
+      • per‑chunk feedback, sent concurrently through the token‑bucket
+        limiter in llm_client.py (no fixed sleeps between calls)
       • single synthesis call that merges the partial notes in *chronological*
         order into one concise report (Key Strengths / Areas for Improvement /
         Overall Summary).
 """
 
 from __future__ import annotations
-import os
 import re
-import time
 import json
+import asyncio
 from pathlib import Path
-import tiktoken
-from openai import OpenAI
 from collections import OrderedDict
 
 import sys, pathlib
 
 #Ensure parent folder is in the import path
 #sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))  # repo root
 
 from config import OPENAI_MODEL, ANALYSIS_PROMPTS
+from llm_client import AsyncLLMClient
+from tree_reduce import FAN_OUT, tree_reduce
+from pipeline_metrics import stage
+from caption_cluster import compress_captions, format_entry
+from token_budget import SAFETY_BUFFER, chunk_ceiling, message_tokens as _message_tokens, pack
 
 # Configuration
 TPM_LIMIT = 28000
 MAX_REPLY_TOKENS = 1200
-SAFETY_BUFFER = 3000
 MAX_INPUT_TOKENS = TPM_LIMIT - MAX_REPLY_TOKENS - SAFETY_BUFFER
-SLEEP_SECONDS = 75
 
 PROMPT_REMOVER = re.compile(
     r"\s*This image is from a pre-school storytelling class\. I would like you to analyze the scene and provide a detailed breakdown of what is happening\. Specifically, focus on the following aspects:\s*"
@@ -56,19 +59,14 @@ PROMPT_REMOVER = re.compile(
 )
 
 
-# Token encoding
-enc = tiktoken.encoding_for_model(OPENAI_MODEL)
-
 def message_tokens(text: str) -> int:
     """Calculate the number of tokens in the given text."""
-    return len(enc.encode(text)) + 4  # 4 tokens for role and JSON formatting
+    return _message_tokens(text, OPENAI_MODEL)  # +4 tokens for role and JSON formatting
 
 def _clean(desc: str) -> str:
     """Clean redundant prompt text and excess whitespace."""
     return PROMPT_REMOVER.sub(" ", desc).strip()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 # Feedback generation function
 def generate_feedback(llava_json_path: str | Path, output_dir: str | Path) -> None:
     try:                                                                                                                                                                        
@@ -79,55 +77,26 @@ def generate_feedback(llava_json_path: str | Path, output_dir: str | Path) -> No
         print(f"❌ Failed to load JSON file: {e}")
         sys.exit(1)
 
-    # Run-length compression
-    compressed: list[str] = []
-    last_desc, first_frame, last_frame = None, None, None
-
-    for frame, item in raw.items():                                                                                                                                             
-        # Flatten multi-prompt entries or use single string                                                                                                                     
-        if isinstance(item, dict):                                                                                                                                              
-            parts: list[str] = []                                                                                                                                               
-            # iterate in config order to keep consistency                                                                                                                       
-            for p in ANALYSIS_PROMPTS:                                                                                                                                          
-                key = p["name"]                                                                                                                                                 
-                if key in item and item[key]:                                                                                                                                   
-                    parts.append(f"[{key}] {item[key].strip()}")                                                                                                                
-            desc_str = "\n".join(parts)                                                                                                                                         
-        else:                                                                                                                                                                   
-            desc_str = str(item)                                                                                                                                                
-        desc = _clean(desc_str)   
-        if desc == last_desc:
-            last_frame = frame
-            continue
-        if last_desc is not None:
-            if first_frame == last_frame:
-                compressed.append(f"{first_frame}: {last_desc}")
-            else:
-                compressed.append(f"{first_frame}–{last_frame}: {last_desc}")
-        first_frame = last_frame = frame
-        last_desc = desc
-
-    if last_desc is not None:
-        if first_frame == last_frame:
-            compressed.append(f"{first_frame}: {last_desc}")
-        else:
-            compressed.append(f"{first_frame}–{last_frame}: {last_desc}")
-
-    # Adaptive chunking
-    bucket, chunks, bucket_tok = [], [], 0
-    for line in compressed:
-        t = message_tokens(line + "\n")
-        if bucket_tok + t > MAX_INPUT_TOKENS:
-            chunks.append("\n".join(bucket))
-            bucket, bucket_tok = [line], t
+    # Semantic run compression: similar consecutive captions per prompt → one ranged entry
+    frames: list[tuple[str, dict[str, str]]] = []
+    for frame, item in raw.items():
+        # multi-prompt entries in config order, or a single string
+        if isinstance(item, dict):
+            caps = {p["name"]: _clean(item[p["name"]]) for p in ANALYSIS_PROMPTS if item.get(p["name"])}
         else:
-            bucket.append(line)
-            bucket_tok += t
-    if bucket:
-        chunks.append("\n".join(bucket))
+            caps = {"description": _clean(str(item))}
+        frames.append((frame, caps))
+
+    with stage("caption compression", frames=len(frames)):
+        entries = compress_captions(frames, [p["name"] for p in ANALYSIS_PROMPTS] + ["description"])
+        compressed = [format_entry(e) for e in entries]
+    before = sum(message_tokens(f"{frame} [{p}]: {c}\n") for frame, caps in frames for p, c in caps.items())
+    after = sum(message_tokens(line + "\n") for line in compressed)
+    n_caps = sum(len(caps) for _, caps in frames)
+    print(f"🗜️  {n_caps} caption(s) → {len(compressed)} entries, {before} → {after} tokens "
+          f"({before / max(1, after):.1f}× compression)")
 
     # Process each chunk
-    partial_notes = []
     CHUNK_TEMPLATE = """
 You are an expert pre-school classroom observer.
 
@@ -148,25 +117,15 @@ OUTPUT FORMAT
 
 {context}
 """
-    for i, context in enumerate(chunks, 1):
-        prompt = CHUNK_TEMPLATE.format(context=context)
-        try:
-            resp = client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=MAX_REPLY_TOKENS,
-            )
-            partial_notes.append(resp.choices[0].message.content.strip())
-        except Exception as e:
-            print(f"❌ Error during API call: {e}")
-            sys.exit(1)
-
-        if i < len(chunks):
-            time.sleep(SLEEP_SECONDS)
-
-    # Final synthesis
-    merged_notes = "\n\n".join(partial_notes)
-    SYNTH_PROMPT = f"""
+    # Adaptive chunking: fewest calls whose template + lines fit one request's budget
+    with stage("token packing", lines=len(compressed)):
+        ceiling = chunk_ceiling(TPM_LIMIT, MAX_REPLY_TOKENS, message_tokens(CHUNK_TEMPLATE),
+                                model=OPENAI_MODEL, max_input_tokens=MAX_INPUT_TOKENS)
+        chunks = ["\n".join(bucket) for bucket in
+                  pack(compressed, ceiling, cost=lambda line: message_tokens(line + "\n"), balance=False)]
+    print(f"📦 {len(compressed)} description(s) packed into {len(chunks)} call(s)")
+
+    SYNTH_TEMPLATE = """
 You are an instructional-coaching expert.
 
 **Important:** The notes below appear in chronological order. Combine them
@@ -174,7 +133,7 @@ into ONE cohesive report, keeping the same sequence so the reader can follow
 the lesson flow.
 
 Notes to merge:
-{merged_notes}
+{notes}
 
 - Key Strengths
 - Areas for Improvement
@@ -182,11 +141,36 @@ Notes to merge:
 
 Merge duplicates, eliminate contradictions, and prioritize clarity and actionability.
 """
-    final = client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=[{"role": "user", "content": SYNTH_PROMPT}],
-        max_tokens=MAX_REPLY_TOKENS,
-    ).choices[0].message.content.strip()
+    async def map_reduce() -> str:
+        llm = AsyncLLMClient(tpm=TPM_LIMIT, estimate=message_tokens)
+        requests = [
+            {
+                "model": OPENAI_MODEL,
+                "messages": [{"role": "user", "content": CHUNK_TEMPLATE.format(context=context)}],
+                "max_tokens": MAX_REPLY_TOKENS,
+            }
+            for context in chunks
+        ]
+        # chunks run concurrently within the TPM budget; gather keeps chronological order
+        partial_notes = await llm.complete_many(
+            requests, labels=[f"chunk {i}/{len(chunks)}" for i in range(1, len(chunks) + 1)])
+
+        # Final synthesis: long lessons are first merged FAN_OUT notes at a time
+        # (tree_reduce), so the synthesis prompt never holds more than FAN_OUT notes
+        def synth_request(notes, level=None):
+            return {
+                "model": OPENAI_MODEL,
+                "messages": [{"role": "user", "content": SYNTH_TEMPLATE.format(notes="\n\n".join(notes))}],
+                "max_tokens": MAX_REPLY_TOKENS,
+            }
+        top_notes = await tree_reduce(partial_notes, synth_request, llm, fan_out=FAN_OUT)
+        return await llm.complete("synthesis", **synth_request(top_notes))
+
+    try:
+        final = asyncio.run(map_reduce())
+    except Exception as e:
+        print(f"❌ Error during API call: {e}")
+        sys.exit(1)
 
     # Save output
     Path(output_dir).mkdir(parents=True, exist_ok=True)
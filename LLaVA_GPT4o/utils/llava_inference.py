@@ -1,10 +1,23 @@
 # llava_inference.py
 # Clean, minimal version – works with LLaVA‑1.5‑7B HF.
+# (frame, prompt) pairs are grouped into padded batches and decoded together.
 
-import os, json, torch
+import os, sys, json, time, torch
+import numpy as np
+from pathlib import Path
 from PIL import Image
-from transformers import AutoProcessor, AutoModelForImageTextToText
-from config import ANALYSIS_PROMPTS, FPS
+from transformers import AutoProcessor
+from config import (
+    ANALYSIS_PROMPTS, FPS, LLAVA_BATCH_SIZE, LLAVA_MAX_NEW_TOKENS,
+    GPU_MEM_HIGH_WATERMARK, CPU_SHARED_VISION, DEDUP_ENABLED, LLAVA_BACKEND,
+)
+from frame_dedup import StreamDedup, frame_signature, load_signature, select_adaptive, select_keyframes
+from frame_extractor import prefetch, stream_frames
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))  # repo root
+from stage_cache import cache, content_digest, make_key
+from inference_backends import load_llava
+from pipeline_metrics import stage, timed
 
 # ------------------------------------------------------------------
 # 1.  Environment & model
@@ -12,21 +25,193 @@ from config import ANALYSIS_PROMPTS, FPS
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "max_split_size_mb:128"
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
-processor = AutoProcessor.from_pretrained("llava-hf/llava-1.5-7b-hf", use_fast=True)
-model = AutoModelForImageTextToText.from_pretrained(
-    "llava-hf/llava-1.5-7b-hf",
-    torch_dtype=torch.float16
-).to(device).eval()
+MODEL_ID = "llava-hf/llava-1.5-7b-hf"
+processor = AutoProcessor.from_pretrained(MODEL_ID, use_fast=True)
+processor.tokenizer.padding_side = "left"     # decoder-only → pad on the left for batched generate
+BACKEND = os.getenv("LLAVA_BACKEND", LLAVA_BACKEND)
+model = load_llava(MODEL_ID, BACKEND, device)       # fp16 on CUDA; fp32 / bf16 / int8 on CPU
+# quantised or reduced-precision weights caption slightly differently
+MODEL_KEY = MODEL_ID if BACKEND == "torch" else f"{MODEL_ID}@{BACKEND}"
+
+PAD_ID = processor.tokenizer.pad_token_id
+if PAD_ID is None:
+    PAD_ID = processor.tokenizer.eos_token_id
+IMAGE_TOKEN_ID = getattr(model.config, "image_token_id", None)
+if IMAGE_TOKEN_ID is None:
+    IMAGE_TOKEN_ID = model.config.image_token_index
 
 # ------------------------------------------------------------------
 # 2.  Helpers
 # ------------------------------------------------------------------
-def clear_gpu():
-    if torch.cuda.is_available():
-        torch.cuda.empty_cache()
-        torch.cuda.ipc_collect()
+def clear_gpu(force: bool = False):
+    """Release cached CUDA blocks, but only when the allocator is near the limit."""
+    if not torch.cuda.is_available():
+        return
+    if not force:
+        total = torch.cuda.get_device_properties(0).total_memory
+        if torch.cuda.memory_reserved() < GPU_MEM_HIGH_WATERMARK * total:
+            return
+    torch.cuda.empty_cache()
+    torch.cuda.ipc_collect()
+
+def applicable_prompts(time_min: float) -> list[dict]:
+    """ANALYSIS_PROMPTS whose [start_min, end_min) window contains <time_min>."""
+    applicable = []
+    for p in ANALYSIS_PROMPTS:
+        start = p.get("start_min", 0)
+        end = p.get("end_min", None)
+        if time_min >= start and (end is None or time_min < end):
+            applicable.append(p)
+    return applicable
+
+def preprocess_image(img: Image.Image) -> torch.Tensor:
+    """Pixel tensor for one frame – computed once and shared by every prompt."""
+    return processor.image_processor(img, return_tensors="pt")["pixel_values"][0]
+
+_prompt_ids: dict[str, torch.Tensor] = {}
+
+def encode_prompt(prompt: str, img: Image.Image) -> torch.Tensor:
+    """
+    Token ids for <prompt> with the <image> placeholder already expanded.
+    The expansion only depends on the processor's crop size, so each prompt
+    is tokenised once per run and reused for every frame.
+    """
+    ids = _prompt_ids.get(prompt)
+    if ids is None:
+        ids = processor(images=img, text=prompt, return_tensors="pt")["input_ids"][0]
+        _prompt_ids[prompt] = ids
+    return ids
+
+def _pad_left(seqs: list[torch.Tensor]) -> tuple[torch.Tensor, torch.Tensor]:
+    width = max(len(s) for s in seqs)
+    ids = torch.full((len(seqs), width), PAD_ID, dtype=torch.long)
+    mask = torch.zeros((len(seqs), width), dtype=torch.long)
+    for i, s in enumerate(seqs):
+        ids[i, width - len(s):] = s
+        mask[i, width - len(s):] = 1
+    return ids, mask
 
 @torch.no_grad()
+def generate_batch(pixels: list[torch.Tensor], prompt_ids: list[torch.Tensor]) -> list[str]:
+    """One padded generate() call over N (frame, prompt) pairs; returns only the new text."""
+    ids, mask = _pad_left(prompt_ids)
+    pixel_values = torch.stack(pixels).to(device, dtype=model.dtype)
+    out = model.generate(
+        input_ids=ids.to(device),
+        attention_mask=mask.to(device),
+        pixel_values=pixel_values,
+        max_new_tokens=LLAVA_MAX_NEW_TOKENS,
+        do_sample=False,
+        pad_token_id=PAD_ID,
+    )
+    return processor.batch_decode(out[:, ids.shape[1]:], skip_special_tokens=True)
+
+@torch.no_grad()
+def generate_shared_vision(pixel: torch.Tensor, prompt_ids: list[torch.Tensor]) -> list[str]:
+    """
+    Run the vision tower + projector once for <pixel> and splice the resulting
+    embeddings into every prompt of the batch (CPU path, where the ViT pass
+    is the dominant per-call cost).
+    """
+    feats = model.get_image_features(
+        pixel_values=pixel[None].to(device, dtype=model.dtype),
+        vision_feature_layer=model.config.vision_feature_layer,
+        vision_feature_select_strategy=model.config.vision_feature_select_strategy,
+    )
+    if isinstance(feats, (list, tuple)):
+        feats = feats[0]
+    feats = feats.reshape(-1, feats.shape[-1])
+
+    ids, mask = _pad_left(prompt_ids)
+    ids = ids.to(device)
+    embeds = model.get_input_embeddings()(ids)
+    embeds[ids == IMAGE_TOKEN_ID] = feats.repeat(len(prompt_ids), 1).to(embeds.dtype)
+    out = model.generate(
+        inputs_embeds=embeds,
+        attention_mask=mask.to(device),
+        max_new_tokens=LLAVA_MAX_NEW_TOKENS,
+        do_sample=False,
+        pad_token_id=PAD_ID,
+    )
+    # with inputs_embeds only the generated tokens are returned
+    return processor.batch_decode(out, skip_special_tokens=True)
+
+def _run_jobs(jobs: list[tuple], shared_vision: bool) -> list[str | None]:
+    """
+    Decode a batch of (key, prompt_name, pixel, prompt_ids, cache_key) jobs.  On CUDA OOM
+    the batch is halved and retried, so a too-large LLAVA_BATCH_SIZE degrades
+    to smaller calls instead of losing captions.
+    """
+    try:
+        if shared_vision:
+            return generate_shared_vision(jobs[0][2], [j[3] for j in jobs])
+        return generate_batch([j[2] for j in jobs], [j[3] for j in jobs])
+    except torch.cuda.OutOfMemoryError:
+        clear_gpu(force=True)
+        if len(jobs) == 1:
+            print(f"❌  Out of memory on {jobs[0][0]} ({jobs[0][1]}), skipped.")
+            return [None]
+        half = len(jobs) // 2
+        return _run_jobs(jobs[:half], shared_vision) + _run_jobs(jobs[half:], shared_vision)
+    except Exception as err:
+        print(f"❌  Inference failed on {sorted({j[0] for j in jobs})}: {err}")
+        return [None] * len(jobs)
+    finally:
+        clear_gpu()
+
+def caption_frames(frames, batch_size: int = LLAVA_BATCH_SIZE, shared_vision: bool | None = None):
+    """
+    Batched LLaVA engine.
+
+    <frames> yields (key, PIL image, [prompt dicts]).  Each image is
+    preprocessed once; its (frame, prompt) pairs are queued and flushed in
+    batches of <batch_size>.  Yields (key, prompt_name, caption); cache
+    hits come back immediately, the rest as their batch completes.  caption
+    is None when inference failed.
+    """
+    if shared_vision is None:
+        shared_vision = CPU_SHARED_VISION and device == "cpu"
+
+    pending: list[tuple] = []
+
+    def flush(jobs):
+        with stage("llava", pairs=len(jobs)):
+            caps = _run_jobs(jobs, shared_vision)
+        for job, cap in zip(jobs, caps):
+            cap = cap.strip() if cap else None
+            if cap:
+                cache.put_json(job[4], cap)
+            yield job[0], job[1], cap
+
+    for key, img, prompts in frames:
+        # captions from a previous run with identical pixels, prompt and settings are reused
+        img_digest = content_digest(img.tobytes())
+        misses = []
+        for p in prompts:
+            cache_key = make_key("llava", MODEL_KEY, {"prompt": p["prompt"], "max_new_tokens": LLAVA_MAX_NEW_TOKENS},
+                                 data=[img_digest])
+            cap = cache.get_json(cache_key)
+            if cap is not None:
+                yield key, p["name"], cap
+            else:
+                misses.append((p, cache_key))
+        if not misses:
+            continue
+        pixel = preprocess_image(img)
+        jobs = [(key, p["name"], pixel, encode_prompt(p["prompt"], img), cache_key) for p, cache_key in misses]
+        if shared_vision:
+            # one vision pass per frame; prompts of the frame form the batch
+            for i in range(0, len(jobs), batch_size):
+                yield from flush(jobs[i:i + batch_size])
+            continue
+        pending.extend(jobs)
+        while len(pending) >= batch_size:
+            yield from flush(pending[:batch_size])
+            pending = pending[batch_size:]
+
+    if pending:
+        yield from flush(pending)
+
 def infer_frame(img_path: str, prompt: str) -> str | None:
     """
     Run LLaVA on a single image file and return the decoded caption,
@@ -37,88 +222,231 @@ def infer_frame(img_path: str, prompt: str) -> str | None:
     except Exception as err:
         print(f"❌  Corrupted image skipped: {img_path} ({err})")
         return None
-
-    batch = processor(images=img, text=prompt, return_tensors="pt").to(device)
-
-    try:
-        out = model.generate(**batch, max_new_tokens=90)
-        caption = processor.batch_decode(out, skip_special_tokens=True)[0]
-        return caption
-    except Exception as err:
-        print(f"❌  Inference failed on {os.path.basename(img_path)}: {err}")
-        return None
-    finally:
-        clear_gpu()
+    frames = [(img_path, img, [{"name": "caption", "prompt": prompt}])]
+    for _, _, cap in caption_frames(frames, batch_size=1):
+        return cap
+    return None
 
 # ------------------------------------------------------------------
 # 3.  Loop over frame folder
 # ------------------------------------------------------------------
-def run_llava_on_frames(frame_dir: str, output_dir: str) -> str:
-    """                                                                                                                                                                         
-    Run LLaVA inference with multiple prompts based on time windows.                                                                                                            
-    Outputs a JSON mapping each frame to a dict containing:                                                                                                                     
-      - time_s: time in seconds                                                                                                                                                 
-      - time_min: time in minutes                                                                                                                                               
-      - <prompt_name>: caption string for each applicable prompt                                                                                                                
-    """                                                                                                                                                                         
-    os.makedirs(output_dir, exist_ok=True)                                                                                                                                      
-    results = {}                                                                                                                                                                
-                                                                                                                                                                                
-    for fname in sorted(os.listdir(frame_dir)):                                                                                                                                 
-        if not fname.lower().endswith(".jpg"):                                                                                                                                  
-            continue                                                                                                                                                            
-        fpath = os.path.join(frame_dir, fname)                                                                                                                                  
-                                                                                                                                                                                
-        # Parse frame index from filename, e.g. 'frame_0012.jpg' -> 12                                                                                                          
-        try:                                                                                                                                                                    
-            base = os.path.splitext(fname)[0]                                                                                                                                   
-            idx = int(base.split('_')[-1])                                                                                                                                      
-        except Exception:                                                                                                                                                       
-            print(f"⚠️  Cannot parse frame index from '{fname}', skipping.")                                                                                                    
-            continue                                                                                                                                                            
-                                                                                                                                                                                
-        # Compute time in seconds and minutes                                                                                                                                   
-        time_s = idx / FPS                                                                                                                                                      
-        time_min = time_s / 60.0                                                                                                                                                
-                                                                                                                                                                                
-        entry: dict[str, object] = {                                                                                                                                            
-            "time_s": time_s,                                                                                                                                                   
-            "time_min": time_min,                                                                                                                                               
-        }                                                                                                                                                                       
-                                                                                                                                                                                
-        # Determine which prompts apply for this frame                                                                                                                          
-        applicable = []                                                                                                                                                         
-        for p in ANALYSIS_PROMPTS:                                                                                                                                              
-            start = p.get("start_min", 0)                                                                                                                                       
-            end = p.get("end_min", None)                                                                                                                                        
-            if time_min >= start and (end is None or time_min < end):                                                                                                           
-                applicable.append(p)                                                                                                                                            
-                                                                                                                                                                                
-        if not applicable:                                                                                                                                                      
-            print(f"🖼️  No prompts for {fname} at {time_s:.1f}s.")                                                                                                             
-            results[fname] = entry                                                                                                                                              
-            continue                                                                                                                                                            
-                                                                                                                                                                                
-        names = [p["name"] for p in applicable]                                                                                                                                 
-        print(f"🖼️  Inferring {fname} at {time_s:.1f}s for prompts: {names}")                                                                                                  
-                                                                                                                                                                                
-        # Run inference for each prompt
-        for p in applicable:
-            cap = infer_frame(fpath, p["prompt"])
-            if not cap:
+def _list_frames(frame_dir: str, fps: float) -> list[tuple[str, str, float]]:
+    """(fname, path, time_s) for every frame_XXXX.jpg in <frame_dir>, in order."""
+    frames = []
+    for fname in sorted(os.listdir(frame_dir)):
+        if not fname.lower().endswith(".jpg"):
+            continue
+        fpath = os.path.join(frame_dir, fname)
+
+        # Parse frame index from filename, e.g. 'frame_0012.jpg' -> 12
+        try:
+            base = os.path.splitext(fname)[0]
+            idx = int(base.split('_')[-1])
+        except Exception:
+            print(f"⚠️  Cannot parse frame index from '{fname}', skipping.")
+            continue
+        frames.append((fname, fpath, idx / fps))
+    return frames
+
+def _prompt_groups(times) -> list[int]:
+    """Integer id of the applicable-prompt set at each time (dedup never crosses a change)."""
+    ids: dict[tuple, int] = {}
+    return [ids.setdefault(tuple(p["name"] for p in applicable_prompts(t / 60.0)), len(ids)) for t in times]
+
+def _dedup_frames(frames, adaptive: bool, dedup: bool):
+    """
+    Returns (frames, rep) where rep[i] is the index of the frame whose
+    captions frame i reuses.  With <adaptive>, densely decoded frames are
+    first thinned to the 1/FPS baseline plus scene changes.
+    """
+    sigs, kept = [], []
+    for f in frames:
+        sig = load_signature(f[1])
+        if sig is not None:
+            sigs.append(sig)
+            kept.append(f)
+    frames = kept
+    if not frames:
+        return frames, np.arange(0)
+    sigs = np.stack(sigs)
+    times = np.array([f[2] for f in frames])
+
+    if adaptive:
+        idx = select_adaptive(times, sigs, base_interval=1.0 / FPS)
+        print(f"🎯  Adaptive sampling kept {len(idx)} of {len(frames)} decoded frames")
+        frames = [frames[i] for i in idx]
+        sigs, times = sigs[idx], times[idx]
+
+    if not dedup:
+        return frames, np.arange(len(frames))
+    rep = select_keyframes(times, sigs, groups=_prompt_groups(times))
+    n_keys = int((rep == np.arange(len(rep))).sum())
+    print(f"🧹  Dedup: captioning {n_keys} of {len(frames)} frames")
+    return frames, rep
+
+def _iter_images(frames):
+    """Yield (fname, image, prompts) for every readable frame that has applicable prompts."""
+    for fname, fpath, time_s in frames:
+        applicable = applicable_prompts(time_s / 60.0)
+        if not applicable:
+            print(f"🖼️  No prompts for {fname} at {time_s:.1f}s.")
+            continue
+
+        try:
+            img = Image.open(fpath).convert("RGB")
+        except Exception as err:
+            print(f"❌  Corrupted image skipped: {fpath} ({err})")
+            continue
+
+        names = [p["name"] for p in applicable]
+        print(f"🖼️  Queued {fname} at {time_s:.1f}s for prompts: {names}")
+        yield fname, img, applicable
+
+def _carry_forward(frames, rep, results: dict, start: int = 0) -> None:
+    """Copy keyframe captions onto their near-duplicates (dup_of) and record each keyframe's span."""
+    for i in range(start, len(frames)):
+        fname, _, time_s = frames[i]
+        if rep[i] == i:
+            continue
+        key_name = frames[rep[i]][0]
+        key_entry = results[key_name]
+        for p in applicable_prompts(time_s / 60.0):
+            if p["name"] in key_entry:
+                results[fname][p["name"]] = key_entry[p["name"]]
+        results[fname]["dup_of"] = key_name
+        key_entry["span_s"] = [key_entry["time_s"], time_s]
+
+def _caption_into(results: dict, frames_iter, batch_size: int, shared_vision: bool | None) -> None:
+    t0 = time.time()
+    n_frames, n_captions = set(), 0
+    for fname, name, cap in caption_frames(frames_iter, batch_size, shared_vision):
+        n_frames.add(fname)
+        if not cap:
+            continue
+        results[fname][name] = cap
+        n_captions += 1
+    dt = max(time.time() - t0, 1e-9)
+    print(f"⚡  {len(n_frames)} frames / {n_captions} captions in {dt:.1f}s "
+          f"({len(n_frames) / dt:.2f} frames/s, batch_size={batch_size})")
+
+def _save_results(results: dict, output_dir: str) -> str:
+    # Save all results as JSON
+    out_json = os.path.join(output_dir, "llava_responses.json")
+    with open(out_json, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅  Inference completed. Captions saved to {out_json}")
+    return out_json
+
+def run_llava_on_frames(frame_dir: str, output_dir: str,
+                        batch_size: int = LLAVA_BATCH_SIZE,
+                        shared_vision: bool | None = None,
+                        fps: float = FPS,
+                        dedup: bool = DEDUP_ENABLED,
+                        adaptive: bool = False) -> str:
+    """
+    Run LLaVA inference with multiple prompts based on time windows.
+    Outputs a JSON mapping each frame to a dict containing:
+      - time_s: time in seconds
+      - time_min: time in minutes
+      - <prompt_name>: caption string for each applicable prompt
+    With dedup, near-duplicate frames are not captioned; they reuse the
+    captions of their keyframe and carry "dup_of": <keyframe name>, while the
+    keyframe gets "span_s": [first, last] seconds it stands for.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    frames = _list_frames(frame_dir, fps)
+    if dedup or adaptive:
+        frames, rep = _dedup_frames(frames, adaptive, dedup)
+    else:
+        rep = np.arange(len(frames))
+
+    results: dict[str, dict] = {}
+    for fname, _, time_s in frames:
+        results[fname] = {
+            "time_s": time_s,
+            "time_min": time_s / 60.0,
+        }
+
+    keyframes = [f for i, f in enumerate(frames) if rep[i] == i]
+    _caption_into(results, _iter_images(keyframes), batch_size, shared_vision)
+    _carry_forward(frames, rep, results)
+    return _save_results(results, output_dir)
+
+class StreamCaptioner:
+    """
+    Online captioning state for frames that arrive as (name, time_s, RGB
+    array): dedup / adaptive sampling via StreamDedup, batched captioning and
+    carry-forward onto duplicates.  feed() can be called repeatedly (one call
+    per live window); keyframes carry over between calls.
+    """
+
+    def __init__(self, batch_size: int = LLAVA_BATCH_SIZE, shared_vision: bool | None = None,
+                 dedup: bool = DEDUP_ENABLED, adaptive: bool = False):
+        self.batch_size = batch_size
+        self.shared_vision = shared_vision
+        self.online = StreamDedup(1.0 / FPS, adaptive=adaptive, dedup=dedup) if (dedup or adaptive) else None
+        self.frames: list[tuple] = []
+        self.rep: list[int] = []
+        self.results: dict[str, dict] = {}
+        self._groups: dict[tuple, int] = {}
+        self._key = -1
+
+    def _keyframes(self, source):
+        for fname, time_s, arr in source:
+            img = Image.fromarray(arr)
+            applicable = applicable_prompts(time_s / 60.0)
+            is_key = True
+            if self.online is not None:
+                group = self._groups.setdefault(tuple(p["name"] for p in applicable), len(self._groups))
+                sampled, is_key = self.online.observe(time_s, frame_signature(img), group)
+                if not sampled:
+                    continue
+            i = len(self.frames)
+            self.frames.append((fname, None, time_s))
+            self.results[fname] = {"time_s": time_s, "time_min": time_s / 60.0}
+            if is_key:
+                self._key = i
+            self.rep.append(self._key)
+            if not is_key:
                 continue
-            # Extract only the model's response, stripping any echoed prompt
-            if "\n\n" in cap:
-                response = cap.split("\n\n", 1)[1].strip()
-            else:
-                response = cap.strip()
-            entry[p["name"]] = response
-                                                                                                                                                                                
-        results[fname] = entry                                                                                                                                                  
-                                                                                                                                                                                
-    # Save all results as JSON                                                                                                                                                  
-    out_json = os.path.join(output_dir, "llava_responses.json")                                                                                                                 
-    with open(out_json, "w") as f:                                                                                                                                              
-        json.dump(results, f, indent=2)                                                                                                                                         
-    print(f"✅  Inference completed. Captions saved to {out_json}")                                                                                                              
-    return out_json  
+            if not applicable:
+                print(f"🖼️  No prompts for {fname} at {time_s:.1f}s.")
+                continue
+            print(f"🖼️  Queued {fname} at {time_s:.1f}s for prompts: {[p['name'] for p in applicable]}")
+            yield fname, img, applicable
+
+    def feed(self, source) -> list[str]:
+        """Caption the frames of <source>; returns the names of the frames it added."""
+        start = len(self.frames)
+        _caption_into(self.results, self._keyframes(source), self.batch_size, self.shared_vision)
+        _carry_forward(self.frames, self.rep, self.results, start)
+        return [f[0] for f in self.frames[start:]]
+
+    def summary(self) -> str:
+        n_keys = sum(1 for i, r in enumerate(self.rep) if r == i)
+        return f"captioned {n_keys} of {len(self.frames)} frames"
+
+def run_llava_on_video(video_path: str, output_dir: str,
+                       batch_size: int = LLAVA_BATCH_SIZE,
+                       shared_vision: bool | None = None,
+                       fps: float = FPS,
+                       dedup: bool = DEDUP_ENABLED,
+                       adaptive: bool = False,
+                       save_frames: bool = False) -> str:
+    """
+    Same output as run_llava_on_frames, but frames are piped out of ffmpeg as
+    RGB arrays at FRAME_SIZE and handed to the batched engine through a
+    bounded queue, so decoding overlaps inference and nothing touches disk
+    unless <save_frames> also writes the JPEGs to <output_dir>/frames.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    frame_dir = None
+    if save_frames:
+        frame_dir = os.path.join(output_dir, "frames")
+        os.makedirs(frame_dir, exist_ok=True)
+
+    captioner = StreamCaptioner(batch_size, shared_vision, dedup=dedup, adaptive=adaptive)
+    captioner.feed(prefetch(timed(stream_frames(video_path, fps=fps, save_dir=frame_dir), "frame extraction")))
+    if captioner.online is not None:
+        print(f"🧹  Dedup: {captioner.summary()}")
+    return _save_results(captioner.results, output_dir)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Run the audio and visual pipelines over many videos with each model loaded once.
+
+Every entry point still works on its own, but loading Whisper large-v3,
+LLaVA-1.5-7B or Demucs per process costs more than a short session takes to
+process.  This runner imports each selected pipeline a single time (which
+loads its weights), then schedules every video through every stage: each
+stage has its own worker pool, so one video's audio runs while another's
+frames are being captioned.  Outputs land where the individual scripts put
+them:
+
+  whisper      → whisperlarge_v3/outputs/<name>_transcription.json
+  demucs       → demucs_whisper/outputs/<name>_transcript.txt, _feedback.json
+  llava        → LLaVA_GPT4o/outputs/<name>/llava_responses.json, final_feedback.txt
+  whisper_base → outputs/<name>_analysis.txt
+
+Usage:
+  python batch_runner.py path/to/videos/                    # every video in the folder
+  python batch_runner.py manifest.txt --stages whisper,llava
+  python batch_runner.py manifest.json --report batch_report.json
+
+A manifest is a text file with one video path per line (# for comments) or a
+JSON list of paths; relative paths are resolved against the manifest's folder.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from pipeline_metrics import add_cli_args, metrics
+
+ROOT = Path(__file__).resolve().parent
+VIDEO_EXTS = (".mp4", ".mov", ".mkv", ".avi", ".m4v")
+
+# top-level module names that mean something different in every pipeline folder
+_CLASHING = ("main", "utils", "config")
+
+
+def load_module(name: str, path: Path, search_paths=()):
+    """
+    Import <path> as <name>, with <search_paths> first on sys.path while it
+    executes so its own `import utils` / `import config` resolve locally.
+    """
+    saved = {k: sys.modules.pop(k) for k in _CLASHING if k in sys.modules}
+    added = [str(p) for p in search_paths]
+    sys.path[:0] = added
+    try:
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    finally:
+        for k in _CLASHING:
+            sys.modules.pop(k, None)
+        sys.modules.update(saved)
+        for p in added:
+            sys.path.remove(p)
+    return module
+
+
+# ---------- stages ----------
+def _load_whisper(args):
+    mod = load_module("whisperlarge_v3_main", ROOT / "whisperlarge_v3" / "main.py")
+    mod.get_recognizer()
+    return mod
+
+
+def _run_whisper(mod, video, args):
+    return mod.run(video, output_dir=str(ROOT / "whisperlarge_v3" / "outputs"),
+                   batched=True, batch_size=args.batch_size, timestamps=args.timestamps,
+                   chunk_sec=args.chunk_sec, overlap_sec=args.overlap_sec)
+
+
+def _load_demucs(args):
+    folder = ROOT / "demucs_whisper"
+    mod = load_module("demucs_whisper_main", folder / "main.py", [folder])
+    mod.load_demucs()
+    mod.get_whisper()
+    return mod
+
+
+def _run_demucs(mod, video, args):
+    return mod.main(video, args.chunk_len, stream=True)
+
+
+def _load_llava(args):
+    folder = ROOT / "LLaVA_GPT4o"
+    return load_module("llava_gpt4o_main", folder / "main.py", [folder, folder / "utils"])
+
+
+def _run_llava(mod, video, args):
+    return mod.main(video, adaptive=args.adaptive, output_root=str(ROOT / "LLaVA_GPT4o" / "outputs"))
+
+
+def _load_whisper_base(args):
+    mod = load_module("whisperaudio_chunk_transcribe_analyze", ROOT / "whisperaudio_chunk_transcribe_analyze.py")
+    mod.get_model()
+    return mod
+
+
+def _run_whisper_base(mod, video, args):
+    transcript, analysis = mod.run(video)
+    out = ROOT / "outputs" / f"{Path(video).stem}_analysis.txt"
+    out.parent.mkdir(exist_ok=True)
+    out.write_text(f"--- FULL TRANSCRIPTION ---\n\n{transcript}\n\n"
+                   f"--- TEACHER PERFORMANCE ANALYSIS ---\n\n{analysis}\n")
+    return str(out)
+
+
+STAGES = {
+    "whisper": (_load_whisper, _run_whisper),
+    "demucs": (_load_demucs, _run_demucs),
+    "llava": (_load_llava, _run_llava),
+    "whisper_base": (_load_whisper_base, _run_whisper_base),
+}
+
+
+# ---------- inputs ----------
+def collect_videos(source: str) -> list[str]:
+    """Videos in a folder, or listed in a .txt / .json manifest."""
+    path = Path(source)
+    if path.is_dir():
+        return sorted(str(p) for p in path.iterdir() if p.suffix.lower() in VIDEO_EXTS)
+    if path.suffix.lower() == ".json":
+        entries = json.loads(path.read_text())
+    else:
+        entries = [line.strip() for line in path.read_text().splitlines()]
+        entries = [e for e in entries if e and not e.startswith("#")]
+    return [str(p if p.is_absolute() else path.parent / p) for p in map(Path, entries)]
+
+
+# ---------- scheduling ----------
+def run_batch(videos, stages, args) -> list[dict]:
+    models = {}
+    for name in stages:
+        t0 = time.time()
+        print(f"🚀 Loading {name} …")
+        models[name] = STAGES[name][0](args)
+        print(f"✅ {name} ready in {time.time() - t0:.1f}s")
+
+    def job(name, video):
+        t0 = time.time()
+        print(f"▶️  {name}: {Path(video).name}")
+        try:
+            out = STAGES[name][1](models[name], video, args)
+            status = "ok"
+        except Exception as err:
+            traceback.print_exc()
+            out, status = None, f"failed: {err!r}"
+        dt = time.time() - t0
+        print(f"{'✅' if status == 'ok' else '❌'} {name}: {Path(video).name} ({dt:.1f}s)")
+        return {"video": video, "stage": name, "status": status, "seconds": round(dt, 1),
+                "output": out if isinstance(out, (str, type(None))) else [str(o) for o in out]}
+
+    pools = {name: ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix=name) for name in stages}
+    try:
+        futures = [pools[name].submit(job, name, video) for video in videos for name in stages]
+        return [f.result() for f in futures]
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process many videos with each model loaded once")
+    parser.add_argument("source", help="Folder of videos, or a .txt / .json manifest")
+    parser.add_argument("--stages", default="whisper,llava",
+                        help=f"Comma-separated stages from {', '.join(STAGES)} (default: whisper,llava)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Concurrent videos per stage (default: 1; models are shared between workers)")
+    parser.add_argument("--batch-size", type=int, default=8, help="whisper: windows per forward pass")
+    parser.add_argument("--timestamps", choices=["none", "segment", "word"], default="none",
+                        help="whisper: also emit segment- or word-level timestamps")
+    parser.add_argument("--chunk-sec", type=float, default=10, help="whisper: window length in seconds")
+    parser.add_argument("--overlap-sec", type=float, default=0.0,
+                        help="whisper: seconds shared by neighbouring windows, stitched word by word")
+    parser.add_argument("--chunk-len", type=int, default=60, help="demucs: window length in seconds")
+    parser.add_argument("--adaptive", action="store_true", help="llava: denser sampling around scene changes")
+    parser.add_argument("--report", help="Write per-video, per-stage status and timings to this JSON file")
+    add_cli_args(parser)
+    args = parser.parse_args()
+    metrics.configure(args.metrics, args.metrics_port)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+    videos = collect_videos(args.source)
+    missing = [v for v in videos if not os.path.isfile(v)]
+    if missing:
+        parser.error(f"not found: {', '.join(missing)}")
+    if not videos:
+        parser.error(f"no videos in {args.source}")
+
+    print(f"🎬 {len(videos)} video(s) × {len(stages)} stage(s): {', '.join(stages)}")
+    t0 = time.time()
+    results = run_batch(videos, stages, args)
+    failed = [r for r in results if r["status"] != "ok"]
+    print(f"\n🏁 {len(results) - len(failed)}/{len(results)} jobs succeeded in {time.time() - t0:.0f}s")
+    for r in failed:
+        print(f"   ❌ {r['stage']}: {r['video']} — {r['status']}")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"📝 Report saved → {args.report}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Compare inference backends (inference_backends.py) on one recording.
+
+For every requested backend the script times the same workload and reports:
+
+  whisper / hf_asr   real-time factor (compute seconds / audio seconds) and
+                     word error rate against the first backend's transcript
+                     (or against --reference, a plain-text transcript)
+  llava              seconds per (frame, prompt) caption and caption drift,
+                     the word error rate of each caption against the first
+                     backend's caption for the same frame
+
+Model load time is reported separately and not counted in RTF.  Results are
+printed as a table and written to --out as JSON.
+
+Usage:
+  python bench_backends.py lesson.mp4 --whisper torch torch-int8 ctranslate2 --seconds 120
+  python bench_backends.py lesson.mp4 --hf-asr hf hf-int8 onnx --threads 8
+  python bench_backends.py lesson.mp4 --llava torch torch-bf16 torch-int8 --frames 8
+"""
+import argparse
+import gc
+import json
+import re
+import subprocess
+import time
+from pathlib import Path
+
+import numpy as np
+
+import inference_backends as ib
+
+SR = 16000
+LLAVA_MODEL = "llava-hf/llava-1.5-7b-hf"
+LLAVA_PROMPT = "USER: <image>\nDescribe what the teacher and the children are doing. ASSISTANT:"
+FRAME_SIZE = (336, 336)
+
+
+def load_audio(video_path, seconds):
+    cmd = ["ffmpeg", "-loglevel", "error", "-i", video_path, "-t", str(seconds),
+           "-vn", "-ac", "1", "-ar", str(SR), "-f", "f32le", "pipe:1"]
+    return np.frombuffer(subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout, dtype=np.float32)
+
+
+def load_frames(video_path, n, every):
+    """<n> RGB frames, one every <every> seconds, at LLaVA's input size."""
+    w, h = FRAME_SIZE
+    cmd = ["ffmpeg", "-loglevel", "error", "-i", video_path, "-vf",
+           f"fps=1/{every},scale={w}:{h}:force_original_aspect_ratio=increase,crop={w}:{h}",
+           "-frames:v", str(n), "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+    raw = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+    return list(np.frombuffer(raw, dtype=np.uint8).reshape(-1, h, w, 3))
+
+
+def _words(text):
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+def wer(reference: str, hypothesis: str) -> float:
+    """Word error rate: word-level edit distance / reference length."""
+    ref, hyp = _words(reference), _words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h))
+        prev = cur
+    return prev[-1] / len(ref)
+
+
+def _free():
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+# ---------- workloads ----------
+def bench_whisper(backend, audio, device, threads):
+    t0 = time.perf_counter()
+    model = ib.load_whisper("large-v3", backend, device, threads)
+    load_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    text = model.transcribe(audio, fp16=ib.whisper_fp16(device), language="en")["text"].strip()
+    return {"load_s": load_s, "compute_s": time.perf_counter() - t0, "text": text}
+
+
+def bench_hf_asr(backend, audio, device, threads):
+    t0 = time.perf_counter()
+    asr = ib.load_hf_asr("openai/whisper-large-v3", backend, 0 if device == "cuda" else -1, threads)
+    load_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    out = asr({"raw": audio, "sampling_rate": SR}, chunk_length_s=30, batch_size=8)
+    return {"load_s": load_s, "compute_s": time.perf_counter() - t0, "text": out["text"].strip()}
+
+
+def bench_llava(backend, frames, device, threads, max_new_tokens):
+    import torch
+    from transformers import AutoProcessor
+    processor = AutoProcessor.from_pretrained(LLAVA_MODEL, use_fast=True)
+    t0 = time.perf_counter()
+    model = ib.load_llava(LLAVA_MODEL, backend, device, threads)
+    load_s = time.perf_counter() - t0
+    captions = []
+    t0 = time.perf_counter()
+    for frame in frames:
+        inputs = processor(images=frame, text=LLAVA_PROMPT, return_tensors="pt").to(device)
+        inputs["pixel_values"] = inputs["pixel_values"].to(model.dtype)
+        with torch.inference_mode():
+            ids = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False)
+        captions.append(processor.decode(ids[0, inputs["input_ids"].shape[1]:], skip_special_tokens=True).strip())
+    return {"load_s": load_s, "compute_s": time.perf_counter() - t0, "captions": captions}
+
+
+# ---------- main ----------
+def main():
+    parser = argparse.ArgumentParser(description="Real-time factor and accuracy drift per inference backend")
+    parser.add_argument("video_path")
+    parser.add_argument("--whisper", nargs="*", choices=ib.WHISPER_BACKENDS, default=[],
+                        help="openai-whisper backends (first one is the accuracy baseline)")
+    parser.add_argument("--hf-asr", nargs="*", choices=ib.HF_ASR_BACKENDS, default=[],
+                        help="HF pipeline backends (first one is the accuracy baseline)")
+    parser.add_argument("--llava", nargs="*", choices=ib.LLAVA_BACKENDS, default=[],
+                        help="LLaVA backends (first one is the caption baseline)")
+    parser.add_argument("--seconds", type=float, default=60, help="Audio to transcribe (default: 60)")
+    parser.add_argument("--frames", type=int, default=4, help="Frames to caption (default: 4)")
+    parser.add_argument("--frame-every", type=float, default=10, help="Seconds between frames (default: 10)")
+    parser.add_argument("--max-new-tokens", type=int, default=90)
+    parser.add_argument("--reference", help="Plain-text reference transcript for WER (default: first backend)")
+    parser.add_argument("--device", choices=["cpu", "cuda"], help="Default: cuda when available")
+    parser.add_argument("--threads", type=int, help="Intra-op CPU threads")
+    parser.add_argument("--out", default="backend_bench.json")
+    args = parser.parse_args()
+
+    device = args.device or ib.default_device()
+    reference = Path(args.reference).read_text() if args.reference else None
+    rows = []
+
+    if args.whisper or args.hf_asr:
+        audio = load_audio(args.video_path, args.seconds)
+        audio_s = len(audio) / SR
+        print(f"🎧 {audio_s:.1f}s of audio on {device}")
+        for family, backends, fn in (("whisper", args.whisper, bench_whisper),
+                                     ("hf_asr", args.hf_asr, bench_hf_asr)):
+            baseline = reference
+            for backend in backends:
+                r = fn(backend, audio, device, args.threads)
+                baseline = r["text"] if baseline is None else baseline
+                rows.append({"family": family, "backend": backend, "load_s": round(r["load_s"], 2),
+                             "rtf": round(r["compute_s"] / audio_s, 3),
+                             "wer": round(wer(baseline, r["text"]), 4), "text": r["text"]})
+                print(f"⏱️  {family}/{backend}: RTF {rows[-1]['rtf']}, WER {rows[-1]['wer']}")
+                _free()
+
+    if args.llava:
+        frames = load_frames(args.video_path, args.frames, args.frame_every)
+        print(f"🖼️  {len(frames)} frame(s) on {device}")
+        baseline = None
+        for backend in args.llava:
+            r = bench_llava(backend, frames, device, args.threads, args.max_new_tokens)
+            baseline = baseline or r["captions"]
+            drift = [wer(b, c) for b, c in zip(baseline, r["captions"])]
+            rows.append({"family": "llava", "backend": backend, "load_s": round(r["load_s"], 2),
+                         "s_per_caption": round(r["compute_s"] / max(1, len(frames)), 2),
+                         "caption_drift": round(float(np.mean(drift)) if drift else 0.0, 4),
+                         "captions": r["captions"]})
+            print(f"⏱️  llava/{backend}: {rows[-1]['s_per_caption']}s/caption, drift {rows[-1]['caption_drift']}")
+            _free()
+
+    if not rows:
+        parser.error("pick at least one of --whisper / --hf-asr / --llava")
+
+    print(f"\n{'family':<8} {'backend':<12} {'load s':>7} {'RTF':>7} {'WER':>7} {'s/cap':>7} {'drift':>7}")
+    for r in rows:
+        print(f"{r['family']:<8} {r['backend']:<12} {r['load_s']:>7} {r.get('rtf', '-'):>7} "
+              f"{r.get('wer', '-'):>7} {r.get('s_per_caption', '-'):>7} {r.get('caption_drift', '-'):>7}")
+    Path(args.out).write_text(json.dumps({"device": device, "threads": args.threads, "results": rows}, indent=2))
+    print(f"📝 Results → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,33 +2,67 @@
 import os
 import sys
 import json
+import asyncio
 import argparse
-from openai import OpenAI
+
+from llm_client import AsyncLLMClient, TPM_LIMIT, RPM_LIMIT
+from pipeline_metrics import stage
+from timeline import MODES, align
+from timeline_store import FRAME_METADATA_KEYS, Timeline, is_store, llava_json, transcript_json
+from token_budget import chunk_ceiling, message_tokens, pack
+from tree_reduce import FAN_OUT, tree_reduce
 
 def load_audio_transcript(path):
+    """Timed segments from a transcript JSON or a timeline store (timeline_store.py)."""
+    if is_store(path):
+        return transcript_json(Timeline.open(path))
     with open(path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
 def load_image_captions(path):
-    with open(path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    image_map = {}
-    for val in data.values():
-        key = round(val.get("time_s", 0.0), 3)
-        image_map[key] = {k: v for k, v in val.items() if k not in ("time_s", "time_min")}
-    return image_map
-
-def combine_transcript(audio_data, image_map):
+    """Frame records [{"frame", "time_s", "captions"}] from a llava_responses.json or a timeline store, in time order."""
+    if is_store(path):
+        data = llava_json(Timeline.open(path))
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    frames = []
+    for name, val in data.items():
+        frames.append({
+            "frame": name,
+            "time_s": float(val.get("time_s", 0.0)),
+            "captions": {k: v for k, v in val.items() if k not in FRAME_METADATA_KEYS},
+        })
+    frames.sort(key=lambda fr: fr["time_s"])
+    return frames
+
+def teacher_segments(audio_data):
+    """Only the segments diarize.tag_segments() attributed to the teacher."""
+    if not any("teacher" in seg for seg in audio_data):
+        raise ValueError("transcript has no speaker tags; run diarize.py on it first")
+    return [seg for seg in audio_data if seg.get("teacher")]
+
+def combine_transcript(audio_data, frames, mode="overlap", window=None):
+    """
+    Attach to every audio segment all frames aligned with it (see timeline.align):
+    "images" lists them in time order, "image" keeps the first one's captions
+    for readers of the old single-frame format.
+    """
+    matches = align(audio_data, frames, mode=mode, window=window)
     combined = []
-    for entry in audio_data:
-        start_key = round(entry.get("start", 0.0), 3)
+    for entry, matched in zip(audio_data, matches):
         combined_entry = {
             "start": entry.get("start"),
             "end": entry.get("end"),
             "transcript": entry.get("text", "").strip()
         }
-        image_entry = image_map.get(start_key, {})
-        combined_entry["image"] = image_entry
+        if "speaker" in entry:
+            combined_entry["speaker"] = entry["speaker"]
+            combined_entry["teacher"] = entry.get("teacher", False)
+        combined_entry["image"] = matched[0]["captions"] if matched else {}
+        combined_entry["images"] = [
+            {"frame": fr["frame"], "time_s": fr["time_s"], **fr["captions"]} for fr in matched
+        ]
         combined.append(combined_entry)
     return combined
 
@@ -39,88 +73,153 @@ def transcript_to_plaintext(chunk):
             f"Segment {idx}: {seg.get('start', 0.0)}s to {seg.get('end', 0.0)}s",
             f"Transcript: {seg.get('transcript', '')}"
         ]
-        image = seg.get("image", {})
-        if image:
-            part_lines.append("Image Analysis:")
-            for k, v in image.items():
+        if seg.get("speaker"):
+            part_lines[1] = f"Transcript ({'teacher' if seg.get('teacher') else 'other speaker'}): {seg['transcript']}"
+        images = seg.get("images")
+        if images is None:
+            images = [seg["image"]] if seg.get("image") else []
+        last = None
+        for image in images:
+            captions = {k: v for k, v in image.items() if k not in ("frame", "time_s")}
+            if not captions or captions == last:      # near-duplicate frames share captions
+                continue
+            last = captions
+            at = f" at {image['time_s']:g}s" if "time_s" in image else ""
+            part_lines.append(f"Image Analysis{at}:")
+            for k, v in captions.items():
                 part_lines.append(f"- {k.replace('_', ' ').capitalize()}: {v}")
         parts.append("\n".join(part_lines))
     return "\n\n".join(parts)
 
-def summarize_chunk(chunk, client, model):
+SUMMARY_SYSTEM = "You are an expert preschool education evaluator. Summarize the following transcript chunk. Focus on classroom setup, child engagement, prop usage, body language, and teacher communication. Provide a concise summary."
+SUMMARY_REPLY_TOKENS = 1024
+FEEDBACK_SYSTEM = "You are a knowledgeable preschool education evaluator."
+FEEDBACK_TEMPLATE = (
+    "Below is the summarized combined transcript of a preschool storytelling class:\n\n"
+    "{summary}\n\n"
+    "Based on this, provide comprehensive, actionable feedback focusing on classroom setup, "
+    "child engagement, prop usage, body language, and teacher communication."
+)
+FEEDBACK_REPLY_TOKENS = 2048
+
+def summarize_chunk_request(chunk, model):
     content = transcript_to_plaintext(chunk)
     messages = [
-        {"role": "system", "content": "You are an expert preschool education evaluator. Summarize the following transcript chunk. Focus on classroom setup, child engagement, prop usage, body language, and teacher communication. Provide a concise summary."},
+        {"role": "system", "content": SUMMARY_SYSTEM},
         {"role": "user", "content": content}
     ]
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=0.7
-    )
-    return response.choices[0].message.content.strip()
+    return {"model": model, "messages": messages, "temperature": 0.7, "max_tokens": SUMMARY_REPLY_TOKENS}
+
+@stage("token packing")
+def pack_segments(combined, args):
+    """
+    Fewest map calls whose segments fit one request's token ceiling (TPM tier,
+    reply budget and --max_input_tokens); --chunk_size optionally caps the
+    segment count per call.
+    """
+    model = args.summary_model
+    ceiling = chunk_ceiling(args.tpm, SUMMARY_REPLY_TOKENS, message_tokens(SUMMARY_SYSTEM, model),
+                            model=model, max_input_tokens=args.max_input_tokens)
+    cost = lambda seg: message_tokens(transcript_to_plaintext([seg]) + "\n\n", model)
+    # unbalanced greedy packing keeps earlier chunks (and their cached summaries) stable as a session grows
+    return pack(combined, ceiling, cost=cost, max_items=args.chunk_size, balance=False)
 
-def generate_feedback(summary, client, model):
+MERGE_SYSTEM = "You are an expert preschool education evaluator. The summaries below cover consecutive parts of one class, in chronological order. Merge them into one concise chronological summary that keeps the observations on classroom setup, child engagement, prop usage, body language, and teacher communication."
+
+def merge_summaries_request(model):
+    def request(texts, level):
+        content = "\n\n".join(f"Part {i}:\n{t}" for i, t in enumerate(texts, 1))
+        messages = [
+            {"role": "system", "content": MERGE_SYSTEM},
+            {"role": "user", "content": content}
+        ]
+        return {"model": model, "messages": messages, "temperature": 0.7, "max_tokens": SUMMARY_REPLY_TOKENS}
+    return request
+
+async def summarize_chunks(chunks, llm, model):
+    """Summarize all chunks concurrently within the rate budget; summaries stay in chronological order."""
+    requests = [summarize_chunk_request(chunk, model) for chunk in chunks]
+    labels = [f"chunk {idx}/{len(chunks)}" for idx in range(1, len(chunks) + 1)]
+    return await llm.complete_many(requests, labels)
+
+async def generate_feedback(summary, llm, model):
     messages = [
-        {"role": "system", "content": "You are a knowledgeable preschool education evaluator."},
-        {"role": "user", "content": (
-            "Below is the summarized combined transcript of a preschool storytelling class:\n\n"
-            f"{summary}\n\n"
-            "Based on this, provide comprehensive, actionable feedback focusing on classroom setup, "
-            "child engagement, prop usage, body language, and teacher communication."
-        )}
+        {"role": "system", "content": FEEDBACK_SYSTEM},
+        {"role": "user", "content": FEEDBACK_TEMPLATE.format(summary=summary)}
     ]
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=0.7
-    )
-    return response.choices[0].message.content.strip()
+    return await llm.complete("final feedback", model=model, messages=messages, temperature=0.7,
+                              max_tokens=FEEDBACK_REPLY_TOKENS)
+
+async def summarize_and_feedback(combined, llm, args):
+    # Summarize in chunks only if the transcript does not fit the final call
+    plaintext_tokens = message_tokens(transcript_to_plaintext(combined), args.model)
+    prompt_tokens = (message_tokens(FEEDBACK_SYSTEM, args.model)
+                     + message_tokens(FEEDBACK_TEMPLATE.format(summary=""), args.model))
+    fits = plaintext_tokens <= chunk_ceiling(args.tpm, FEEDBACK_REPLY_TOKENS, prompt_tokens, model=args.model,
+                                             max_input_tokens=args.max_input_tokens)
+    if not fits or (args.chunk_size and len(combined) > args.chunk_size):
+        chunks = pack_segments(combined, args)
+        print(f"Summarizing {len(combined)} segments ({plaintext_tokens} tokens) in {len(chunks)} chunks...")
+        summaries = await summarize_chunks(chunks, llm, args.summary_model)
+        # merge in fixed fan-out levels so the final prompt stays bounded
+        summaries = await tree_reduce(summaries, merge_summaries_request(args.summary_model), llm,
+                                      fan_out=args.fan_out, save_to=args.summary_tree)
+        combined_summary = "\n\n".join(summaries)
+    else:
+        print("No summarization needed; transcript is small.")
+        combined_summary = transcript_to_plaintext(combined)
+
+    print("Generating final feedback...")
+    return await generate_feedback(combined_summary, llm, args.model)
 
 def main():
     parser = argparse.ArgumentParser(
         description="Combine audio and image transcripts, summarize, and generate feedback."
     )
-    parser.add_argument("--audio_json", required=True, help="Path to audio transcription JSON")
-    parser.add_argument("--image_json", required=True, help="Path to image caption JSON")
+    parser.add_argument("--audio_json", required=True, help="Path to audio transcription JSON (or a .timeline store)")
+    parser.add_argument("--image_json", required=True, help="Path to image caption JSON (or a .timeline store)")
     parser.add_argument("--output_transcript", default="combined_transcript.json", help="Path to write combined transcript JSON")
     parser.add_argument("--output_feedback", default="Feedback_on_combined_transcript.txt", help="Path to write final feedback text")
-    parser.add_argument("--chunk_size", type=int, default=10, help="Number of segments per summarization chunk")
+    parser.add_argument("--align", choices=MODES, default="overlap",
+                        help="How frames are matched to segments: inside it, within --window s of it, or nearest to its start")
+    parser.add_argument("--window", type=float, default=None,
+                        help="Seconds of slack for --align window, or max distance for --align nearest")
+    parser.add_argument("--teacher_only", action="store_true",
+                        help="Keep only segments tagged as the teacher's (see diarize.py)")
+    parser.add_argument("--chunk_size", type=int, default=None,
+                        help="Optional cap on segments per summarization chunk (chunks are packed by tokens)")
+    parser.add_argument("--max_input_tokens", type=int, default=None,
+                        help="Optional ceiling on input tokens per summarization call (default: what the TPM tier allows)")
+    parser.add_argument("--fan_out", type=int, default=FAN_OUT,
+                        help="Summaries merged per call when reducing long transcripts")
+    parser.add_argument("--summary_tree", default=None, help="Optional path to save every level of the summary tree (JSON)")
     parser.add_argument("--model", default="gpt-4o", help="Model to use for final feedback")
     parser.add_argument("--summary_model", default="gpt-4o", help="Model to use for summarization")
+    parser.add_argument("--tpm", type=int, default=TPM_LIMIT, help="Tokens-per-minute budget for the OpenAI org")
+    parser.add_argument("--rpm", type=int, default=RPM_LIMIT, help="Requests-per-minute budget for the OpenAI org")
     args = parser.parse_args()
 
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         print("Error: OPENAI_API_KEY environment variable is not set.", file=sys.stderr)
         sys.exit(1)
-    client = OpenAI(api_key=api_key)
+    llm = AsyncLLMClient(tpm=args.tpm, rpm=args.rpm, api_key=api_key)
 
     print("Loading transcripts...")
     audio_data = load_audio_transcript(args.audio_json)
-    image_map = load_image_captions(args.image_json)
+    if args.teacher_only:
+        kept = teacher_segments(audio_data)
+        print(f"Keeping {len(kept)}/{len(audio_data)} teacher segments...")
+        audio_data = kept
+    frames = load_image_captions(args.image_json)
 
     print("Combining transcripts...")
-    combined = combine_transcript(audio_data, image_map)
+    combined = combine_transcript(audio_data, frames, mode=args.align, window=args.window)
     with open(args.output_transcript, "w", encoding="utf-8") as f:
         json.dump(combined, f, ensure_ascii=False, indent=2)
     print(f"Combined transcript saved to {args.output_transcript}")
 
-    # Summarize in chunks if needed
-    if len(combined) > args.chunk_size:
-        chunks = [combined[i : i + args.chunk_size] for i in range(0, len(combined), args.chunk_size)]
-        summaries = []
-        for idx, chunk in enumerate(chunks, 1):
-            print(f"Summarizing chunk {idx}/{len(chunks)}...")
-            summary = summarize_chunk(chunk, client, args.summary_model)
-            summaries.append(summary)
-        combined_summary = "\n\n".join(summaries)
-    else:
-        print("No summarization needed; transcript is small.")
-        combined_summary = transcript_to_plaintext(combined)
-
-    print("Generating final feedback...")
-    feedback = generate_feedback(combined_summary, client, args.model)
+    feedback = asyncio.run(summarize_and_feedback(combined, llm, args))
     with open(args.output_feedback, "w", encoding="utf-8") as f:
         f.write(feedback)
     print(f"Feedback saved to {args.output_feedback}")
@@ -1,10 +1,13 @@
-import os, sys, json, pathlib, time
+import os, sys, json, pathlib, time, argparse
 #from dotenv import load_dotenv
 import whisper
 from openai import OpenAI
 from openai.types.chat import ChatCompletion
-from utils import split_video, extract_audio, separate_vocals
+from utils import SR, split_video, extract_audio, separate_vocals, separate_vocals_array, stream_windows
+from utils import load_demucs
 import torch
+import numpy as np
+from scipy.io import wavfile
 
 def main(mp4_path: str, chunk_len: int = 60):
     print(f"[DEBUG] Starting main() with file: {mp4_path}")
@@ -12,42 +15,208 @@ def main(mp4_path: str, chunk_len: int = 60):
 # ---------- init ----------
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 device = "cuda" if torch.cuda.is_available() else "cpu"
-wmodel = whisper.load_model("large-v3", device=device)                # <- forces fp16
-print("🤖 Whisper weights on", next(wmodel.parameters()).device, "dtype", next(wmodel.parameters()).dtype)
 from pathlib import Path
+from stage_cache import cached_chat, cached_json    # repo root is put on sys.path by utils
+from inference_backends import WHISPER_BACKEND, WHISPER_BACKENDS, load_whisper, set_threads, whisper_fp16
+from vad import gather, speech_regions
+from overlap_stitch import bucket, stitch
+from diarize import diarize_stream, intersect, tag_segments, teacher_regions
+from pipeline_metrics import add_cli_args, metrics, stage
 BASE = Path(__file__).resolve().parent        # …/demucs_whisper
 OUT = BASE / "outputs"                        # …/demucs_whisper/outputs
 OUT.mkdir(exist_ok=True)
 
-def transcribe(chunk_wav: str) -> str:
-    res = wmodel.transcribe(chunk_wav, fp16=True, language="en")
-    txt = res["text"].strip()
+WHISPER_MODEL = "large-v3"
+WHISPER_BACKEND_NAME = WHISPER_BACKEND        # torch | torch-int8 | ctranslate2
+WHISPER_PARAMS = {"fp16": whisper_fp16(device), "language": "en"}
+TEACHER_WHISPER_PARAMS = {"beam_size": 5, "best_of": 5}   # --teacher-only: less audio, so decode it carefully
+_wmodel = None
+
+def get_whisper():
+    """Whisper for the selected backend, loaded on first use."""
+    global _wmodel
+    if _wmodel is None:
+        _wmodel = load_whisper(WHISPER_MODEL, WHISPER_BACKEND_NAME, device)
+        print(f"🤖 Whisper {WHISPER_MODEL} ({WHISPER_BACKEND_NAME}) on {device}")
+    return _wmodel
+
+def _whisper_key():
+    return WHISPER_MODEL if WHISPER_BACKEND_NAME == "torch" else f"{WHISPER_MODEL}@{WHISPER_BACKEND_NAME}"
+
+@stage("asr")
+def transcribe(chunk_wav: str, params: dict = WHISPER_PARAMS) -> str:
+    txt = cached_json(
+        "whisper", lambda: get_whisper().transcribe(chunk_wav, **params)["text"].strip(),
+        model=_whisper_key(), params=params, files=[chunk_wav])
     (pathlib.Path(chunk_wav).with_suffix(".txt")).write_text(txt)
     return txt
 
-def main(mp4_path: str, chunk_len: int = 60):
-    t0 = time.time()
+@stage("asr")
+def transcribe_array(audio, params: dict = WHISPER_PARAMS) -> str:
+    """Whisper on an in-memory float32 16 kHz array (no WAV round-trip)."""
+    return cached_json(
+        "whisper", lambda: get_whisper().transcribe(audio, **params)["text"].strip(),
+        model=_whisper_key(), params=params, data=[audio])
+
+@stage("asr")
+def transcribe_segments(audio, words: bool = False, params: dict = WHISPER_PARAMS) -> list[dict]:
+    """
+    Whisper segments ({"start", "end", "text"}, seconds into <audio>) for an
+    in-memory array; with <words> each segment also has a "words" list.
+    """
+    params = {**params, "word_timestamps": True} if words else params
+
+    def compute():
+        out = []
+        for s in get_whisper().transcribe(audio, **params)["segments"]:
+            seg = {"start": s["start"], "end": s["end"], "text": s["text"].strip()}
+            if words:
+                seg["words"] = [{"text": w["word"].strip(), "start": w["start"], "end": w["end"]}
+                                for w in s.get("words", [])]
+            out.append(seg)
+        return out
+    return cached_json("whisper_segments", compute, model=_whisper_key(), params=params, data=[audio])
+
+def _transcribe_window(window, offset: float, stats: dict, vad: bool = True,
+                       words: bool = False, keep=None, params: dict = WHISPER_PARAMS) -> tuple[str, list[dict]]:
+    """
+    Demucs + Whisper on one window, segments on the recording timeline.  With
+    <vad> only the speech regions are processed: they are packed into one
+    buffer (so Whisper still sees full 30 s contexts) and the segment times
+    are mapped back.  <keep> (recording-timeline regions, e.g. the teacher's
+    turns) narrows the processed audio further.
+    """
+    regions = speech_regions(window, SR) if vad else [(0.0, len(window) / SR)]
+    if keep is not None:
+        regions = intersect(regions, [(s - offset, e - offset) for s, e in keep])
+    compact, tmap = gather(window, regions, SR)
+    if vad or keep is not None:
+        stats["total_s"] += len(window) / SR
+        stats["speech_s"] += len(compact) / SR
+        print(f"🗣️  Kept {len(compact) / SR:.1f}s of {len(window) / SR:.1f}s in {len(regions)} region(s)")
+    if not len(compact):
+        return "", []
+    vocals = separate_vocals_array(compact)
+    tmap = tmap.shift(offset)
+
+    def mapped(item):
+        item = {**item, "start": round(tmap.to_original(item["start"]), 2),
+                "end": round(tmap.to_original(item["end"]), 2)}
+        if "words" in item:
+            item["words"] = [mapped(w) for w in item["words"]]
+        return item
+    segs = [mapped(seg) for seg in transcribe_segments(vocals, words, params)]
+    return " ".join(seg["text"] for seg in segs), segs
+
+def _load_wav(wav_fp: str):
+    sr, audio = wavfile.read(wav_fp)
+    if audio.dtype == np.int16:
+        audio = audio.astype(np.float32) / 32768.0
+    return audio if audio.ndim == 1 else audio.mean(axis=1)
+
+def _chunks_via_files(mp4_path: str, chunk_len: int, vad: bool, stats: dict, keep=None,
+                      params: dict = WHISPER_PARAMS):
     print(f"🔪 Splitting into {chunk_len}s chunks …")
     chunks = split_video(mp4_path, chunk_len)
 
-    all_txt = []
+    all_txt, all_segs = [], []
     for i, chunk in enumerate(chunks, 1):
         print(f"\n⏩  Chunk {i}/{len(chunks)}  ({pathlib.Path(chunk).name})")
         wav = extract_audio(chunk)
-        vocals = separate_vocals(wav)
-        print("✅ Vocals isolated for", wav)
-        txt = transcribe(vocals)
-        all_txt.append(f"[Chunk {i}] {txt}")
+        if vad or keep is not None:
+            txt, segs = _transcribe_window(_load_wav(wav), (i - 1) * chunk_len, stats, vad, keep=keep,
+                                           params=params)
+            all_segs.extend(segs)
+        else:
+            vocals = separate_vocals(wav)
+            print("✅ Vocals isolated for", wav)
+            txt = transcribe(vocals, params)
+        all_txt.append(f"[Chunk {i}] {txt}")
+    return all_txt, all_segs
 
-    full_transcript = "\n".join(all_txt)
+def _chunks_via_stream(mp4_path: str, chunk_len: int, vad: bool, stats: dict, overlap: float = 0.0, keep=None,
+                       params: dict = WHISPER_PARAMS):
+    if overlap:
+        return _chunks_overlapped(mp4_path, chunk_len, vad, stats, overlap, keep, params)
+    print(f"🌊 Streaming audio in {chunk_len}s windows (single decode) …")
+    all_txt, all_segs = [], []
+    for i, (offset, window) in enumerate(stream_windows(mp4_path, chunk_len), 1):
+        print(f"\n⏩  Window {i}  ({offset:.0f}s – {offset + len(window) / SR:.0f}s)")
+        if vad or keep is not None:
+            txt, segs = _transcribe_window(window, offset, stats, vad, keep=keep, params=params)
+            all_segs.extend(segs)
+        else:
+            vocals = separate_vocals_array(window)
+            txt = transcribe_array(vocals, params)
+        all_txt.append(f"[Chunk {i}] {txt}")
+    return all_txt, all_segs
+
+def _chunks_overlapped(mp4_path: str, chunk_len: int, vad: bool, stats: dict, overlap: float, keep=None,
+                       params: dict = WHISPER_PARAMS):
+    """
+    Windows of <chunk_len> s sharing <overlap> s, decoded with word timestamps
+    and stitched so words on a window edge are neither cut nor duplicated.
+    Chunks in the transcript are then chunk_len - overlap seconds long.
+    """
+    print(f"🌊 Streaming audio in {chunk_len}s windows overlapping by {overlap}s (single decode) …")
+    plan, window_words = [], []
+    for i, (offset, window) in enumerate(stream_windows(mp4_path, chunk_len, overlap_sec=overlap), 1):
+        print(f"\n⏩  Window {i}  ({offset:.0f}s – {offset + len(window) / SR:.0f}s)")
+        _, segs = _transcribe_window(window, offset, stats, vad=vad, words=True, keep=keep, params=params)
+        plan.append((offset, len(window) / SR))
+        window_words.append([w for seg in segs for w in seg["words"]])
+    words = stitch(window_words, plan)
+    total = plan[-1][0] + plan[-1][1] if plan else 0.0
+    all_txt = [f"[Chunk {i}] " + " ".join(w["text"] for w in entry["words"])
+               for i, entry in enumerate(bucket(words, chunk_len - overlap, total), 1)]
+    return all_txt, words
+
+def _diarize(mp4_path: str, chunk_len: int, stem: str):
+    """Speaker turns over the whole recording (one extra, cheap audio decode)."""
+    print("👥 Diarising speakers …")
+    turns, info = diarize_stream(stream_windows(mp4_path, chunk_len), SR)
+    for spk, st in info["speakers"].items():
+        mark = "  ← teacher" if spk == info["teacher"] else ""
+        print(f"🗣️  {spk}: {st['talk_s']:.0f}s, median pitch {st['f0_hz'] or '-'} Hz{mark}")
+    dpath = OUT / f"{stem}_speakers.json"
+    dpath.write_text(json.dumps({**info, "turns": turns}, indent=2))
+    print(f"📝 Speaker turns saved → {dpath}")
+    return turns
+
+@stage("demucs_whisper")
+def main(mp4_path: str, chunk_len: int = 60, stream: bool = False, vad: bool = True, overlap: float = 0.0,
+         diarize: bool = False, teacher_only: bool = False):
+    t0 = time.time()
+    stats = {"total_s": 0.0, "speech_s": 0.0}
     stem = pathlib.Path(mp4_path).stem
+    if overlap and not stream:
+        print("ℹ️  --overlap needs sample-accurate windows; using the streaming decoder")
+        stream = True
+    turns = _diarize(mp4_path, chunk_len, stem) if diarize or teacher_only else None
+    keep = teacher_regions(turns) if teacher_only else None
+    params = {**WHISPER_PARAMS, **(TEACHER_WHISPER_PARAMS if teacher_only else {})}   # per call, not global
+    if stream:
+        all_txt, segments = _chunks_via_stream(mp4_path, chunk_len, vad, stats, overlap, keep, params)
+    else:
+        all_txt, segments = _chunks_via_files(mp4_path, chunk_len, vad, stats, keep, params)
+    if (vad or keep is not None) and stats["total_s"]:
+        print(f"\n🗣️  {'Teacher' if teacher_only else 'VAD'}: {stats['speech_s']:.0f}s of {stats['total_s']:.0f}s "
+              f"sent to Demucs/Whisper ({stats['speech_s'] / stats['total_s']:.0%})")
+    if turns is not None:
+        tag_segments(segments, turns)
+
+    full_transcript = "\n".join(all_txt)
     tpath = OUT / f"{stem}_transcript.txt"
     tpath.write_text(full_transcript)
     print(f"\n📝 Transcript saved → {tpath}")
+    if vad or overlap or turns is not None:
+        spath = OUT / f"{stem}_{'words' if overlap else 'segments'}.json"
+        spath.write_text(json.dumps(segments, indent=2, ensure_ascii=False))
+        print(f"📝 Timestamped segments saved → {spath}")
 
     # ---------- GPT‑4o feedback ----------
     prompt = f"""
-You are evaluating a preschool teacher. Here is the auto‑extracted transcript (teacher‑dominant) in 60‑second chunks:
+You are evaluating a preschool teacher. Here is the auto‑extracted transcript ({'teacher only' if teacher_only else 'teacher‑dominant'}) in {chunk_len}‑second chunks:
 
 {full_transcript}
 
@@ -56,19 +225,40 @@ Return JSON with keys:
   areas_for_improvement: list[str]
   summary: str
 """
-    chat = client.chat.completions.create(
+    feedback = cached_chat(
+        client,
         model="gpt-4o-mini",
         messages=[{"role":"user", "content": prompt}],
         temperature=0.3
     )
-    feedback = chat.choices[0].message.content
     fpath = OUT / f"{stem}_feedback.json"
     fpath.write_text(feedback)
     print(f"✅ Feedback saved → {fpath}")
     print(f"\n🏁 Completed in {int(time.time()-t0)} s")
+    return tpath, fpath
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 demucs_whisper/main.py <video.mp4>")
-        sys.exit(1)
-    main(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Demucs + Whisper teacher transcript and GPT feedback")
+    parser.add_argument("video_path", help="Path to input MP4 video")
+    parser.add_argument("--chunk-len", type=int, default=60, help="Chunk length in seconds (default: 60)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Decode audio once through an ffmpeg pipe and keep every chunk in memory")
+    parser.add_argument("--overlap", type=float, default=0.0,
+                        help="Seconds shared by neighbouring windows, stitched word by word (implies --stream; "
+                             "e.g. --chunk-len 30 --overlap 5)")
+    parser.add_argument("--no-vad", action="store_true",
+                        help="Send every second to Demucs/Whisper instead of only the detected speech regions")
+    parser.add_argument("--diarize", action="store_true",
+                        help="Tag timestamped segments with speaker and teacher (writes <name>_speakers.json)")
+    parser.add_argument("--teacher-only", action="store_true",
+                        help="Diarise, then transcribe only the teacher's turns with beam search")
+    parser.add_argument("--backend", choices=WHISPER_BACKENDS, default=WHISPER_BACKEND_NAME,
+                        help="Whisper runtime: torch (default), torch-int8 or ctranslate2 (faster-whisper)")
+    parser.add_argument("--threads", type=int, help="Intra-op CPU threads (default: torch's choice)")
+    add_cli_args(parser)
+    args = parser.parse_args()
+    metrics.configure(args.metrics, args.metrics_port)
+    WHISPER_BACKEND_NAME = args.backend
+    set_threads(args.threads)
+    main(args.video_path, args.chunk_len, args.stream, vad=not args.no_vad, overlap=args.overlap,
+         diarize=args.diarize, teacher_only=args.teacher_only)
@@ -1,20 +1,28 @@
+import os
+import sys
 import subprocess
 import tempfile
 import numpy as np
 import torch
 import pathlib
+import struct
+import threading
 import time
-from scipy.io.wavfile import write as wavwrite
 from scipy.io import wavfile
 from pathlib import Path
 from demucs.apply import apply_model
 from demucs.pretrained import get_model
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repo root
+from stage_cache import cached_array, cached_files
+from pipeline_metrics import note, stage
+
 SR = 16_000                         # Whisper default
 _device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
 # ---------- Video helpers ----------
+@stage("ffmpeg split")
 def split_video(input_path: str, chunk_sec: int = 60) -> list[str]:
     """
     Slice <input_path> into N x <chunk_sec> MP4s (stream‑copy, no re‑encode).
@@ -36,59 +44,279 @@ def split_video(input_path: str, chunk_sec: int = 60) -> list[str]:
     subprocess.run(cmd, check=True)
     return sorted([f.as_posix() for f in tmp_dir.glob("chunk_*.mp4")])
 
+@stage("audio extract")
 def extract_audio(video_fp: str, sr: int = SR) -> str:
     wav_out = pathlib.Path(tempfile.gettempdir()) / (pathlib.Path(video_fp).stem + ".wav")
     cmd = ["ffmpeg", "-loglevel", "error", "-y", "-i", video_fp, "-ac", "1", "-ar", str(sr), wav_out.as_posix()]
     subprocess.run(cmd, check=True)
     return str(wav_out)
 
+# ---------- Streaming audio ----------
+def decode_audio_stream(input_path: str, sr: int = SR, block_sec: float = 1.0):
+    """
+    Decode the audio track of <input_path> exactly once through an ffmpeg
+    pipe and yield float32 mono blocks of ~<block_sec> seconds.
+    """
+    cmd = ["ffmpeg", "-loglevel", "error", "-i", input_path,
+           "-vn", "-ac", "1", "-ar", str(sr), "-f", "f32le", "pipe:1"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    block_bytes = int(block_sec * sr) * 4
+    eof = False
+    try:
+        while True:
+            buf = proc.stdout.read(block_bytes)
+            if not buf:
+                eof = True
+                break
+            buf = buf[: len(buf) - len(buf) % 4]
+            yield np.frombuffer(buf, dtype=np.float32)
+    finally:
+        proc.stdout.close()
+        if not eof:                 # consumer stopped early (or raised): ffmpeg's exit status is meaningless
+            proc.kill()
+        proc.wait()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+class AudioRingBuffer:
+    """Fixed-capacity float32 FIFO; blocks go in, fixed-length windows come out."""
+
+    def __init__(self, capacity: int):
+        self._buf = np.zeros(capacity, dtype=np.float32)
+        self._start = 0
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def write(self, block: np.ndarray) -> None:
+        n = len(block)
+        cap = len(self._buf)
+        if self._len + n > cap:
+            raise OverflowError(f"ring buffer full ({self._len}+{n} > {cap})")
+        end = (self._start + self._len) % cap
+        first = min(n, cap - end)
+        self._buf[end:end + first] = block[:first]
+        self._buf[:n - first] = block[first:]
+        self._len += n
+
+    def peek(self, n: int) -> np.ndarray:
+        """Copy of the oldest <n> samples (fewer if the buffer holds less), left in place."""
+        n = min(n, self._len)
+        idx = (self._start + np.arange(n)) % len(self._buf)
+        return self._buf[idx]
+
+    def drop(self, n: int) -> None:
+        n = min(n, self._len)
+        self._start = (self._start + n) % len(self._buf)
+        self._len -= n
+
+    def read(self, n: int) -> np.ndarray:
+        """Pop the oldest <n> samples (fewer if the buffer holds less)."""
+        out = self.peek(n)
+        self.drop(len(out))
+        return out
+
+
+def stream_windows(input_path: str, window_sec: float = 60, sr: int = SR, block_sec: float = 1.0,
+                   overlap_sec: float = 0.0):
+    """
+    Yield (offset_sec, float32 window) pairs of <window_sec> audio decoded in a
+    single pass – no chunk MP4s, no intermediate WAVs.  With <overlap_sec>
+    each window repeats the last <overlap_sec> of the previous one
+    (the same windows as overlap_stitch.plan_windows).
+    """
+    window = int(window_sec * sr)
+    overlap = int(overlap_sec * sr)
+    if not 0 <= overlap < window:
+        raise ValueError(f"overlap ({overlap_sec}s) must be shorter than the window ({window_sec}s)")
+    ring = AudioRingBuffer(window + int(block_sec * sr) + 1)
+    offset = 0
+    fresh = 0                      # samples in the ring not yet covered by a yielded window
+    for block in decode_audio_stream(input_path, sr, block_sec):
+        ring.write(block)
+        fresh += len(block)
+        while len(ring) >= window:
+            yield offset / sr, ring.peek(window)
+            ring.drop(window - overlap)
+            offset += window - overlap
+            fresh = len(ring) - overlap
+    if fresh > 0:
+        yield offset / sr, ring.read(len(ring))
+
 # ---------- Demucs ----------
 _model = None                       # lazy‑load once
+DEMUCS_MODEL = "mdx_extra_q"
+DEMUCS_WINDOW_S = 30                # audio per apply_model window
+DEMUCS_CROSSFADE_S = 1.0            # overlap between windows, linearly crossfaded
+DEMUCS_BATCH = 4 if _device.type == "cpu" else 2   # windows per apply_model call
+DEMUCS_PARAMS = {"segment": 15, "overlap": 0.25, "shifts": 0,
+                 "window": DEMUCS_WINDOW_S, "crossfade": DEMUCS_CROSSFADE_S}
 
-def separate_vocals(wav_fp: str) -> str:
-    global _model,_device
-
+def load_demucs():
+    """The Demucs model, loaded on first use (call it up front to warm it)."""
+    global _model
     if _model is None:
-        print(f"🚀 [Demucs] loading mdx_extra_q on {_device} …")
-        _model = get_model("mdx_extra_q").to(_device)
+        print(f"🚀 [Demucs] loading {DEMUCS_MODEL} on {_device} …")
+        _model = get_model(DEMUCS_MODEL).to(_device)
+    return _model
 
-    # ---------- 1) resample to 16 kHz mono with ffmpeg ----------
-    tmp_wav = Path(tempfile.gettempdir()) / (Path(wav_fp).stem + "_16k.wav")
-    subprocess.run(
-        ["ffmpeg", "-y", "-loglevel", "error",
-         "-i", wav_fp, "-ac", "1", "-ar", "16000", tmp_wav.as_posix()],
-        check=True)
 
-    # ---------- 2) load & dup mono → stereo ----------
-    sr, wav_np = wavfile.read(tmp_wav)
-    if wav_np.dtype == np.int16:
-        wav_np = wav_np.astype(np.float32) / 32768.0
-    if wav_np.ndim == 1:
-        wav_np = np.stack([wav_np, wav_np])          # [2, N]
+class DemucsSeparator:
+    """
+    Vocals stem of arbitrarily long mono audio at constant memory.
+
+    The input is cut into <window_sec> windows that overlap by <crossfade_sec>;
+    <batch> windows at a time are copied into one preallocated [batch, T]
+    buffer (int16 is scaled on the way in), handed to apply_model as a
+    stereo *view* (expand, no stacking) and the vocals of each window are
+    crossfaded into the output as they come back.  Peak memory is the batch
+    buffers plus the model's activations – independent of input length – and
+    the output can be a np.memmap, so whole recordings never sit in RAM.
+    """
+
+    def __init__(self, window_sec: float = DEMUCS_WINDOW_S, crossfade_sec: float = DEMUCS_CROSSFADE_S,
+                 batch: int = DEMUCS_BATCH, sr: int = SR):
+        self.win = int(window_sec * sr)
+        self.ov = int(crossfade_sec * sr)
+        if not 0 <= self.ov < self.win:
+            raise ValueError("crossfade must be shorter than the window")
+        self.hop = self.win - self.ov
+        self.batch = batch
+        self.sr = sr
+        self._mono = torch.zeros(batch, self.win)                   # reused for every batch
+        self._fade_in = np.linspace(0.0, 1.0, self.ov, dtype=np.float32)
+        self._fade_out = self._fade_in[::-1].copy()
+
+    def starts(self, n: int) -> range:
+        """Window starts: every hop, until a window reaches the end of <n> samples."""
+        last = max(0, -(-(n - self.win) // self.hop)) if n > self.win else 0
+        return range(0, last * self.hop + 1, self.hop)
+
+    def _fill(self, audio, starts) -> list[int]:
+        """Copy the windows at <starts> into the mono buffer; returns their lengths."""
+        buf = self._mono.numpy()                                    # shares memory with the tensor
+        lengths = []
+        for b, s in enumerate(starts):
+            chunk = audio[s:s + self.win]
+            n = len(chunk)
+            if chunk.dtype == np.int16:
+                np.multiply(chunk, 1 / 32768, out=buf[b, :n], casting="unsafe")
+            else:
+                buf[b, :n] = chunk
+            buf[b, n:] = 0.0
+            lengths.append(n)
+        return lengths
+
+    def _vocals(self, nb: int) -> np.ndarray:
+        """[nb, win] vocals for the first <nb> buffered windows."""
+        model = load_demucs()
+        stereo = self._mono[:nb, None, :].expand(nb, 2, self.win)   # [nb, 2, T] view, no copy
+        with torch.inference_mode():
+            sources = apply_model(model, stereo, segment=DEMUCS_PARAMS["segment"],
+                                  overlap=DEMUCS_PARAMS["overlap"], shifts=DEMUCS_PARAMS["shifts"],
+                                  device=_device)
+        return sources[:, model.sources.index("vocals")].mean(1).cpu().numpy()
 
-    wav_tensor = torch.tensor(wav_np).unsqueeze(0).to(_device)  # [1,2,N]
+    def iter_blocks(self, audio):
+        """Yield (offset, float32 block) of separated vocals, back to back and crossfaded."""
+        n_total = len(audio)
+        starts = list(self.starts(n_total))
+        tail = None
+        for i in range(0, len(starts), self.batch):
+            group = starts[i:i + self.batch]
+            lengths = self._fill(audio, group)
+            vocals = self._vocals(len(group))
+            for s, n, y in zip(group, lengths, vocals):
+                y = y[:n]
+                last = s + n >= n_total
+                if tail is not None:                                # blend into the previous window's tail
+                    k = min(self.ov, n)
+                    y[:k] = tail[:k] * self._fade_out[:k] + y[:k] * self._fade_in[:k]
+                yield s, y[:n if last else self.hop]
+                tail = None if last else y[self.hop:n].copy()
 
-    # ---------- 3) run Demucs (fast settings) ----------
-    print(f"🎧 [Demucs] start on {wav_fp}  →  {wav_tensor.shape[-1]/sr:.1f}s")
+    def separate(self, audio, out=None) -> np.ndarray:
+        """Peak-normalised vocals of <audio> (float32 or int16, may be a memmap) into <out>."""
+        out = np.empty(len(audio), dtype=np.float32) if out is None else out
+        peak = 0.0
+        for off, block in self.iter_blocks(audio):
+            out[off:off + len(block)] = block
+            if len(block):
+                peak = max(peak, float(block.max()), -float(block.min()))
+        if peak > 0:
+            for i in range(0, len(out), self.win):                  # in place, block by block
+                out[i:i + self.win] *= 1.0 / peak
+        return out
+
+
+_local = threading.local()          # one separator (and [batch, T] buffer) per thread, e.g. batch_runner --workers
+
+def get_separator() -> DemucsSeparator:
+    if getattr(_local, "separator", None) is None:
+        _local.separator = DemucsSeparator()
+    return _local.separator
+
+def separate_vocals_array(wav_np: np.ndarray, sr: int = SR) -> np.ndarray:
+    """Demucs vocals stem for a float32 mono array; returns float32 mono in [-1, 1]."""
+    return cached_array("demucs", lambda: _separate_vocals_array(wav_np, sr),
+                        model=DEMUCS_MODEL, params={**DEMUCS_PARAMS, "sr": sr}, data=[wav_np])
+
+@stage("demucs")
+def _separate_vocals_array(wav_np: np.ndarray, sr: int) -> np.ndarray:
+    print(f"🎧 [Demucs] start  →  {len(wav_np)/sr:.1f}s")
     t0 = time.time()
-    sources = apply_model(
-    _model,
-    wav_tensor,          # [1, 2, N]
-    segment=15,
-    overlap=0.25,
-    shifts=0,
-    device=_device,
-)             
+    vocals = get_separator().separate(wav_np)
     dt = time.time() - t0
     print(f"✅ [Demucs] finished in {dt:.2f}s")
+    note(audio_s=round(len(wav_np) / sr, 2))
+    return vocals
 
-    # ---------- 4) extract vocals stem ----------
-    vocal_idx = _model.sources.index("vocals")
-    vocals = sources[0, vocal_idx].cpu().numpy()
-    vocals = (vocals / np.max(np.abs(vocals))) * 32767
-    vocals = vocals.astype(np.int16)
+def separate_vocals(wav_fp: str) -> str:
+    out_dir = os.path.dirname(wav_fp) or "."
+    return cached_files("demucs", lambda: [_separate_vocals(wav_fp)], out_dir,
+                        model=DEMUCS_MODEL, params={**DEMUCS_PARAMS, "sr": SR}, files=[wav_fp])[0]
 
-    out_fp = wav_fp.replace(".wav", "_vocals.wav")
-    wavwrite(out_fp, sr, vocals.T)   # scipy wav write
+def _wav_header(n_samples: int, sr: int) -> bytes:
+    """44-byte RIFF header for mono 16-bit PCM."""
+    data = n_samples * 2
+    return (b"RIFF" + struct.pack("<I", 36 + data) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sr, sr * 2, 2, 16)
+            + b"data" + struct.pack("<I", data))
+
+@stage("demucs")
+def _separate_vocals(wav_fp: str) -> str:
+    """
+    Vocals of a WAV file of any length: input and output are memory-mapped,
+    so RAM use does not grow with the recording.
+    """
+    # ---------- 1) resample to 16 kHz mono with ffmpeg ----------
+    tmp_wav = Path(tempfile.gettempdir()) / (Path(wav_fp).stem + "_16k.wav")
+    subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error",
+         "-i", wav_fp, "-ac", "1", "-ar", str(SR), "-c:a", "pcm_s16le", tmp_wav.as_posix()],
+        check=True)
+
+    # ---------- 2) map the samples, separate into a float32 scratch map ----------
+    sr, wav_np = wavfile.read(tmp_wav, mmap=True)
+    print(f"🎧 [Demucs] start on {wav_fp}  →  {len(wav_np)/sr:.1f}s")
+    t0 = time.time()
+    with tempfile.NamedTemporaryFile(suffix=".f32") as scratch:
+        vocals = np.memmap(scratch.name, dtype=np.float32, mode="w+", shape=(len(wav_np),))
+        get_separator().separate(wav_np, out=vocals)
+        dt = time.time() - t0
+        print(f"✅ [Demucs] finished in {dt:.2f}s")
+        note(audio_s=round(len(wav_np) / sr, 2))
+
+        # ---------- 3) write int16 vocals block by block ----------
+        out_fp = wav_fp.replace(".wav", "_vocals.wav")
+        with open(out_fp, "wb") as f:
+            f.write(_wav_header(len(vocals), sr))
+            step = sr * DEMUCS_WINDOW_S
+            for i in range(0, len(vocals), step):
+                f.write((vocals[i:i + step] * 32767).astype("<i2").tobytes())
+        del vocals
     return out_fp
+
 # ----------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+CPU speaker diarisation that finds the teacher.
+
+Demucs separates voice from noise, not one voice from another: the children
+are speech too.  diarize() labels who speaks when, so the pipeline can tag
+transcript segments with the teacher / other speakers and, optionally, send
+only the teacher's speech to ASR and GPT.
+
+  1. vad.speech_regions() finds the speech;
+  2. every region is cut into SEG_S subsegments (SEG_HOP_S hop) and each one
+     gets a small embedding: mean / std of its MFCCs and of their deltas, plus
+     its median log-pitch, all standardised over the recording;
+  3. the embeddings are clustered agglomeratively (cosine similarity of
+     cluster centroids, stop below THRESHOLD or at --speakers);
+  4. the teacher is the cluster with the most talk time whose median pitch is
+     in the adult range (children speak at 250–400 Hz);
+  5. subsegment labels are smoothed and merged into turns.
+
+Everything is numpy: features for an hour of speech take seconds.
+
+    turns, info = diarize(audio, 16000)          # [{"start", "end", "speaker", "teacher"}], summary
+    tag_segments(segments, turns)                # adds "speaker" / "teacher" to transcript segments
+    keep = intersect(regions, teacher_regions(turns))
+
+Usage:
+  python diarize.py lesson.mp4                           # print turns and talk time per speaker
+  python diarize.py lesson.mp4 --transcript lesson_segments.json --out tagged.json
+"""
+import argparse
+import json
+import subprocess
+
+import numpy as np
+
+from pipeline_metrics import note, stage
+from vad import _frames, speech_regions
+
+SR = 16000
+FRAME_MS = 32             # 512 samples: long enough for pitch down to 75 Hz
+HOP_MS = 10
+N_MELS = 40
+N_MFCC = 20               # c0 (loudness) is dropped
+SEG_S = 1.5               # subsegment length
+SEG_HOP_S = 0.75
+MIN_SEG_S = 0.4           # shorter regions are not embedded
+PITCH_RANGE_HZ = (75, 500)
+VOICING = 0.45            # normalised autocorrelation peak for a voiced frame
+PITCH_WEIGHT = 4.0        # log-pitch counts as this many MFCC dimensions
+THRESHOLD = 0.1           # stop merging clusters below this centroid cosine similarity
+MAX_POINTS = 400          # larger inputs are pre-reduced with k-means
+ADULT_MAX_F0_HZ = 255
+_BLOCK = 4096             # frames per FFT block (bounds memory on long regions)
+
+
+# ---------- features ----------
+def _mel_filters(sr: int, n_fft: int, n_mels: int = N_MELS) -> np.ndarray:
+    """[n_mels, n_fft // 2 + 1] triangular mel filterbank."""
+    mel = lambda f: 2595 * np.log10(1 + f / 700)
+    hz = lambda m: 700 * (10 ** (m / 2595) - 1)
+    edges = hz(np.linspace(mel(20), mel(sr / 2 - 200), n_mels + 2))
+    freqs = np.fft.rfftfreq(n_fft, 1 / sr)
+    lo, mid, hi = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    return np.maximum(0, np.minimum((freqs - lo) / (mid - lo), (hi - freqs) / (hi - mid))).astype(np.float32)
+
+
+def _dct(n_in: int, n_out: int) -> np.ndarray:
+    k = np.arange(n_out)[:, None]
+    return np.cos(np.pi / n_in * (np.arange(n_in) + 0.5) * k).astype(np.float32)
+
+
+def frame_features(audio: np.ndarray, sr: int = SR) -> tuple[np.ndarray, np.ndarray]:
+    """(mfcc [n_frames, N_MFCC - 1], f0 [n_frames], NaN when unvoiced) per 10 ms hop."""
+    audio = np.ascontiguousarray(audio, dtype=np.float32)
+    frames = _frames(audio, sr, FRAME_MS, HOP_MS)
+    n = frames.shape[1]
+    window = np.hamming(n).astype(np.float32)
+    fbank, dct = _mel_filters(sr, n), _dct(N_MELS, N_MFCC)
+    lag_lo, lag_hi = int(sr / PITCH_RANGE_HZ[1]), int(sr / PITCH_RANGE_HZ[0])
+
+    mfcc = np.empty((len(frames), N_MFCC - 1), dtype=np.float32)
+    f0 = np.full(len(frames), np.nan, dtype=np.float32)
+    for i in range(0, len(frames), _BLOCK):
+        block = frames[i:i + _BLOCK] * window
+        spec = np.abs(np.fft.rfft(block, axis=1)) ** 2
+        mfcc[i:i + _BLOCK] = (np.log(spec @ fbank.T + 1e-8) @ dct.T)[:, 1:]
+
+        # pitch: strongest normalised autocorrelation peak in the lag range
+        block = block - block.mean(axis=1, keepdims=True)
+        ac = np.fft.irfft(np.abs(np.fft.rfft(block, 2 * n, axis=1)) ** 2, axis=1)[:, :lag_hi + 1]
+        ac /= ac[:, :1] + 1e-8
+        lag = lag_lo + np.argmax(ac[:, lag_lo:], axis=1)
+        voiced = ac[np.arange(len(ac)), lag] > VOICING
+        f0[i:i + _BLOCK][voiced] = sr / lag[voiced]
+    return mfcc, f0
+
+
+def _embed(mfcc: np.ndarray, f0: np.ndarray) -> tuple[np.ndarray, float]:
+    """Raw (unstandardised) embedding of one subsegment and its median pitch."""
+    delta = np.diff(mfcc, axis=0) if len(mfcc) > 1 else np.zeros_like(mfcc)
+    pitch = float(np.nanmedian(f0)) if np.isfinite(f0).any() else np.nan
+    emb = np.concatenate([mfcc.mean(0), mfcc.std(0), delta.std(0), [np.log(pitch) if pitch == pitch else np.nan]])
+    return emb, pitch
+
+
+def subsegments(start: float, end: float, seg: float = SEG_S, hop: float = SEG_HOP_S) -> list[tuple[float, float]]:
+    """Windows of <seg> s every <hop> s covering [start, end); the last one ends at <end>."""
+    if end - start <= seg:
+        return [(start, end)]
+    n = int(np.ceil((end - start - seg) / hop)) + 1
+    starts = np.minimum(start + np.arange(n) * hop, end - seg)
+    return [(round(float(s), 3), round(float(s) + seg, 3)) for s in starts]
+
+
+# ---------- clustering ----------
+def _normalise(x: np.ndarray) -> np.ndarray:
+    return x / (np.linalg.norm(x, axis=-1, keepdims=True) + 1e-8)
+
+
+def _kmeans(x: np.ndarray, k: int, iters: int = 20, seed: int = 0) -> np.ndarray:
+    """Spherical k-means labels for unit rows of <x>."""
+    rng = np.random.default_rng(seed)
+    centres = x[rng.choice(len(x), k, replace=False)]
+    for _ in range(iters):
+        labels = np.argmax(x @ centres.T, axis=1)
+        sums = np.zeros_like(centres)
+        np.add.at(sums, labels, x)
+        empty = ~sums.any(axis=1)
+        sums[empty] = centres[empty]
+        centres = _normalise(sums)
+    return np.argmax(x @ centres.T, axis=1)
+
+
+def cluster(x: np.ndarray, threshold: float = THRESHOLD, n_speakers: int | None = None,
+            max_points: int = MAX_POINTS) -> np.ndarray:
+    """
+    Agglomerative clustering of unit embeddings: repeatedly merge the two
+    clusters whose centroids are most similar, until the best similarity drops
+    below <threshold> (or <n_speakers> clusters remain).  Returns labels.
+    """
+    n = len(x)
+    if n < 2:
+        return np.zeros(n, dtype=int)
+    init = _kmeans(x, max_points) if n > max_points else np.arange(n)
+    ids = np.unique(init)
+    sums = np.stack([x[init == c].sum(0) for c in ids])
+    members = [np.flatnonzero(init == c) for c in ids]
+    target = n_speakers or 1
+
+    sim = _normalise(sums) @ _normalise(sums).T
+    np.fill_diagonal(sim, -np.inf)
+    alive = np.ones(len(sums), dtype=bool)
+    while alive.sum() > target:
+        a, b = np.unravel_index(np.argmax(sim), sim.shape)
+        if n_speakers is None and sim[a, b] < threshold:
+            break
+        sums[a] += sums[b]
+        members[a] = np.concatenate([members[a], members[b]])
+        alive[b] = False
+        sim[b, :] = sim[:, b] = -np.inf
+        row = _normalise(sums[a]) @ _normalise(sums).T
+        row[~alive] = -np.inf
+        row[a] = -np.inf
+        sim[a, :] = sim[:, a] = row
+
+    labels = np.empty(n, dtype=int)
+    for k, c in enumerate(np.flatnonzero(alive)):
+        labels[members[c]] = k
+    return labels
+
+
+# ---------- turns ----------
+def _smooth(labels: np.ndarray, region: np.ndarray) -> np.ndarray:
+    """A single subsegment between two of one other speaker (same region) takes their label."""
+    labels = labels.copy()
+    for i in range(1, len(labels) - 1):
+        if (region[i - 1] == region[i] == region[i + 1] and labels[i - 1] == labels[i + 1] != labels[i]):
+            labels[i] = labels[i - 1]
+    return labels
+
+
+def _turns(segs, labels, region, names, teacher) -> list[dict]:
+    """Subsegments own the span up to the midpoints with their neighbours; same-speaker spans merge."""
+    turns = []
+    for i, ((s, e), lab) in enumerate(zip(segs, labels)):
+        if i and region[i - 1] == region[i]:
+            s = (segs[i - 1][1] + s) / 2 if segs[i - 1][1] > s else s
+        if i + 1 < len(segs) and region[i + 1] == region[i]:
+            e = (e + segs[i + 1][0]) / 2 if segs[i + 1][0] < e else e
+        s, e = round(s, 3), round(e, 3)
+        if turns and turns[-1]["speaker"] == names[lab] and s - turns[-1]["end"] < 1e-6:
+            turns[-1]["end"] = e
+        else:
+            turns.append({"start": s, "end": e, "speaker": names[lab], "teacher": names[lab] == teacher})
+    return turns
+
+
+@stage("diarize")
+def diarize_stream(windows, sr: int = SR, n_speakers: int | None = None,
+                   threshold: float = THRESHOLD) -> tuple[list[dict], dict]:
+    """
+    Diarise a recording given as (offset_s, float32 window) pairs, e.g. from
+    demucs_whisper.utils.stream_windows().  Returns (turns, info): turns on the
+    recording timeline, info = {"teacher", "speakers": {id: {"talk_s", "f0_hz"}}, ...}.
+    """
+    segs, embs, pitches, region = [], [], [], []
+    total, hop = 0.0, HOP_MS / 1000
+    for offset, window in windows:
+        total = max(total, offset + len(window) / sr)
+        for s, e in speech_regions(window, sr):
+            if e - s < MIN_SEG_S:
+                continue
+            mfcc, f0 = frame_features(window[int(s * sr):int(e * sr)], sr)
+            rid = region[-1] + 1 if region else 0
+            for a, b in subsegments(s, e):
+                i = min(int((a - s) / hop), len(mfcc) - 1)
+                j = max(i + 1, int((b - s) / hop))
+                emb, pitch = _embed(mfcc[i:j], f0[i:j])
+                segs.append((round(offset + a, 3), round(offset + b, 3)))
+                embs.append(emb)
+                pitches.append(pitch)
+                region.append(rid)
+    note(audio_s=round(total, 2), subsegments=len(segs))
+    info = {"total_s": round(total, 2), "speech_s": 0.0, "teacher": None, "speakers": {}}
+    if not segs:
+        return [], info
+
+    x = np.array(embs, dtype=np.float64)
+    logf0 = x[:, -1]
+    x[:, -1] = np.where(np.isnan(logf0), np.nanmean(logf0) if np.isfinite(logf0).any() else 0.0, logf0)
+    x = (x - x.mean(0)) / (x.std(0) + 1e-8)
+    x[:, -1] *= np.sqrt(PITCH_WEIGHT)
+    region = np.array(region)
+    labels = _smooth(cluster(_normalise(x), threshold, n_speakers), region)
+
+    # speakers ranked by talk time; the teacher is the most talkative adult
+    pitches = np.array(pitches)
+    durations = np.minimum([e - s for s, e in segs], SEG_HOP_S)    # the span each subsegment owns, roughly
+    stats = []
+    for k in np.unique(labels):
+        sel = labels == k
+        f0 = float(np.nanmedian(pitches[sel])) if np.isfinite(pitches[sel]).any() else None
+        stats.append((k, float(durations[sel].sum()), f0))
+    stats.sort(key=lambda t: -t[1])
+    names = {k: f"S{i}" for i, (k, _, _) in enumerate(stats)}
+    adults = [t for t in stats if t[2] is None or t[2] <= ADULT_MAX_F0_HZ]
+    teacher = names[(adults or stats)[0][0]]
+
+    turns = _turns(segs, labels, region, names, teacher)
+    talk = {}
+    for t in turns:
+        talk[t["speaker"]] = talk.get(t["speaker"], 0.0) + t["end"] - t["start"]
+    info["speech_s"] = round(sum(talk.values()), 2)
+    info["teacher"] = teacher
+    info["speakers"] = {names[k]: {"talk_s": round(talk.get(names[k], 0.0), 2),
+                                   "f0_hz": round(f0, 1) if f0 else None} for k, _, f0 in stats}
+    return turns, info
+
+
+def diarize(audio: np.ndarray, sr: int = SR, n_speakers: int | None = None,
+            threshold: float = THRESHOLD) -> tuple[list[dict], dict]:
+    """diarize_stream() for one in-memory buffer."""
+    return diarize_stream([(0.0, audio)], sr, n_speakers, threshold)
+
+
+# ---------- using the turns ----------
+def teacher_regions(turns) -> list[tuple[float, float]]:
+    return [(t["start"], t["end"]) for t in turns if t["teacher"]]
+
+
+def intersect(a, b) -> list[tuple[float, float]]:
+    """Intersection of two sorted lists of non-overlapping (start, end) intervals."""
+    out, i, j = [], 0, 0
+    while i < len(a) and j < len(b):
+        s, e = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+        if e > s:
+            out.append((s, e))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return out
+
+
+def tag_segments(segments, turns) -> list[dict]:
+    """
+    Give every timed segment (in place) the "speaker" with the most overlap and
+    "teacher": whether that is the teacher.  Segments without speech overlap
+    get speaker None.
+    """
+    turns = sorted(turns, key=lambda t: t["start"])
+    teachers = {t["speaker"] for t in turns if t["teacher"]}
+    ends = np.array([t["end"] for t in turns])
+    for seg in segments:
+        s, e = seg.get("start") or 0.0, seg.get("end") or 0.0
+        talk = {}
+        k = int(np.searchsorted(ends, s, side="right"))
+        while k < len(turns) and turns[k]["start"] < e:
+            t = turns[k]
+            talk[t["speaker"]] = talk.get(t["speaker"], 0.0) + min(e, t["end"]) - max(s, t["start"])
+            k += 1
+        speaker = max(talk, key=talk.get) if talk else None
+        seg["speaker"] = speaker
+        seg["teacher"] = speaker in teachers
+    return segments
+
+
+def load_audio(path: str, sr: int = SR) -> np.ndarray:
+    """Mono float32 audio of any file ffmpeg can read."""
+    cmd = ["ffmpeg", "-loglevel", "error", "-i", path, "-vn", "-ac", "1", "-ar", str(sr), "-f", "f32le", "pipe:1"]
+    return np.frombuffer(subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout, dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speaker turns and the teacher of a classroom recording")
+    parser.add_argument("media_path", help="Video or audio file")
+    parser.add_argument("--speakers", type=int, help="Number of speakers (default: found by --threshold)")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="Centroid cosine similarity below which clusters stay apart")
+    parser.add_argument("--transcript", help="Timed transcript JSON to tag with speaker / teacher")
+    parser.add_argument("--out", help="Where to write the tagged transcript (default: overwrite --transcript) "
+                                      "or, without --transcript, the turns")
+    args = parser.parse_args()
+
+    turns, info = diarize(load_audio(args.media_path), SR, args.speakers, args.threshold)
+    for spk, st in info["speakers"].items():
+        mark = "  ← teacher" if spk == info["teacher"] else ""
+        print(f"🗣️  {spk}: {st['talk_s']:.1f}s, median pitch {st['f0_hz'] or '-'} Hz{mark}")
+    teacher_s = info["speakers"].get(info["teacher"], {}).get("talk_s", 0.0)
+    print(f"👩‍🏫 teacher speaks {teacher_s:.0f}s of {info['speech_s']:.0f}s of speech ({info['total_s']:.0f}s recorded)")
+
+    if args.transcript:
+        with open(args.transcript, encoding="utf-8") as f:
+            segments = json.load(f)
+        tag_segments(segments, turns)
+        out = args.out or args.transcript
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(segments, f, ensure_ascii=False, indent=2)
+        print(f"📝 {sum(s['teacher'] for s in segments)}/{len(segments)} segments tagged as teacher → {out}")
+    elif args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({**info, "turns": turns}, f, indent=2)
+        print(f"📝 Turns → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark split_to_intervals.make_segments on synthetic transcripts.
+
+Usage:
+  python bench_make_segments.py [--interval 1] [--sizes 1000 2000 5000 10000 20000 50000]
+
+Generates ElevenLabs-style "words" arrays (word + spacing entries, ~2.5
+words/s) of increasing length and times the bisect-based make_segments
+against the previous per-interval full scan.  The old version is only run
+up to --legacy-max words since it grows quadratically.  A flat µs/word
+column means linear scaling.
+"""
+import argparse
+import random
+import time
+
+from split_to_intervals import make_segments
+
+
+def legacy_make_segments(words, interval_sec):
+    """The original O(intervals × words) implementation, kept for comparison."""
+    max_end = max(w.get('end', 0) for w in words)
+    num = int(max_end // interval_sec) + 1
+    segments = []
+    for i in range(num):
+        start_t = i * interval_sec
+        end_t = start_t + interval_sec
+        texts = [w.get('text', '') for w in words
+                 if w.get('type') == 'word' and start_t <= w.get('start', 0) < end_t]
+        segments.append({'start': float(start_t), 'end': float(end_t), 'text': ' '.join(texts).strip()})
+    return segments
+
+
+def synthetic_words(n, seed=0):
+    rng = random.Random(seed)
+    words, t = [], 0.0
+    for i in range(n):
+        dur = rng.uniform(0.15, 0.45)
+        words.append({'text': f"w{i}", 'type': 'word', 'start': t, 'end': t + dur})
+        words.append({'text': ' ', 'type': 'spacing', 'start': t + dur, 'end': t + dur + 0.1})
+        t += dur + rng.uniform(0.0, 0.1)
+    return words
+
+
+def best_of(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark make_segments scaling")
+    parser.add_argument('--interval', '-i', type=float, default=1.0)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 5000, 10000, 20000, 50000])
+    parser.add_argument('--legacy-max', type=int, default=5000,
+                        help='Largest transcript to run the old quadratic version on')
+    args = parser.parse_args()
+
+    print(f"{'words':>8} {'new (ms)':>10} {'µs/word':>8} {'old (ms)':>10} {'speedup':>8}")
+    for n in args.sizes:
+        words = synthetic_words(n)
+        t_new, seg_new = best_of(lambda: make_segments(words, args.interval))
+        old_ms, speedup = "-", "-"
+        if n <= args.legacy_max:
+            t_old, seg_old = best_of(lambda: legacy_make_segments(words, args.interval), repeat=1)
+            assert seg_old == seg_new, "new make_segments disagrees with the old one"
+            old_ms, speedup = f"{t_old * 1e3:.1f}", f"{t_old / t_new:.0f}x"
+        print(f"{n:>8} {t_new * 1e3:>10.1f} {t_new / n * 1e6:>8.2f} {old_ms:>10} {speedup:>8}")
+
+
+if __name__ == '__main__':
+    main()
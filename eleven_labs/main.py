@@ -4,6 +4,14 @@ Transcribe MP4 videos using Eleven Labs Scribe v1 model and save JSON transcript
 
 Usage:
   python main.py path/to/video.mp4
+  python main.py path/to/video.mp4 --stream-audio [--segment-sec 900 --workers 4]
+
+--stream-audio extracts the audio track as low-bitrate mono Opus and streams
+it as a chunked multipart upload instead of posting the whole MP4.  With
+--segment-sec, long recordings are cut into overlapping segments that are
+transcribed concurrently and stitched back into one "words" array with
+corrected timestamps.  --api-url (or ELEVEN_LABS_API_URL) points the client
+at a local HTTP stub for testing.
 
 Requires:
   - Python 3.6+
@@ -12,8 +20,14 @@ Requires:
 """
 import os
 import sys
+import time
+import uuid
 import argparse
 import json
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 try:
     import requests
@@ -21,11 +35,39 @@ except ImportError:
     sys.stderr.write("Error: this script requires the 'requests' library. Install with 'pip install -r requirements.txt'\n")
     sys.exit(1)
 
-def transcribe(video_path, api_key, model, response_format, language=None):
+from requests.adapters import HTTPAdapter
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repo root
+from stage_cache import cached_json
+from overlap_stitch import plan_windows, shift_words, stitch
+from pipeline_metrics import stage
+
+API_URL = os.getenv("ELEVEN_LABS_API_URL", "https://api.elevenlabs.io/v1/speech-to-text")
+CONNECT_TIMEOUT = 10                # seconds
+READ_TIMEOUT = 900                  # transcription of a long file can take minutes
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 2.0
+RETRY_STATUS = (429, 500, 502, 503, 504)
+UPLOAD_BLOCK = 1 << 20              # bytes per chunk of the streamed body
+AUDIO_ARGS = ["-vn", "-ac", "1", "-ar", "16000", "-c:a", "libopus", "-b:a", "32k"]
+SEGMENT_OVERLAP_SEC = 5.0
+
+_session = None
+
+def get_session(pool_size=8):
+    """Shared keep-alive Session; no urllib3 retries, post_audio() is the only retry layer."""
+    global _session
+    if _session is None:
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        _session = requests.Session()
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+def transcribe(video_path, api_key, model, response_format, language=None, url=API_URL):
     """
     Send the video file to Eleven Labs speech-to-text API and return the parsed JSON response.
     """
-    url = "https://api.elevenlabs.io/v1/speech-to-text"
     headers = {"xi-api-key": api_key}
     with open(video_path, "rb") as vf:
         files = {"file": vf}
@@ -33,7 +75,8 @@ def transcribe(video_path, api_key, model, response_format, language=None):
         data = {"model_id": model, "response_format": response_format}
         if language:
             data["language"] = language
-        resp = requests.post(url, headers=headers, files=files, data=data)
+        resp = get_session().post(url, headers=headers, files=files, data=data,
+                                  timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
     try:
         result = resp.json()
     except ValueError:
@@ -44,6 +87,149 @@ def transcribe(video_path, api_key, model, response_format, language=None):
         sys.exit(1)
     return result
 
+# ---------- compressed audio ----------
+def probe_duration(path):
+    out = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration",
+                          "-of", "default=nw=1:nk=1", path],
+                         check=True, capture_output=True, text=True).stdout
+    return float(out.strip())
+
+@stage("audio extract")
+def extract_audio(video_path, out_path, start=None, duration=None):
+    """Audio track of <video_path> (optionally a [start, start+duration) slice) as mono Opus."""
+    cmd = ["ffmpeg", "-loglevel", "error", "-y"]
+    if start is not None:
+        cmd += ["-ss", f"{start:.3f}"]
+    if duration is not None:
+        cmd += ["-t", f"{duration:.3f}"]
+    cmd += ["-i", video_path] + AUDIO_ARGS + [out_path]
+    subprocess.run(cmd, check=True)
+    return out_path
+
+# ---------- streamed upload ----------
+def _multipart_body(fields, path, boundary, stats):
+    """Yield a multipart/form-data body with <path> as the "file" part, one block at a time."""
+    for name, value in fields.items():
+        yield (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n"
+               f"{value}\r\n").encode()
+    yield (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; "
+           f"filename=\"{os.path.basename(path)}\"\r\nContent-Type: audio/ogg\r\n\r\n").encode()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_BLOCK), b""):
+            stats["bytes"] += len(block)
+            yield block
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+@stage("asr")
+def post_audio(audio_path, api_key, model, response_format, language=None, url=API_URL):
+    """
+    Stream <audio_path> to the API as a chunked multipart upload and return the JSON
+    response.  Connection errors, timeouts, 429 and 5xx are retried with exponential
+    backoff (the body is a generator, so every attempt re-opens the file).
+    """
+    fields = {"model_id": model, "response_format": response_format}
+    if language:
+        fields["language"] = language
+    session = get_session()
+    for attempt in range(MAX_RETRIES + 1):
+        boundary = uuid.uuid4().hex
+        headers = {"xi-api-key": api_key,
+                   "Content-Type": f"multipart/form-data; boundary={boundary}"}
+        stats = {"bytes": 0}
+        delay = BACKOFF_SECONDS * 2 ** attempt
+        try:
+            resp = session.post(url, headers=headers,
+                                data=_multipart_body(fields, audio_path, boundary, stats),
+                                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        except (requests.ConnectionError, requests.Timeout) as err:
+            if attempt == MAX_RETRIES:
+                raise
+            print(f"⏳ Upload of {os.path.basename(audio_path)} failed ({err}); retrying in {delay:.0f}s")
+            time.sleep(delay)
+            continue
+        if resp.status_code in RETRY_STATUS and attempt < MAX_RETRIES:
+            retry_after = resp.headers.get("retry-after")
+            if retry_after and retry_after.replace(".", "", 1).isdigit():
+                delay = float(retry_after)
+            print(f"⏳ {os.path.basename(audio_path)}: HTTP {resp.status_code}; retrying in {delay:.0f}s")
+            resp.close()
+            time.sleep(delay)
+            continue
+        try:
+            result = resp.json()
+        except ValueError:
+            resp.raise_for_status()
+            raise
+        if resp.status_code != 200:
+            raise RuntimeError(f"API request failed [{resp.status_code}]: {result}")
+        print(f"⬆️  Uploaded {stats['bytes'] / 1e6:.1f} MB from {os.path.basename(audio_path)}")
+        return result
+
+def plan_segments(duration, segment_sec, overlap_sec=SEGMENT_OVERLAP_SEC):
+    """[(start, length), ...] covering <duration> with <overlap_sec> shared between neighbours."""
+    return plan_windows(duration, segment_sec, overlap_sec)
+
+def stitch_segments(results, plan):
+    """
+    Merge per-segment responses into one.  Word timestamps are shifted by the
+    segment start and each overlap is deduplicated by overlap_stitch.stitch
+    (text alignment, falling back to the overlap midpoint).
+    """
+    words = stitch([shift_words(r.get("words", []), start) for r, (start, _) in zip(results, plan)], plan)
+    # never leave two spacing entries side by side at a junction, and never glue two words together
+    cleaned = []
+    for w in words:
+        is_word = w.get("type", "word") != "spacing"
+        if cleaned and not is_word and cleaned[-1].get("type") == "spacing":
+            continue
+        if cleaned and is_word and cleaned[-1].get("type", "word") != "spacing":
+            cleaned.append({"text": " ", "type": "spacing", "start": cleaned[-1]["end"], "end": w["start"]})
+        cleaned.append(w)
+    while cleaned and cleaned[0].get("type") == "spacing":
+        cleaned.pop(0)
+    while cleaned and cleaned[-1].get("type") == "spacing":
+        cleaned.pop()
+    merged = {k: v for k, v in results[0].items() if k not in ("words", "text")}
+    merged["text"] = "".join(w.get("text", "") for w in cleaned)
+    merged["words"] = cleaned
+    return merged
+
+def transcribe_streamed(video_path, api_key, model, response_format, language=None,
+                        url=API_URL, segment_sec=0, overlap_sec=SEGMENT_OVERLAP_SEC, workers=4):
+    """Compressed-audio path: extract → (segment) → concurrent streamed uploads → stitch."""
+    t0 = time.time()
+    get_session(pool_size=workers)
+    with tempfile.TemporaryDirectory(prefix="elevenlabs_") as tmp:
+        duration = probe_duration(video_path)
+        plan = plan_segments(duration, segment_sec, overlap_sec)
+        print(f"🔹 Extracting {len(plan)} audio segment(s) from {duration / 60:.1f} min of video")
+
+        def run(i):
+            start, length = plan[i]
+            seg = extract_audio(video_path, os.path.join(tmp, f"seg_{i:03d}.ogg"),
+                                start=start if len(plan) > 1 else None,
+                                duration=length if len(plan) > 1 else None)
+            return post_audio(seg, api_key, model, response_format, language, url)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            results = list(pool.map(run, range(len(plan))))
+
+    result = results[0] if len(results) == 1 else stitch_segments(results, plan)
+    print(f"⚡  Transcribed in {time.time() - t0:.1f}s (video file: {os.path.getsize(video_path) / 1e6:.0f} MB)")
+    return result
+
+def transcribe_video(video_path, api_key, model, response_format, language=None, url=API_URL,
+                     stream_audio=False, segment_sec=0, overlap_sec=SEGMENT_OVERLAP_SEC, workers=4):
+    """transcribe() or transcribe_streamed(), through the stage cache."""
+    params = {"response_format": response_format, "language": language}
+    if stream_audio:
+        params.update(audio=AUDIO_ARGS, segment_sec=segment_sec, overlap_sec=overlap_sec)
+        compute = lambda: transcribe_streamed(video_path, api_key, model, response_format, language,
+                                              url, segment_sec, overlap_sec, workers)
+    else:
+        compute = lambda: transcribe(video_path, api_key, model, response_format, language, url)
+    return cached_json("elevenlabs", compute, model=model, params=params, files=[video_path])
+
 def main():
     parser = argparse.ArgumentParser(
         description="Transcribe MP4 videos using Eleven Labs Scribe v1"
@@ -72,6 +258,26 @@ def main():
         "--language", "-l",
         help="Language code (e.g., en), optional"
     )
+    parser.add_argument(
+        "--stream-audio", action="store_true",
+        help="Upload only the compressed audio track, streamed in chunks"
+    )
+    parser.add_argument(
+        "--segment-sec", type=float, default=0,
+        help="With --stream-audio: split into overlapping segments of this length (0 = one upload)"
+    )
+    parser.add_argument(
+        "--overlap-sec", type=float, default=SEGMENT_OVERLAP_SEC,
+        help=f"Overlap between segments in seconds (default: {SEGMENT_OVERLAP_SEC:g})"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4,
+        help="Concurrent segment uploads (default: 4)"
+    )
+    parser.add_argument(
+        "--api-url", default=API_URL,
+        help="Speech-to-text endpoint, e.g. a local stub (default: ELEVEN_LABS_API_URL or the public API)"
+    )
     args = parser.parse_args()
 
     video_path = args.video_path
@@ -84,12 +290,17 @@ def main():
         sys.stderr.write("Error: set ELEVEN_LABS_API_KEY environment variable\n")
         sys.exit(1)
 
-    transcript = transcribe(
+    transcript = transcribe_video(
         video_path,
         api_key,
         args.model,
         args.response_format,
-        language=args.language
+        language=args.language,
+        url=args.api_url,
+        stream_audio=args.stream_audio,
+        segment_sec=args.segment_sec,
+        overlap_sec=args.overlap_sec,
+        workers=args.workers
     )
 
     base = os.path.splitext(os.path.basename(video_path))[0]
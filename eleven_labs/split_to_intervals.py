@@ -3,15 +3,19 @@
 Split an Eleven Labs STT verbose_json transcript into fixed-interval segments.
 
 Usage:
-  python split_to_intervals.py input.json [--interval 10] [--output output.json]
+  python split_to_intervals.py input.json [--interval 10] [--step 5] [--output output.json]
+  python split_to_intervals.py input.json --align-llava path/to/llava_responses.json
 
 Reads an Eleven Labs STT output JSON (with a "words" array containing word-level timestamps)
 and writes a JSON array of segments, each with "start", "end", and concatenated "text"
-for each interval (default 10 seconds).
+for each interval (default 10 seconds).  With --step the intervals overlap;
+with --align-llava there is one segment per LLaVA frame, spanning until the
+next frame, tagged with the frame name.
 """
 import os
 import sys
 import json
+import bisect
 import argparse
 
 def load_words(path):
@@ -22,28 +26,58 @@ def load_words(path):
         sys.exit(1)
     return data['words']
 
-def make_segments(words, interval_sec):
-    # Determine total duration
-    max_end = max(w.get('end', 0) for w in words)
-    # Number of segments (cover until max_end)
-    num = int(max_end // interval_sec) + 1
+def _word_index(words):
+    """Sorted start times and texts of the 'word' entries, for bisecting."""
+    items = sorted((w for w in words if w.get('type') == 'word'), key=lambda w: w.get('start', 0))
+    return [w.get('start', 0) for w in items], [w.get('text', '') for w in items]
+
+def fixed_windows(total_sec, interval_sec, step_sec=None):
+    """[start, end) windows of <interval_sec> every <step_sec> (default: back to back) covering total_sec."""
+    step_sec = step_sec or interval_sec
+    num = int(total_sec // step_sec) + 1
+    return [(i * step_sec, i * step_sec + interval_sec) for i in range(num)]
+
+def frame_windows(frame_times, total_sec, interval_sec):
+    """One window per LLaVA frame: from the frame to the next one (last frame gets <interval_sec>)."""
+    times = sorted(frame_times)
+    windows = []
+    for i, t in enumerate(times):
+        start_t = 0.0 if i == 0 else t
+        end_t = times[i + 1] if i + 1 < len(times) else max(t + interval_sec, total_sec)
+        windows.append((start_t, end_t))
+    return windows
+
+def load_frame_times(path):
+    """(frame name, time_s) pairs from a llava_responses.json, in time order."""
+    with open(path, 'r', encoding='utf-8') as f:
+        frames = json.load(f)
+    return sorted(((name, float(v['time_s'])) for name, v in frames.items()), key=lambda x: x[1])
+
+def make_segments(words, interval_sec, step_sec=None, windows=None):
+    """
+    Group word texts into segments by start time.  By default the windows are
+    back-to-back <interval_sec> intervals; <step_sec> < interval_sec gives
+    overlapping sliding windows, and <windows> ([(start, end), ...], any
+    lengths, may overlap) overrides both.  Words are sorted once and each
+    window is cut out with two bisections, so the cost is O((words + windows)
+    · log words) instead of scanning every word for every window.
+    """
+    if not words:
+        return []
+    starts, texts = _word_index(words)
+    if windows is None:
+        # Determine total duration
+        max_end = max(w.get('end', 0) for w in words)
+        windows = fixed_windows(max_end, interval_sec, step_sec)
+
     segments = []
-    for i in range(num):
-        start_t = i * interval_sec
-        end_t = start_t + interval_sec
-        # Collect word texts whose start time is within this interval
-        texts = []
-        for w in words:
-            if w.get('type') != 'word':
-                continue
-            st = w.get('start', 0)
-            if st >= start_t and st < end_t:
-                texts.append(w.get('text', ''))
-        txt = ' '.join(texts).strip()
+    for start_t, end_t in windows:
+        lo = bisect.bisect_left(starts, start_t)
+        hi = bisect.bisect_left(starts, end_t, lo)
         segments.append({
             'start': float(start_t),
             'end': float(end_t),
-            'text': txt
+            'text': ' '.join(texts[lo:hi]).strip()
         })
     return segments
 
@@ -52,15 +86,30 @@ def main():
     parser.add_argument('input', help='Path to Eleven Labs transcript JSON')
     parser.add_argument('--interval', '-i', type=float, default=10.0,
                         help='Interval length in seconds (default: 10)')
+    parser.add_argument('--step', '-s', type=float, default=None,
+                        help='Window hop in seconds; smaller than --interval gives overlapping windows')
+    parser.add_argument('--align-llava', metavar='LLAVA_JSON',
+                        help='Use the frame timestamps of a llava_responses.json as window boundaries')
     parser.add_argument('--output', '-o', help='Output JSON path (default: input_basename_intervals.json)')
     args = parser.parse_args()
 
     words = load_words(args.input)
-    segments = make_segments(words, args.interval)
+    base, _ = os.path.splitext(os.path.basename(args.input))
+    if args.align_llava:
+        frames = load_frame_times(args.align_llava)
+        max_end = max((w.get('end', 0) for w in words), default=0)
+        windows = frame_windows([t for _, t in frames], max_end, args.interval)
+        segments = make_segments(words, args.interval, windows=windows)
+        for seg, (name, _) in zip(segments, frames):
+            seg['frame'] = name
+        suffix = "_llava_aligned.json"
+    else:
+        segments = make_segments(words, args.interval, step_sec=args.step)
+        suffix = f"_intervals_{int(args.interval)}s.json"
+        if args.step:
+            suffix = f"_intervals_{int(args.interval)}s_step{args.step:g}s.json"
 
     # Determine output path; default to same directory as input
-    base, _ = os.path.splitext(os.path.basename(args.input))
-    suffix = f"_intervals_{int(args.interval)}s.json"
     if args.output:
         out_path = args.output
     else:
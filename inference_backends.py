@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Backend selection for the local models (Whisper, HF ASR pipeline, LLaVA).
+
+Without a GPU the original loading code is the worst option on every count:
+openai-whisper falls back from fp16 with a warning, the HF pipeline runs
+fp32 with default threading, and LLaVA is loaded in float16, which most CPU
+kernels emulate slowly.  Each loader here takes a backend name:
+
+  Whisper (openai-whisper API)   torch        fp16 on CUDA, fp32 on CPU
+                                 torch-int8   dynamic int8 Linear layers (CPU)
+                                 ctranslate2  faster-whisper, int8 on CPU / fp16 on CUDA
+  HF ASR pipeline                hf           fp16 on CUDA, fp32 on CPU
+                                 hf-int8      dynamic int8 Linear layers (CPU)
+                                 onnx         optimum + onnxruntime export
+  LLaVA-1.5                      torch        fp16 on CUDA, fp32 on CPU
+                                 torch-bf16   bfloat16 (CPUs with AVX512-BF16 / AMX)
+                                 torch-int8   dynamic int8 language model (CPU)
+
+Defaults come from WHISPER_BACKEND / HF_ASR_BACKEND / LLAVA_BACKEND and the
+intra-op thread count from INFERENCE_THREADS.  faster-whisper and optimum
+are optional and only imported when their backend is chosen.
+"""
+import os
+
+WHISPER_BACKENDS = ("torch", "torch-int8", "ctranslate2")
+HF_ASR_BACKENDS = ("hf", "hf-int8", "onnx")
+LLAVA_BACKENDS = ("torch", "torch-bf16", "torch-int8")
+
+WHISPER_BACKEND = os.getenv("WHISPER_BACKEND", "torch")
+HF_ASR_BACKEND = os.getenv("HF_ASR_BACKEND", "hf")
+LLAVA_BACKEND = os.getenv("LLAVA_BACKEND", "torch")
+THREADS = int(os.getenv("INFERENCE_THREADS", "0")) or None
+
+
+def _check(backend, choices, what):
+    if backend not in choices:
+        raise ValueError(f"unknown {what} backend {backend!r}; expected one of {choices}")
+
+
+def default_device() -> str:
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def set_threads(n: int | None = THREADS) -> None:
+    """Pin torch's intra-op pool (and BLAS, if not imported yet) to <n> threads."""
+    if not n:
+        return
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ.setdefault(var, str(n))
+    import torch
+    torch.set_num_threads(n)
+
+
+def quantize_int8(module, device: str, linear_types: tuple = ()):
+    """
+    In-place dynamic int8 quantisation of every nn.Linear (weights int8,
+    activations quantised per batch).  quantize_dynamic matches exact types,
+    so nn.Linear subclasses in <linear_types> (e.g. whisper.model.Linear) are
+    first turned back into plain nn.Linear; they must not change the maths.
+    """
+    import torch
+    if device != "cpu":
+        print("⚠️  int8 dynamic quantisation is CPU-only; keeping the float model on", device)
+        return module
+    for m in module.modules():
+        if type(m) in linear_types:
+            m.__class__ = torch.nn.Linear
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+# ---------- openai-whisper API ----------
+class _FasterWhisper:
+    """faster-whisper (CTranslate2) behind openai-whisper's transcribe() → {"text", "segments"}."""
+
+    def __init__(self, name, device, threads):
+        from faster_whisper import WhisperModel
+        compute_type = "float16" if device == "cuda" else "int8"
+        self.model = WhisperModel(name, device=device, compute_type=compute_type, cpu_threads=threads or 0)
+        self.device = device
+
+    def transcribe(self, audio, fp16=None, language=None, word_timestamps=False, **kwargs):
+        segments, _ = self.model.transcribe(audio, language=language, beam_size=kwargs.get("beam_size", 5),
+                                            word_timestamps=word_timestamps)
+        segs = []
+        for s in segments:
+            seg = {"start": s.start, "end": s.end, "text": s.text}
+            if word_timestamps:
+                seg["words"] = [{"word": w.word, "start": w.start, "end": w.end} for w in s.words or []]
+            segs.append(seg)
+        return {"text": "".join(s["text"] for s in segs), "segments": segs}
+
+
+def load_whisper(name: str = "large-v3", backend: str = WHISPER_BACKEND, device: str | None = None,
+                 threads: int | None = THREADS):
+    """Whisper model with an openai-whisper style transcribe(); pass fp16=whisper_fp16(device)."""
+    _check(backend, WHISPER_BACKENDS, "whisper")
+    device = device or default_device()
+    set_threads(threads)
+    if backend == "ctranslate2":
+        return _FasterWhisper(name, device, threads)
+    import whisper
+    model = whisper.load_model(name, device=device)
+    if backend == "torch-int8":
+        # whisper.model.Linear only casts weights to the input dtype, a no-op in float32 on CPU
+        model = quantize_int8(model, device, (whisper.model.Linear,))
+    return model
+
+
+def whisper_fp16(device: str | None = None) -> bool:
+    """fp16 decoding only where it exists; on CPU whisper would warn and fall back anyway."""
+    return (device or default_device()) == "cuda"
+
+
+# ---------- HF pipeline ----------
+def load_hf_asr(model_name: str = "openai/whisper-large-v3", backend: str = HF_ASR_BACKEND,
+                device=None, threads: int | None = THREADS):
+    """transformers ASR pipeline for <backend>; device is a pipeline device (-1 = CPU, 0 = cuda:0)."""
+    _check(backend, HF_ASR_BACKENDS, "HF ASR")
+    import torch
+    from transformers import pipeline
+    set_threads(threads)
+    if device is None:
+        device = 0 if torch.cuda.is_available() else -1
+    on_gpu = device != -1 and device != "cpu"
+
+    if backend == "onnx":
+        from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+        from transformers import AutoProcessor
+        processor = AutoProcessor.from_pretrained(model_name)
+        provider = "CUDAExecutionProvider" if on_gpu else "CPUExecutionProvider"
+        model = ORTModelForSpeechSeq2Seq.from_pretrained(model_name, export=True, provider=provider)
+        return pipeline("automatic-speech-recognition", model=model, tokenizer=processor.tokenizer,
+                        feature_extractor=processor.feature_extractor)
+
+    dtype = torch.float16 if on_gpu else torch.float32
+    asr = pipeline("automatic-speech-recognition", model=model_name, device=device, torch_dtype=dtype)
+    if backend == "hf-int8":
+        asr.model = quantize_int8(asr.model, "cuda" if on_gpu else "cpu")
+    return asr
+
+
+# ---------- LLaVA ----------
+def load_llava(model_id: str, backend: str = LLAVA_BACKEND, device: str | None = None,
+               threads: int | None = THREADS):
+    """LLaVA model in eval mode for <backend>."""
+    _check(backend, LLAVA_BACKENDS, "LLaVA")
+    import torch
+    from transformers import AutoModelForImageTextToText
+    device = device or default_device()
+    set_threads(threads)
+    if device == "cuda":
+        dtype = torch.float16
+    elif backend == "torch-bf16":
+        dtype = torch.bfloat16
+    else:
+        dtype = torch.float32      # fp16 matmuls are emulated on most CPUs
+    model = AutoModelForImageTextToText.from_pretrained(model_id, torch_dtype=dtype).to(device).eval()
+    if backend == "torch-int8":
+        # the 7B language model dominates; the CLIP tower stays float
+        lm = model.language_model if hasattr(model, "language_model") else model.model.language_model
+        quantize_int8(lm, device)      # in place: language_model is a read-only property on newer transformers
+    return model
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Live / near-real-time lesson analysis over a growing recording or a stream.
+
+One ffmpeg process reads the source and writes two raw streams into pipes:
+16 kHz mono float32 audio and RGB frames at the LLaVA FPS / FRAME_SIZE.  Both
+are cut into rolling windows (default 60 s).  As each window completes it is
+transcribed (HF whisper-large-v3 or openai-whisper), its frames are captioned
+by LLaVA (with the usual dedup carried across windows), the two are aligned
+with combine_transcript, and a GPT-4o note for the window is requested in the
+background.  Notes are rolled up with tree_reduce every --rollup-every
+windows into partial_feedback.txt, so coaches see feedback during the class.
+When the source ends only the last window and the (mostly cached) tree merge
+remain, so the final feedback follows within seconds.
+
+Sources:
+  growing file   python live_pipeline.py recording.ts            (tailed; ends after --idle-timeout s without new data)
+  named pipe     mkfifo /tmp/cam && python live_pipeline.py /tmp/cam
+  network        python live_pipeline.py rtsp://camera.local/stream
+  test source    python live_pipeline.py "testsrc2=rate=10:duration=300[out0];sine=duration=300[out1]" --input-format lavfi --realtime
+
+A growing MP4 is only readable while it is written if it is fragmented
+(e.g. recorded with -movflags frag_keyframe+empty_moov); MPEG-TS and MKV work as-is.
+
+Outputs (default Combined_Pipeline_Outputs/Live_<timestamp>/):
+  window_notes.jsonl, combined_transcript.json, llava_responses.json,
+  partial_feedback.txt, Feedback_on_combined_transcript.txt
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from batch_runner import ROOT, load_module
+from combine_audio_video_feedback import (
+    FRAME_METADATA_KEYS, combine_transcript, generate_feedback, merge_summaries_request,
+    summarize_chunk_request)
+from llm_client import AsyncLLMClient, TPM_LIMIT, RPM_LIMIT
+from pipeline_metrics import add_cli_args, metrics
+from tree_reduce import FAN_OUT, tree_reduce
+
+SR = 16000
+AUDIO_BLOCK_SEC = 0.5
+
+
+# ---------- source ----------
+class LiveSource:
+    """ffmpeg → (audio pipe, video pipe), drained by two reader threads into window buffers."""
+
+    def __init__(self, source, fps, size, input_format=None, follow=None, idle_timeout=30.0,
+                 realtime=False, sr=SR):
+        self.fps, self.size, self.sr = fps, size, sr
+        a_read, a_write = os.pipe()
+        v_read, v_write = os.pipe()
+        cmd = ["ffmpeg", "-loglevel", "error", "-nostdin"]
+        if realtime:
+            cmd += ["-re"]
+        if input_format:
+            cmd += ["-f", input_format]
+        if follow is None:
+            follow = os.path.isfile(source)
+        if follow:
+            # tail a file that is still being written; give up after idle_timeout s without new bytes
+            cmd += ["-follow", "1", "-rw_timeout", str(int(idle_timeout * 1e6))]
+            source = f"file:{source}"
+        w, h = size
+        vf = f"fps={fps},scale={w}:{h}:force_original_aspect_ratio=increase,crop={w}:{h}"   # as stream_frames
+        cmd += ["-i", source,
+                "-map", "0:a:0", "-ac", "1", "-ar", str(sr), "-f", "f32le", f"pipe:{a_write}",
+                "-map", "0:v:0", "-vf", vf, "-pix_fmt", "rgb24",
+                "-f", "rawvideo", f"pipe:{v_write}"]
+        self.proc = subprocess.Popen(cmd, pass_fds=(a_write, v_write))
+        os.close(a_write)
+        os.close(v_write)
+
+        self._cond = threading.Condition()
+        self._audio, self._audio_n, self._audio_used = [], 0, 0
+        self._frames, self._frames_seen = [], 0
+        self._audio_done = self._video_done = False
+        self._threads = [
+            threading.Thread(target=self._read_audio, args=(os.fdopen(a_read, "rb"),), daemon=True),
+            threading.Thread(target=self._read_video, args=(os.fdopen(v_read, "rb"),), daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+
+    def _read_audio(self, pipe):
+        block = int(AUDIO_BLOCK_SEC * self.sr) * 4
+        with pipe:
+            for buf in iter(lambda: pipe.read(block), b""):
+                arr = np.frombuffer(buf[: len(buf) - len(buf) % 4], dtype=np.float32)
+                with self._cond:
+                    self._audio.append(arr)
+                    self._audio_n += len(arr)
+                    self._cond.notify_all()
+        with self._cond:
+            self._audio_done = True
+            self._cond.notify_all()
+
+    def _read_video(self, pipe):
+        w, h = self.size
+        frame_bytes = w * h * 3
+        with pipe:
+            while True:
+                buf = pipe.read(frame_bytes)
+                if len(buf) < frame_bytes:
+                    break
+                with self._cond:
+                    idx = self._frames_seen
+                    self._frames.append((f"frame_{idx:04d}.jpg", idx / self.fps,
+                                         np.frombuffer(buf, dtype=np.uint8).reshape(h, w, 3)))
+                    self._frames_seen += 1
+                    self._cond.notify_all()
+        with self._cond:
+            self._video_done = True
+            self._cond.notify_all()
+
+    def windows(self, window_sec):
+        """Yield (start_s, audio, [(name, time_s, rgb)]) per window as soon as both streams cover it."""
+        k = 0
+        while True:
+            end = (k + 1) * window_sec
+            with self._cond:
+                self._cond.wait_for(lambda: (self._audio_done or self._audio_n >= end * self.sr)
+                                    and (self._video_done or self._frames_seen / self.fps >= end))
+                audio = np.concatenate(self._audio) if self._audio else np.zeros(0, np.float32)
+                take = min(len(audio), int(end * self.sr) - self._audio_used)
+                window_audio, rest = audio[:take], audio[take:]
+                self._audio = [rest] if len(rest) else []
+                self._audio_n = len(rest)
+                self._audio_used += take
+                frames = [f for f in self._frames if f[1] < end]
+                self._frames = [f for f in self._frames if f[1] >= end]
+                finished = self._audio_done and self._video_done
+            if len(window_audio) or frames:
+                yield k * window_sec, window_audio, frames
+            elif finished:
+                break
+            k += 1
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+        self.proc.wait()
+
+
+# ---------- models ----------
+def make_asr(engine, model_name, interval):
+    """(audio, offset_s) → [{"start", "end", "text"}] on the lesson timeline."""
+    if engine == "whisper":
+        from inference_backends import load_whisper, whisper_fp16
+        model = load_whisper(model_name or "large-v3")
+        fp16 = whisper_fp16()
+
+        def asr(audio, offset):
+            segs = model.transcribe(audio, fp16=fp16, language="en")["segments"]
+            return [{"start": round(offset + s["start"], 3), "end": round(offset + s["end"], 3),
+                     "text": s["text"].strip()} for s in segs]
+        return asr
+
+    mod = load_module("whisperlarge_v3_main", ROOT / "whisperlarge_v3" / "main.py")
+    model_name = model_name or "openai/whisper-large-v3"
+    mod.get_recognizer(model_name)
+
+    def asr(audio, offset):
+        segs = mod.transcribe_batched(audio, model_name, chunk_sec=interval)
+        return [{**s, "start": offset + s["start"], "end": offset + s["end"]} for s in segs]
+    return asr
+
+
+def load_llava():
+    folder = ROOT / "LLaVA_GPT4o"
+    load_module("llava_gpt4o_main", folder / "main.py", [folder, folder / "utils"])
+    return sys.modules["llava_inference"], sys.modules["frame_extractor"].FRAME_SIZE
+
+
+# ---------- main loop ----------
+class _Loop:
+    """A private asyncio loop in a thread, so GPT calls run while the next window is processed."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+def _write_json(path, value):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(value, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def run(args):
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    print("🚀 Loading ASR and LLaVA …")
+    asr = make_asr(args.asr, args.asr_model, args.interval)
+    llava, frame_size = load_llava()
+    captioner = llava.StreamCaptioner(dedup=not args.no_dedup)
+
+    loop = _Loop()
+    llm = loop.submit(_make_client(args)).result()
+
+    async def note_for(window, label):
+        return await llm.complete(label, **summarize_chunk_request(window, args.summary_model))
+
+    async def rollup(notes):
+        top = await tree_reduce(notes, merge_summaries_request(args.summary_model), llm, fan_out=args.fan_out)
+        return await generate_feedback("\n\n".join(top), llm, args.model)
+
+    source = LiveSource(args.source, llava.FPS, frame_size, input_format=args.input_format,
+                        follow=args.follow, idle_timeout=args.idle_timeout, realtime=args.realtime)
+    combined, notes = [], []
+    t_start = time.time()
+    try:
+        for k, (offset, audio, frames) in enumerate(source.windows(args.window)):
+            t0 = time.time()
+            lag = (t0 - t_start) - (offset + args.window)
+            print(f"\n⏩  Window {k + 1}: {offset:.0f}s – {offset + args.window:.0f}s "
+                  f"({len(audio) / SR:.0f}s audio, {len(frames)} frames, lag {max(lag, 0):.0f}s)")
+            segments = asr(audio, offset) if len(audio) else []
+            if not segments and frames:
+                # silent window: still report what the camera saw
+                segments = [{"start": offset, "end": offset + args.window, "text": ""}]
+            names = captioner.feed(frames)
+            records = [{"frame": n, "time_s": captioner.results[n]["time_s"],
+                        "captions": {k2: v for k2, v in captioner.results[n].items()
+                                     if k2 not in FRAME_METADATA_KEYS}} for n in names]
+            window = combine_transcript(segments, records)
+            combined.extend(window)
+            _write_json(out_dir / "combined_transcript.json", combined)
+            _write_json(out_dir / "llava_responses.json", captioner.results)
+            notes.append(loop.submit(note_for(window, f"window {k + 1}")) if window else None)
+            print(f"✅ Window {k + 1} processed in {time.time() - t0:.1f}s")
+
+            if args.rollup_every and (k + 1) % args.rollup_every == 0:
+                texts = _collect_notes(notes, out_dir)
+                partial = loop.submit(rollup(texts)).result()
+                (out_dir / "partial_feedback.txt").write_text(partial, encoding="utf-8")
+                print(f"📝 Partial feedback after {offset / 60 + args.window / 60:.0f} min → {out_dir / 'partial_feedback.txt'}")
+    finally:
+        source.close()
+
+    t_end = time.time()
+    texts = _collect_notes(notes, out_dir)
+    if not texts:
+        print("❌ No audio or frames were read from the source.")
+        sys.exit(1)
+    final = loop.submit(rollup(texts)).result()
+    out = out_dir / "Feedback_on_combined_transcript.txt"
+    out.write_text(final, encoding="utf-8")
+    print(f"\n✅ Final feedback {time.time() - t_end:.1f}s after the stream ended → {out}")
+    return out
+
+
+async def _make_client(args):
+    # created inside the loop that will use its locks and semaphores
+    return AsyncLLMClient(tpm=args.tpm, rpm=args.rpm)
+
+
+def _collect_notes(notes, out_dir):
+    """Wait for the submitted window notes and rewrite window_notes.jsonl; returns their texts."""
+    texts = []
+    with open(out_dir / "window_notes.jsonl", "w", encoding="utf-8") as f:
+        for i, fut in enumerate(notes, 1):
+            if fut is None:
+                continue
+            text = fut.result()
+            texts.append(text)
+            f.write(json.dumps({"window": i, "note": text}, ensure_ascii=False) + "\n")
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rolling-window analysis of a live or growing recording")
+    parser.add_argument("source", help="Growing file, named pipe, stream URL, or lavfi graph (with --input-format lavfi)")
+    parser.add_argument("--input-format", help="ffmpeg input format (-f), e.g. lavfi, mpegts")
+    parser.add_argument("--follow", action=argparse.BooleanOptionalAction, default=None,
+                        help="Tail the source as a growing file (default: on for regular files)")
+    parser.add_argument("--idle-timeout", type=float, default=30.0,
+                        help="Seconds without new data before a tailed file counts as finished")
+    parser.add_argument("--realtime", action="store_true", help="Read the input at its native rate (-re)")
+    parser.add_argument("--window", type=float, default=60.0, help="Window length in seconds (default: 60)")
+    parser.add_argument("--asr", choices=["hf", "whisper"], default="hf",
+                        help="hf = transformers whisper-large-v3 pipeline, whisper = openai-whisper")
+    parser.add_argument("--asr-model", help="Model name for the chosen ASR engine")
+    parser.add_argument("--interval", type=float, default=10.0, help="Transcript segment length for --asr hf")
+    parser.add_argument("--no-dedup", action="store_true", help="Caption every frame, even near-duplicates")
+    parser.add_argument("--rollup-every", type=int, default=5,
+                        help="Write partial_feedback.txt every N windows (0 = only at the end)")
+    parser.add_argument("--fan_out", type=int, default=FAN_OUT, help="Notes merged per call in the roll-up")
+    parser.add_argument("--model", default="gpt-4o", help="Model to use for feedback")
+    parser.add_argument("--summary_model", default="gpt-4o", help="Model to use for window notes and merges")
+    parser.add_argument("--tpm", type=int, default=TPM_LIMIT, help="Tokens-per-minute budget for the OpenAI org")
+    parser.add_argument("--rpm", type=int, default=RPM_LIMIT, help="Requests-per-minute budget for the OpenAI org")
+    parser.add_argument("--out-dir", help="Output folder (default: Combined_Pipeline_Outputs/Live_<timestamp>)")
+    add_cli_args(parser)
+    args = parser.parse_args()
+    metrics.configure(args.metrics, args.metrics_port)
+
+    if not os.getenv("OPENAI_API_KEY"):
+        print("Error: OPENAI_API_KEY environment variable is not set.", file=sys.stderr)
+        sys.exit(1)
+    args.out_dir = args.out_dir or ROOT / "Combined_Pipeline_Outputs" / f"Live_{datetime.now():%Y%m%d_%H%M}"
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
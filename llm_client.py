@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Async GPT-4o client paced by a real tokens-per-minute / requests-per-minute
+budget instead of fixed sleeps.
+
+Every request reserves its estimated size (prompt estimate + max_tokens, the
+same figure OpenAI charges against the TPM quota) from a continuously
+refilling token bucket before it is sent.  Once the response arrives the
+reservation is reconciled with `usage.total_tokens`, and the buckets are
+re-synchronised with the `x-ratelimit-remaining-*` headers so other clients
+of the same org are accounted for.  Requests therefore run concurrently as
+far as the quota allows and no further.
+
+    llm = AsyncLLMClient(tpm=28_000, estimate=message_tokens)
+    notes = asyncio.run(llm.complete_many([{"model": ..., "messages": ...}, ...]))
+
+Results come back in request order, and every completion goes through the
+shared stage cache (see stage_cache.py) under the same key as cached_chat().
+"""
+import asyncio
+import os
+import random
+import re
+import time
+
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+
+from pipeline_metrics import stage
+from stage_cache import cache, make_key
+from token_budget import message_tokens
+
+TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "28000"))
+RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+DEFAULT_REPLY_TOKENS = 1024
+MAX_CONCURRENCY = 8
+MAX_RETRIES = 6
+
+
+class TokenBucket:
+    """Bucket of <per_minute> units that refills continuously."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60.0)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until <amount> units are available (0 when they already are)."""
+        self._refill()
+        missing = amount - self.level
+        return 0.0 if missing <= 0 else missing * 60.0 / self.capacity
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+    def give_back(self, amount: float) -> None:
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+    def sync(self, remaining: float) -> None:
+        """Never believe we have more than the server says is left."""
+        self._refill()
+        self.level = min(self.level, remaining)
+
+
+class RateLimiter:
+    """TPM + RPM buckets; acquire() waits until both can cover the request."""
+
+    def __init__(self, tpm: int = TPM_LIMIT, rpm: int = RPM_LIMIT):
+        self.tokens = TokenBucket(tpm)
+        self.requests = TokenBucket(rpm)
+        self._lock = asyncio.Lock()     # FIFO: a large request is not starved by small ones
+
+    async def acquire(self, n_tokens: int) -> int:
+        """Reserve <n_tokens>; returns the amount actually reserved."""
+        n_tokens = min(n_tokens, int(self.tokens.capacity))   # an oversize request must still fit eventually
+        async with self._lock:
+            while True:
+                wait = max(self.tokens.wait_time(n_tokens), self.requests.wait_time(1))
+                if wait <= 0:
+                    self.tokens.take(n_tokens)
+                    self.requests.take(1)
+                    return n_tokens
+                await asyncio.sleep(wait)
+
+    def settle(self, reserved: int, used: int) -> None:
+        """Return (or charge) the difference between the reservation and real usage."""
+        if used < reserved:
+            self.tokens.give_back(reserved - used)
+        elif used > reserved:
+            self.tokens.take(used - reserved)
+
+    def observe(self, headers) -> None:
+        """Re-sync with the x-ratelimit-remaining-* response headers, when present."""
+        for name, bucket in (("x-ratelimit-remaining-tokens", self.tokens),
+                             ("x-ratelimit-remaining-requests", self.requests)):
+            value = headers.get(name) if headers is not None else None
+            if value is None:
+                continue
+            try:
+                bucket.sync(float(value))
+            except ValueError:
+                pass
+
+
+def _retry_after(headers) -> float | None:
+    """Seconds to wait from retry-after / x-ratelimit-reset-tokens ('1.5s', '6m0s', '120ms')."""
+    if headers is None:
+        return None
+    value = headers.get("retry-after") or headers.get("x-ratelimit-reset-tokens")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total or None
+
+
+def estimate_tokens(text: str, model: str = "gpt-4o") -> int:
+    """tiktoken count for <text> (+4 for role/JSON framing); see token_budget.message_tokens."""
+    return message_tokens(text, model)
+
+
+class AsyncLLMClient:
+    """Concurrent chat completions within a TPM/RPM budget, cached and retried."""
+
+    def __init__(self, tpm: int = TPM_LIMIT, rpm: int = RPM_LIMIT, estimate=None,
+                 max_concurrency: int = MAX_CONCURRENCY, api_key: str | None = None, client=None):
+        self.client = client or AsyncOpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"))
+        self.limiter = RateLimiter(tpm, rpm)
+        self.estimate = estimate
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    def _estimate(self, request: dict) -> int:
+        prompt = 0
+        for m in request["messages"]:
+            if self.estimate is not None:
+                prompt += self.estimate(m["content"])
+            else:
+                prompt += estimate_tokens(m["content"], request["model"])
+        return prompt + request.get("max_tokens", DEFAULT_REPLY_TOKENS)
+
+    async def complete(self, label: str = "", **request) -> str:
+        """One chat completion → stripped message text."""
+        key = make_key("llm", request.get("model"), {k: v for k, v in request.items() if k != "model"})
+        cached = cache.get_json(key)
+        if cached is not None:
+            print(f"♻️  [cache] llm hit ({label or 'request'})")
+            return cached
+
+        estimate = self._estimate(request)
+        async with self._sem:
+            with stage("llm", model=request.get("model"), label=label) as m:
+                for attempt in range(MAX_RETRIES + 1):
+                    reserved = await self.limiter.acquire(estimate)
+                    try:
+                        raw = await self.client.chat.completions.with_raw_response.create(**request)
+                    except RateLimitError as err:
+                        self.limiter.settle(reserved, 0)
+                        headers = getattr(err.response, "headers", None)
+                        self.limiter.observe(headers)
+                        if attempt == MAX_RETRIES:
+                            raise
+                        delay = _retry_after(headers) or min(60.0, 2 ** attempt) + random.random()
+                        print(f"⏳ Rate limited ({label or 'request'}); retrying in {delay:.1f}s")
+                        await asyncio.sleep(delay)
+                        continue
+                    except (APIConnectionError, APITimeoutError, InternalServerError):
+                        self.limiter.settle(reserved, 0)
+                        if attempt == MAX_RETRIES:
+                            raise
+                        await asyncio.sleep(min(60.0, 2 ** attempt) + random.random())
+                        continue
+
+                    self.limiter.observe(raw.headers)
+                    resp = raw.parse()
+                    used = resp.usage.total_tokens if resp.usage else reserved
+                    self.limiter.settle(reserved, used)
+                    if resp.usage:
+                        self.tokens_in += resp.usage.prompt_tokens
+                        self.tokens_out += resp.usage.completion_tokens
+                        m.add(tokens_in=resp.usage.prompt_tokens, tokens_out=resp.usage.completion_tokens,
+                              retries=attempt)
+                    text = resp.choices[0].message.content.strip()
+                    cache.put_json(key, text)
+                    print(f"✅ {label or 'request'} done ({used} tokens)")
+                    return text
+
+    async def complete_many(self, requests: list[dict], labels: list[str] | None = None) -> list[str]:
+        """Run <requests> concurrently within the budget; results keep the input order."""
+        labels = labels or [f"{i}/{len(requests)}" for i in range(1, len(requests) + 1)]
+        return await asyncio.gather(*(self.complete(label, **r) for r, label in zip(requests, labels)))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Overlapping-window chunking and boundary-aware word stitching.
+
+Hard chunk boundaries cut words in half: the word straddling the cut is
+garbled or missing on both sides.  Decoding windows that overlap by a few
+seconds gives every boundary word one window in which it is whole; stitch()
+then keeps exactly one copy of the overlap:
+
+  1. the words of both windows that fall inside the overlap are aligned as
+     token sequences (difflib), and among the aligned pairs whose timestamps
+     also agree the one nearest the overlap midpoint becomes the junction –
+     the earlier window keeps everything before it, the later window the
+     junction word and everything after;
+  2. if nothing aligns (silence, or the two decodes disagree completely)
+     the overlap is cut at its midpoint by word start time.
+
+Windows then no longer need to be short to keep boundary losses rare, so
+ASR can run at Whisper's native 30 s context.
+
+    plan = plan_windows(duration, 30, 5)                 # [(start, length), ...]
+    words = stitch([asr(win) for win in windows], plan)  # words on the recording timeline
+
+Words are dicts with "start", "end" (recording seconds) and "text"; entries
+with a "type" other than "word" (ElevenLabs spacing) are carried along but
+never used as junctions.
+"""
+import math
+import re
+from difflib import SequenceMatcher
+
+MAX_SHIFT_S = 1.0         # aligned words whose starts differ by more than this are not the same word
+
+
+def plan_windows(duration: float, window_sec: float, overlap_sec: float = 0.0) -> list[tuple[float, float]]:
+    """[(start, length), ...] covering <duration> with <overlap_sec> shared between neighbours."""
+    if not window_sec or duration <= window_sec:
+        return [(0.0, duration)]
+    if not 0 <= overlap_sec < window_sec:
+        raise ValueError(f"overlap ({overlap_sec}s) must be shorter than the window ({window_sec}s)")
+    step = window_sec - overlap_sec
+    plan, start = [], 0.0
+    while start < duration:
+        plan.append((start, min(window_sec, duration - start)))
+        if start + window_sec >= duration:
+            break
+        start += step
+    return plan
+
+
+def _token(w) -> str:
+    if w.get("type", "word") != "word":
+        return ""
+    return re.sub(r"[^\w']+", "", str(w.get("text", "")).lower())
+
+
+def _start(w) -> float:
+    return w["start"] if w.get("start") is not None else (w.get("end") or 0.0)
+
+
+def _center(w) -> float:
+    end = w.get("end")
+    return (_start(w) + (end if end is not None else _start(w))) / 2
+
+
+def junction(prev: list[dict], nxt: list[dict], lo: float, hi: float,
+             max_shift: float = MAX_SHIFT_S) -> tuple[int, int]:
+    """
+    (i, j): keep prev[:i] + nxt[j:].  <lo>, <hi> bound the overlap of the two
+    windows on the recording timeline.
+    """
+    mid = (lo + hi) / 2
+    a_idx = [i for i, w in enumerate(prev) if _token(w) and (w.get("end") or _start(w)) > lo]
+    b_idx = [j for j, w in enumerate(nxt) if _token(w) and _start(w) < hi]
+    if a_idx and b_idx:
+        a = [_token(prev[i]) for i in a_idx]
+        b = [_token(nxt[j]) for j in b_idx]
+        best = None
+        for blk in SequenceMatcher(None, a, b, autojunk=False).get_matching_blocks():
+            for k in range(blk.size):
+                i, j = a_idx[blk.a + k], b_idx[blk.b + k]
+                if abs(_start(prev[i]) - _start(nxt[j])) > max_shift:
+                    continue
+                dist = abs(_center(nxt[j]) - mid)
+                if best is None or dist < best[0]:
+                    best = (dist, i, j)
+        if best is not None:
+            return best[1], best[2]
+    # nothing aligns: cut both windows at the overlap midpoint
+    i = next((k for k, w in enumerate(prev) if _start(w) >= mid), len(prev))
+    j = next((k for k, w in enumerate(nxt) if _start(w) >= mid), len(nxt))
+    return i, j
+
+
+def stitch(windows: list[list[dict]], plan: list[tuple[float, float]],
+           max_shift: float = MAX_SHIFT_S) -> list[dict]:
+    """Merge per-window word lists (already on the recording timeline) into one, overlaps deduplicated."""
+    words: list[dict] = []
+    for n, (win_words, (start, length)) in enumerate(zip(windows, plan)):
+        win_words = sorted(win_words, key=_start)
+        if n == 0 or not words:
+            words = list(win_words)
+            continue
+        prev_start, prev_len = plan[n - 1]
+        lo, hi = start, prev_start + prev_len
+        if hi <= lo:                        # no overlap: plain concatenation
+            words.extend(win_words)
+            continue
+        i, j = junction(words, win_words, lo, hi, max_shift)
+        words = words[:i] + win_words[j:]
+    return words
+
+
+def shift_words(words, offset: float) -> list[dict]:
+    """Copies of <words> moved <offset> seconds along the timeline."""
+    out = []
+    for w in words:
+        w = dict(w)
+        for key in ("start", "end"):
+            if w.get(key) is not None:
+                w[key] = round(w[key] + offset, 3)
+        out.append(w)
+    return out
+
+
+def bucket(words, step: float, total: float | None = None) -> list[dict]:
+    """Group stitched words into back-to-back [k*step, (k+1)*step) entries by start time."""
+    if total is not None:
+        n = max(1, math.ceil(total / step))
+    else:
+        n = int(max((_start(w) for w in words), default=0.0) // step) + 1
+    entries = [{"start": k * step, "end": (k + 1) * step, "words": []} for k in range(n)]
+    for w in words:
+        entries[min(int(_start(w) // step), n - 1)]["words"].append(w)
+    if total is not None and entries:
+        entries[-1]["end"] = max(total, entries[-1]["start"])
+    return entries
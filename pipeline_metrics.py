@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+Per-stage instrumentation shared by every pipeline.
+
+Stages report into one process-wide collector:
+
+    from pipeline_metrics import stage
+    with stage("demucs", audio_s=60) as m:
+        vocals = separate(...)
+        m.add(bytes_written=vocals.nbytes)
+
+Each finished stage becomes one record with its wall time, process CPU time
+(user + sys, all threads – concurrent stages each see the others' work),
+peak RSS so far, bytes read/written by the process (/proc/self/io: files,
+pipes and sockets), stage-cache hits/misses, tokens in/out where the stage
+reports them, and any extra fields passed in.  Records are appended as they
+finish to PIPELINE_METRICS (".jsonl" or ".csv"), and, with
+PIPELINE_METRICS_PORT set, totals per stage are served in the Prometheus
+text format at http://host:port/metrics.
+
+Profiling is switched on per stage, without code changes:
+
+  PIPELINE_PROFILE=demucs,llava     stages to profile ("*" for all)
+  PIPELINE_PROFILE_MODE=cprofile    cProfile → <stage>-<n>.prof (snakeviz, pstats)
+  PIPELINE_PROFILE_MODE=sample      wall-clock stack sampling → <stage>-<n>.folded,
+                                    collapsed stacks as written by py-spy
+                                    (flamegraph.pl, speedscope)
+  PIPELINE_PROFILE_DIR=profiles     where profiles go
+
+Usage:
+  python pipeline_metrics.py run_metrics.jsonl          # per-stage summary, slowest first
+"""
+import argparse
+import atexit
+import collections
+import contextlib
+import contextvars
+import cProfile
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:             # Windows
+    resource = None
+
+METRICS_PATH = os.getenv("PIPELINE_METRICS")
+METRICS_PORT = int(os.getenv("PIPELINE_METRICS_PORT", "0")) or None
+PROFILE_STAGES = {s.strip() for s in os.getenv("PIPELINE_PROFILE", "").split(",") if s.strip()}
+PROFILE_MODE = os.getenv("PIPELINE_PROFILE_MODE", "cprofile")
+PROFILE_DIR = Path(os.getenv("PIPELINE_PROFILE_DIR", "profiles"))
+SAMPLE_INTERVAL_S = 0.005
+
+FIELDS = ["stage", "parent", "started", "wall_s", "cpu_s", "peak_rss_mb", "bytes_read", "bytes_written",
+          "cache_hits", "cache_misses", "tokens_in", "tokens_out", "calls"]
+_COUNTERS = ("wall_s", "cpu_s", "bytes_read", "bytes_written", "cache_hits", "cache_misses",
+             "tokens_in", "tokens_out", "calls")
+
+_current = contextvars.ContextVar("pipeline_stage", default=None)
+_active_cprofile = threading.local()
+
+
+# ---------- process probes ----------
+def _cpu_s() -> float:
+    if resource is None:
+        return time.process_time()
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return ru.ru_utime + ru.ru_stime
+
+
+def _peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _io() -> tuple[int, int]:
+    """(rchar, wchar) for this process, or zeros where /proc is unavailable."""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(":") for line in f if ":" in line)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _cache_counts() -> tuple[int, int]:
+    stage_cache = sys.modules.get("stage_cache")
+    if stage_cache is None:
+        return 0, 0
+    return stage_cache.cache.hits, stage_cache.cache.misses
+
+
+# ---------- profiling ----------
+class _Sampler:
+    """Samples one thread's Python stack every <interval> s into collapsed-stack counts."""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL_S):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: Path):
+        with open(path, "w") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+
+def _profiling(name: str) -> bool:
+    return "*" in PROFILE_STAGES or name in PROFILE_STAGES
+
+
+# ---------- records ----------
+class StageRecord:
+    """Mutable record of one running stage; add() accumulates counters and extra fields."""
+
+    def __init__(self, name: str, parent: str | None, **extra):
+        self.name = name
+        self.parent = parent
+        # bytes added here are on top of the process's own I/O (e.g. an ffmpeg child's output)
+        self.values = dict.fromkeys(("tokens_in", "tokens_out", "bytes_read", "bytes_written"), 0)
+        self.extra = dict(extra)
+
+    def add(self, **values):
+        for k, v in values.items():
+            if k in self.values:
+                self.values[k] += v
+            else:
+                self.extra[k] = v
+        return self
+
+
+class Metrics:
+    """Collects stage records, writes them out and keeps Prometheus totals."""
+
+    def __init__(self, path=METRICS_PATH):
+        self.path = Path(path) if path else None
+        self.records: list[dict] = []
+        self.totals: dict[str, dict] = collections.defaultdict(lambda: dict.fromkeys(_COUNTERS, 0))
+        self.peak_rss_mb = 0.0
+        self._lock = threading.Lock()
+        self._profile_seq = collections.Counter()
+        self._server = None
+
+    def configure(self, path=None, port=None):
+        """Set the report file and/or start the /metrics endpoint (CLI flags call this)."""
+        if path:
+            self.path = Path(path)
+            os.environ["PIPELINE_METRICS"] = str(self.path.resolve())   # worker processes report too
+        if port:
+            self.serve(port)
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **extra):
+        parent = _current.get()
+        rec = StageRecord(name, parent.name if parent is not None else None, **extra)
+        token = _current.set(rec)
+        started = time.time()
+        t0, c0, io0, cache0 = time.perf_counter(), _cpu_s(), _io(), _cache_counts()
+        profiler = self._profiler(name)
+        try:
+            if profiler is None:
+                yield rec
+            else:
+                with profiler[0]:
+                    yield rec
+        finally:
+            _current.reset(token)
+            io1, cache1 = _io(), _cache_counts()
+            record = {
+                "stage": name,
+                "parent": rec.parent,
+                "started": round(started, 3),
+                "wall_s": round(time.perf_counter() - t0, 4),
+                "cpu_s": round(_cpu_s() - c0, 4),
+                "peak_rss_mb": _peak_rss_mb(),
+                "bytes_read": io1[0] - io0[0] + rec.values["bytes_read"],
+                "bytes_written": io1[1] - io0[1] + rec.values["bytes_written"],
+                "cache_hits": cache1[0] - cache0[0],
+                "cache_misses": cache1[1] - cache0[1],
+                "tokens_in": rec.values["tokens_in"],
+                "tokens_out": rec.values["tokens_out"],
+                "calls": 1,
+                **rec.extra,
+            }
+            if profiler is not None:
+                record["profile"] = profiler[1]()
+            self.record(record)
+
+    def record(self, record: dict):
+        """Add a finished record (stage() does this; async code can call it directly)."""
+        record.setdefault("calls", 1)
+        with self._lock:
+            self.records.append(record)
+            totals = self.totals[record["stage"]]
+            for k in _COUNTERS:
+                totals[k] += record.get(k) or 0
+            self.peak_rss_mb = max(self.peak_rss_mb, record.get("peak_rss_mb") or 0)
+            if self.path is not None:
+                self._append(record)
+
+    def _append(self, record: dict):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.suffix == ".csv":
+            new = not self.path.exists()
+            with open(self.path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDS + ["extra"], extrasaction="ignore")
+                if new:
+                    writer.writeheader()
+                extra = {k: v for k, v in record.items() if k not in FIELDS}
+                writer.writerow({**record, "extra": json.dumps(extra, default=str) if extra else ""})
+        else:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def _profiler(self, name: str):
+        """(context manager, finish() → profile path) when <name> is being profiled, else None."""
+        if not _profiling(name):
+            return None
+        with self._lock:
+            self._profile_seq[name] += 1
+            seq = self._profile_seq[name]
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        stem = PROFILE_DIR / f"{name.replace(' ', '_').replace('/', '_')}-{seq}"
+        if PROFILE_MODE == "sample":
+            sampler = _Sampler(threading.get_ident())
+
+            def finish():
+                sampler.write(stem.with_suffix(".folded"))
+                return str(stem.with_suffix(".folded"))
+            return sampler, finish
+
+        if getattr(_active_cprofile, "on", False):
+            return None                 # one cProfile per thread: a profiled parent already covers this stage
+        prof = cProfile.Profile()
+
+        @contextlib.contextmanager
+        def run():
+            _active_cprofile.on = True
+            prof.enable()
+            try:
+                yield
+            finally:
+                prof.disable()
+                _active_cprofile.on = False
+
+        def finish():
+            prof.dump_stats(stem.with_suffix(".prof"))
+            return str(stem.with_suffix(".prof"))
+        return run(), finish
+
+    # ---------- views ----------
+    def summary(self) -> list[dict]:
+        """Per-stage totals, slowest first."""
+        with self._lock:
+            rows = [{"stage": k, **v} for k, v in self.totals.items()]
+        return sorted(rows, key=lambda r: -r["wall_s"])
+
+    def prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            items = sorted(self.totals.items())
+            peak = self.peak_rss_mb
+        for field in _COUNTERS:
+            metric = f"pipeline_stage_{field}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for name, totals in items:
+                label = name.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'{metric}{{stage="{label}"}} {totals[field]}')
+        lines.append("# TYPE pipeline_peak_rss_megabytes gauge")
+        lines.append(f"pipeline_peak_rss_megabytes {max(peak, _peak_rss_mb() or 0)}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = METRICS_PORT, host: str = "0.0.0.0"):
+        """Serve prometheus() at /metrics from a daemon thread."""
+        if self._server is not None:
+            return self._server
+        collector = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = collector.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f"📈 Metrics at http://{host}:{self._server.server_address[1]}/metrics")
+        return self._server
+
+    def print_summary(self):
+        rows = self.summary()
+        if not rows:
+            return
+        print(format_table(rows))
+
+
+def format_table(rows) -> str:
+    out = [f"{'stage':<24} {'calls':>5} {'wall s':>9} {'cpu s':>9} {'read MB':>8} {'write MB':>8} "
+           f"{'hits':>5} {'tok in':>8} {'tok out':>8}"]
+    for r in rows:
+        out.append(f"{r['stage'][:24]:<24} {r['calls']:>5} {r['wall_s']:>9.2f} {r['cpu_s']:>9.2f} "
+                   f"{r['bytes_read'] / 1e6:>8.1f} {r['bytes_written'] / 1e6:>8.1f} {r['cache_hits']:>5} "
+                   f"{r['tokens_in']:>8} {r['tokens_out']:>8}")
+    return "\n".join(out)
+
+
+metrics = Metrics()
+stage = metrics.stage           # also usable as a decorator: @stage("demucs")
+
+
+def note(**values):
+    """add() to the innermost running stage, if any (for code that is wrapped by a decorator)."""
+    rec = _current.get()
+    if rec is not None:
+        rec.add(**values)
+
+if METRICS_PORT:
+    import multiprocessing
+    if multiprocessing.parent_process() is None:        # spawned workers re-import this module
+        metrics.serve(METRICS_PORT)
+
+
+@atexit.register
+def _print_at_exit():
+    import multiprocessing
+    if multiprocessing.parent_process() is not None:       # pool workers: the parent prints
+        return
+    if metrics.records and (metrics.path is not None or PROFILE_STAGES):
+        print("\n📊 Stage metrics")
+        metrics.print_summary()
+
+
+def timed(iterable, name: str, **extra):
+    """
+    Yield from <iterable>, recording the time spent waiting on it as one
+    <name> record – for producer stages such as streamed frame extraction.
+    """
+    wall = cpu = 0.0
+    items = 0
+    it = iter(iterable)
+    try:
+        while True:
+            t0, c0 = time.perf_counter(), _cpu_s()
+            try:
+                item = next(it)
+            except StopIteration:
+                break
+            finally:
+                wall += time.perf_counter() - t0
+                cpu += _cpu_s() - c0
+            items += 1
+            yield item
+    finally:
+        metrics.record({"stage": name, "parent": None, "started": None, "wall_s": round(wall, 4),
+                        "cpu_s": round(cpu, 4), "peak_rss_mb": _peak_rss_mb(), "items": items, **extra})
+
+
+def add_cli_args(parser):
+    """--metrics / --metrics-port for the entry points."""
+    parser.add_argument("--metrics", default=METRICS_PATH,
+                        help="Append per-stage metrics to this .jsonl or .csv file (env PIPELINE_METRICS)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Serve Prometheus-format stage totals on this port (env PIPELINE_METRICS_PORT)")
+
+
+def load_records(path) -> list[dict]:
+    path = Path(path)
+    with open(path, newline="") as f:
+        if path.suffix == ".csv":
+            rows = []
+            for row in csv.DictReader(f):
+                for k in _COUNTERS + ("peak_rss_mb",):
+                    value = float(row[k]) if row.get(k) not in (None, "") else 0.0
+                    row[k] = int(value) if value.is_integer() and k not in ("wall_s", "cpu_s") else value
+                rows.append(row)
+            return rows
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise a pipeline metrics report")
+    parser.add_argument("report", help=".jsonl or .csv written through PIPELINE_METRICS / --metrics")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    collector = Metrics(path=None)
+    for rec in load_records(args.report):
+        collector.record(rec)
+    rows = collector.summary()
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(format_table(rows))
+
+
+if __name__ == "__main__":
+    main()
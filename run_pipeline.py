@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+End-to-end lesson evaluation: audio and visual branches in parallel, then combine.
+
+The audio branch (ElevenLabs or Whisper large-v3 → timed transcript
+segments) and the visual branch (LLaVA frame captions) run at the same time
+in separate processes, each with its own GPU / CPU-thread budget.  As soon as
+both have written their JSON, combine_audio_video_feedback merges them and
+generates the final feedback, so a lesson takes max(audio, video) + combine
+instead of the sum.  Per-stage timings and the critical path are printed and
+saved next to the outputs.
+
+Usage:
+  python run_pipeline.py path/to/video.mp4
+  python run_pipeline.py path/to/video.mp4 --audio whisper --audio-gpus 1 --video-gpus 0
+  python run_pipeline.py path/to/video.mp4 --audio-gpus "" --audio-threads 4   # audio on CPU
+  python run_pipeline.py path/to/video.mp4 --teacher-only                      # GPT sees only the teacher
+
+Outputs (default Combined_Pipeline_Outputs/<name>_Output_<ddmmyyyy>/):
+  Audio Outputs/     transcript JSON and its interval segments
+  Video Outputs/     llava_responses.json
+  session.timeline/  both branches as one columnar store (timeline_store.py)
+  combined_transcript.json, Feedback_on_combined_transcript.txt, timings.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from multiprocessing import get_context
+from pathlib import Path
+
+from pipeline_metrics import add_cli_args, metrics
+
+ROOT = Path(__file__).resolve().parent
+
+
+def _set_budget(gpus, threads):
+    """Process initializer: must run before torch / numpy are imported in the worker."""
+    if gpus is not None:
+        os.environ["CUDA_VISIBLE_DEVICES"] = gpus
+    if threads:
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            os.environ[var] = str(threads)
+    sys.path.insert(0, str(ROOT))
+
+
+def _stage(timings, name, t0):
+    timings.append({"stage": name, "start": t0, "end": time.time()})
+
+
+def _tag_speakers(video_path, transcript_json, timings):
+    """Add speaker / teacher tags (diarize.py) to the segments in <transcript_json>."""
+    from diarize import SR, diarize, load_audio, tag_segments
+    t0 = time.time()
+    turns, info = diarize(load_audio(video_path), SR)
+    with open(transcript_json, encoding="utf-8") as f:
+        segments = json.load(f)
+    with open(transcript_json, "w", encoding="utf-8") as f:
+        json.dump(tag_segments(segments, turns), f, ensure_ascii=False, indent=2)
+    with open(Path(transcript_json).with_name(f"{Path(video_path).stem}_speakers.json"), "w") as f:
+        json.dump({**info, "turns": turns}, f, indent=2)
+    _stage(timings, "audio: diarize", t0)
+
+
+# ---------- branches (run in worker processes) ----------
+def audio_branch(video_path, out_dir, engine, interval, speakers=False):
+    from batch_runner import load_module
+    timings = []
+    stem = Path(video_path).stem
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    if engine == "whisper":
+        t0 = time.time()
+        mod = load_module("whisperlarge_v3_main", ROOT / "whisperlarge_v3" / "main.py")
+        mod.get_recognizer()
+        _stage(timings, "audio: load whisper", t0)
+        t0 = time.time()
+        out = mod.run(video_path, output_dir=str(out_dir), batched=True, chunk_sec=interval)
+        _stage(timings, "audio: transcribe", t0)
+        if speakers:
+            _tag_speakers(video_path, out, timings)
+        return out, timings
+
+    api_key = os.getenv("ELEVENLABS_API_KEY")
+    if not api_key:
+        raise RuntimeError("set ELEVENLABS_API_KEY for the ElevenLabs audio branch")
+    folder = ROOT / "eleven_labs"
+    eleven = load_module("eleven_labs_main", folder / "main.py", [folder])
+    splitter = load_module("split_to_intervals", folder / "split_to_intervals.py", [folder])
+
+    t0 = time.time()
+    model = os.getenv("ELEVEN_LABS_SCRIBE_MODEL", "scribe_v1")
+    transcript = eleven.transcribe_video(video_path, api_key, model, "verbose_json", stream_audio=True)
+    with open(out_dir / f"{stem}.json", "w", encoding="utf-8") as f:
+        json.dump(transcript, f, ensure_ascii=False, indent=2)
+    _stage(timings, "audio: transcribe", t0)
+
+    t0 = time.time()
+    segments = splitter.make_segments(transcript.get("words", []), interval)
+    out = out_dir / f"{stem}_intervals_{int(interval)}s.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(segments, f, ensure_ascii=False, indent=2)
+    _stage(timings, "audio: segment", t0)
+    if speakers:
+        _tag_speakers(video_path, out, timings)
+    return str(out), timings
+
+
+def video_branch(video_path, out_dir, adaptive):
+    from batch_runner import load_module
+    timings = []
+    folder = ROOT / "LLaVA_GPT4o"
+    t0 = time.time()
+    mod = load_module("llava_gpt4o_main", folder / "main.py", [folder, folder / "utils"])
+    _stage(timings, "video: load llava", t0)
+
+    t0 = time.time()
+    fps = mod.ADAPTIVE_FPS if adaptive else mod.FPS
+    out = mod.run_llava_on_video(video_path, str(out_dir), fps=fps, adaptive=adaptive)
+    _stage(timings, "video: caption", t0)
+    return out, timings
+
+
+# ---------- orchestration ----------
+def critical_path(timings):
+    """Stages on the longest chain: the slower branch, then the combine stages."""
+    by_branch = {}
+    for t in timings:
+        by_branch.setdefault(t["stage"].split(":")[0], []).append(t)
+    branch_end = {b: max(t["end"] for t in ts) for b, ts in by_branch.items()}
+    slow = max((b for b in ("audio", "video") if b in branch_end), key=branch_end.get)
+    return [t["stage"] for t in timings if t["stage"].split(":")[0] in (slow, "combine")]
+
+
+def run(video_path, out_dir, args):
+    from combine_audio_video_feedback import (
+        load_audio_transcript, load_image_captions, combine_transcript, summarize_and_feedback, teacher_segments)
+    from llm_client import AsyncLLMClient
+    from timeline_store import SUFFIX as TIMELINE_SUFFIX, build as build_timeline
+
+    out_dir = Path(out_dir)
+    audio_dir, video_dir = out_dir / "Audio Outputs", out_dir / "Video Outputs"
+    ctx = get_context("spawn")          # fresh interpreters, so the budgets apply before torch loads
+    t_start = time.time()
+    with ProcessPoolExecutor(1, mp_context=ctx, initializer=_set_budget,
+                             initargs=(args.audio_gpus, args.audio_threads)) as audio_pool, \
+         ProcessPoolExecutor(1, mp_context=ctx, initializer=_set_budget,
+                             initargs=(args.video_gpus, args.video_threads)) as video_pool:
+        print("🔹 Starting audio and video branches...")
+        audio_f = audio_pool.submit(audio_branch, video_path, str(audio_dir), args.audio, args.interval,
+                                    args.diarize or args.teacher_only)
+        video_f = video_pool.submit(video_branch, video_path, str(video_dir), args.adaptive)
+        audio_json, audio_t = audio_f.result()
+        print(f"✅ Audio branch done ({time.time() - t_start:.0f}s)")
+        image_json, video_t = video_f.result()
+        print(f"✅ Video branch done ({time.time() - t_start:.0f}s)")
+    timings = audio_t + video_t
+
+    t0 = time.time()
+    # one columnar store for the session; later stages and session analytics read it instead of the JSON
+    store = build_timeline(out_dir / f"session{TIMELINE_SUFFIX}", transcript=audio_json, llava=image_json,
+                           meta={"video": Path(video_path).name})
+    audio_data = load_audio_transcript(store)
+    if args.teacher_only:
+        audio_data = teacher_segments(audio_data)
+    combined = combine_transcript(audio_data, load_image_captions(store))
+    transcript_path = out_dir / "combined_transcript.json"
+    with open(transcript_path, "w", encoding="utf-8") as f:
+        json.dump(combined, f, ensure_ascii=False, indent=2)
+    _stage(timings, "combine: merge", t0)
+
+    t0 = time.time()
+    args.summary_tree = str(out_dir / "summary_tree.json")
+    llm = AsyncLLMClient(tpm=args.tpm, rpm=args.rpm)
+    feedback = asyncio.run(summarize_and_feedback(combined, llm, args))
+    feedback_path = out_dir / "Feedback_on_combined_transcript.txt"
+    feedback_path.write_text(feedback, encoding="utf-8")
+    _stage(timings, "combine: feedback", t0)
+    total = time.time() - t_start
+
+    path = critical_path(timings)
+    print(f"\n⏱️  {'stage':<22} {'start':>7} {'secs':>7}")
+    for t in sorted(timings, key=lambda t: t["start"]):
+        mark = " *" if t["stage"] in path else ""
+        print(f"   {t['stage']:<22} {t['start'] - t_start:>7.1f} {t['end'] - t['start']:>7.1f}{mark}")
+    serial = sum(t["end"] - t["start"] for t in timings)
+    print(f"   total {total:.1f}s (stages back to back: {serial:.1f}s); * = critical path")
+
+    with open(out_dir / "timings.json", "w") as f:
+        json.dump({"total_s": round(total, 2), "critical_path": path,
+                   "stages": [{"stage": t["stage"], "start_s": round(t["start"] - t_start, 2),
+                               "seconds": round(t["end"] - t["start"], 2)} for t in timings]}, f, indent=2)
+    print(f"✅ Feedback saved → {feedback_path}")
+    return feedback_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audio + video branches in parallel, then combined feedback")
+    parser.add_argument("video_path", help="Path to input MP4 video")
+    parser.add_argument("--out-dir", help="Output folder (default: Combined_Pipeline_Outputs/<name>_Output_<ddmmyyyy>)")
+    parser.add_argument("--audio", choices=["elevenlabs", "whisper"], default="elevenlabs",
+                        help="Audio branch engine (default: elevenlabs)")
+    parser.add_argument("--interval", type=float, default=10.0, help="Transcript segment length in seconds")
+    parser.add_argument("--diarize", action="store_true", help="Tag transcript segments with speaker / teacher")
+    parser.add_argument("--teacher-only", action="store_true",
+                        help="Diarise and send only the teacher's segments to the combine / GPT stage")
+    parser.add_argument("--adaptive", action="store_true", help="LLaVA: denser sampling around scene changes")
+    cpus = os.cpu_count() or 2
+    parser.add_argument("--audio-gpus", default=None, help="CUDA_VISIBLE_DEVICES for the audio branch ('' = CPU)")
+    parser.add_argument("--video-gpus", default=None, help="CUDA_VISIBLE_DEVICES for the video branch")
+    parser.add_argument("--audio-threads", type=int, default=max(1, cpus // 2), help="CPU threads for the audio branch")
+    parser.add_argument("--video-threads", type=int, default=max(1, cpus - cpus // 2), help="CPU threads for the video branch")
+    parser.add_argument("--chunk_size", type=int, default=None, help="Optional cap on segments per summarization chunk")
+    parser.add_argument("--max_input_tokens", type=int, default=None, help="Optional ceiling on input tokens per summarization call")
+    parser.add_argument("--fan_out", type=int, default=4, help="Summaries merged per call when reducing long transcripts")
+    parser.add_argument("--model", default="gpt-4o", help="Model to use for final feedback")
+    parser.add_argument("--summary_model", default="gpt-4o", help="Model to use for summarization")
+    parser.add_argument("--tpm", type=int, default=None, help="Tokens-per-minute budget for the OpenAI org")
+    parser.add_argument("--rpm", type=int, default=None, help="Requests-per-minute budget for the OpenAI org")
+    add_cli_args(parser)
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.video_path):
+        parser.error(f"file not found: {args.video_path}")
+    if not os.getenv("OPENAI_API_KEY"):
+        print("Error: OPENAI_API_KEY environment variable is not set.", file=sys.stderr)
+        sys.exit(1)
+    from llm_client import TPM_LIMIT, RPM_LIMIT
+    args.tpm = args.tpm or TPM_LIMIT
+    args.rpm = args.rpm or RPM_LIMIT
+
+    stem = Path(args.video_path).stem
+    out_dir = args.out_dir or ROOT / "Combined_Pipeline_Outputs" / f"{stem}_Output_{date.today():%d%m%Y}"
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    # both branch processes append to the same report
+    metrics.configure(args.metrics or Path(out_dir) / "metrics.jsonl", args.metrics_port)
+    run(os.path.abspath(args.video_path), out_dir, args)
+
+
+if __name__ == "__main__":
+    main()
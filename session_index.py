@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Cross-session search over Combined_Pipeline_Outputs.
+
+Every lesson leaves a folder of loose transcripts, captions and feedback
+(<Teacher>_Output[_ddmmyyyy]/...).  index() ingests them into one SQLite
+database with an FTS5 full-text index, so questions across sessions are one
+query instead of a grep through folders:
+
+  sessions  one row per output folder: teacher and date parsed from its name
+  files     path, size and mtime of every ingested file – re-indexing only
+            reads new or changed files and drops rows of deleted ones
+  entries   one row per transcript segment, frame caption or feedback point,
+            with kind (segment / caption / feedback), label (caption prompt
+            or feedback section, e.g. child_engagement, strengths) and
+            start / end seconds where the source has them
+  fts       FTS5 index over the entry texts (porter stemming)
+
+Usage:
+  python session_index.py index                                   # incremental
+  python session_index.py search "prop*" --teacher Teacher2       # every prop mention
+  python session_index.py search "praise" --kind feedback --since 2025-05-01
+  python session_index.py trend --label child_engagement          # per session, in date order
+  python session_index.py trend --query "engag*" --teacher Teacher2
+  python session_index.py sessions
+"""
+import argparse
+import json
+import re
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+OUTPUTS = ROOT / "Combined_Pipeline_Outputs"
+DB_PATH = OUTPUTS / "sessions.db"
+EXTENSIONS = (".json", ".txt")
+CHUNK_SEC = 60            # "[Chunk i]" lines of the Demucs + Whisper transcripts
+FOLDER_RE = re.compile(r"^(?P<teacher>.+?)_Output(?:_(?P<date>\d{8}))?$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY, folder TEXT UNIQUE NOT NULL, teacher TEXT, date TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, session_id INTEGER NOT NULL, size INTEGER, mtime REAL);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY, session_id INTEGER NOT NULL, file TEXT NOT NULL,
+    kind TEXT NOT NULL, label TEXT, start REAL, "end" REAL, text TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS entries_session ON entries(session_id, kind, label);
+CREATE INDEX IF NOT EXISTS entries_file ON entries(file);
+CREATE INDEX IF NOT EXISTS sessions_teacher ON sessions(teacher, date);
+CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5(text, tokenize='porter unicode61');
+"""
+
+
+def connect(db_path=DB_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def parse_folder(name: str) -> tuple[str, str | None]:
+    """("Teacher2", "2025-05-09") for Teacher2_Output_09052025; date None when the name has none."""
+    m = FOLDER_RE.match(name)
+    if not m:
+        return name, None
+    date = m.group("date")
+    if date:
+        try:
+            date = datetime.strptime(date, "%d%m%Y").date().isoformat()
+        except ValueError:
+            date = None
+    return m.group("teacher"), date
+
+
+def _label(heading: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", heading.lower()).strip("_")
+
+
+# ---------- parsers: file content → (kind, label, start, end, text) ----------
+def _segments(items):
+    for seg in items:
+        text = (seg.get("transcript") or seg.get("text") or "").strip()
+        if text:
+            yield "segment", seg.get("speaker"), seg.get("start"), seg.get("end"), text
+        images = seg.get("images")
+        if images is None:
+            images = [{"time_s": seg.get("start"), **seg["image"]}] if seg.get("image") else []
+        seen = set()
+        for image in images:
+            for prompt, caption in image.items():
+                if prompt in ("frame", "time_s") or (prompt, caption) in seen:
+                    continue
+                seen.add((prompt, caption))       # near-duplicate frames repeat their keyframe's caption
+                yield "caption", prompt, image.get("time_s"), image.get("time_s"), caption
+
+
+def _captions(frames: dict):
+    from timeline_store import FRAME_METADATA_KEYS
+    for name, val in frames.items():
+        if isinstance(val, str):
+            m = re.search(r"(\d+)", name)
+            t = int(m.group(1)) * 10.0 if m else None      # one frame every 10 s
+            yield "caption", "description", t, t, val.strip()
+        elif not val.get("dup_of"):
+            for prompt, caption in val.items():
+                if prompt not in FRAME_METADATA_KEYS:
+                    yield "caption", prompt, val.get("time_s"), val.get("time_s"), caption
+
+
+def _feedback_json(data: dict):
+    for key, val in data.items():
+        for item in val if isinstance(val, list) else [val]:
+            yield "feedback", _label(key), None, None, str(item)
+
+
+def _feedback_text(text: str):
+    """Markdown-ish GPT feedback: one entry per paragraph or list item, labelled by its heading."""
+    label = None
+    for block in re.split(r"\n\s*\n|\n(?=\s*(?:\d+\.|[-*])\s)", text):
+        block = block.strip()
+        if not block:
+            continue
+        heading = re.match(r"^#+\s*(.+)$", block.splitlines()[0])
+        if heading:
+            label = _label(heading.group(1).strip("*: "))
+            block = "\n".join(block.splitlines()[1:]).strip()
+            if not block:
+                continue
+        elif re.match(r"^\*\*[^*]+\*\*:?$", block):          # a bold line on its own is a heading too
+            label = _label(block.strip("*: "))
+            continue
+        yield "feedback", label, None, None, block
+
+
+def _chunk_transcript(text: str):
+    for m in re.finditer(r"^\[Chunk (\d+)\]\s*(.*)$", text, re.MULTILINE):
+        i = int(m.group(1))
+        if m.group(2).strip():
+            yield "segment", None, (i - 1) * CHUNK_SEC, i * CHUNK_SEC, m.group(2).strip()
+
+
+def parse_file(path: Path):
+    """Entries of one output file; files this index does not understand yield nothing."""
+    text = path.read_text(encoding="utf-8", errors="replace")
+    fenced = re.match(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", text, re.DOTALL)
+    try:
+        data = json.loads(fenced.group(1) if fenced else text)
+    except ValueError:
+        data = None
+    if isinstance(data, list) and data and isinstance(data[0], dict):
+        return _segments(data)
+    if isinstance(data, dict):
+        if data and all(re.search(r"\.(jpe?g|png)$", k, re.I) for k in data):
+            return _captions(data)
+        return _feedback_json(data)
+    if data is not None:
+        return iter(())
+    if re.search(r"^\[Chunk \d+\]", text, re.MULTILINE):
+        return _chunk_transcript(text)
+    return _feedback_text(text)
+
+
+# ---------- indexing ----------
+def _session_id(conn, folder: Path) -> int:
+    teacher, date = parse_folder(folder.name)
+    conn.execute("INSERT OR IGNORE INTO sessions(folder, teacher, date) VALUES (?, ?, ?)",
+                 (folder.name, teacher, date))
+    return conn.execute("SELECT id FROM sessions WHERE folder = ?", (folder.name,)).fetchone()[0]
+
+
+def _drop_file(conn, rel: str):
+    conn.execute("DELETE FROM fts WHERE rowid IN (SELECT id FROM entries WHERE file = ?)", (rel,))
+    conn.execute("DELETE FROM entries WHERE file = ?", (rel,))
+    conn.execute("DELETE FROM files WHERE path = ?", (rel,))
+
+
+def index(root=OUTPUTS, db_path=DB_PATH) -> dict:
+    """Bring the database up to date with <root>; returns counts of new / changed / removed / unchanged files."""
+    root = Path(root)
+    conn = connect(db_path)
+    known = {p: (size, mtime) for p, size, mtime in conn.execute("SELECT path, size, mtime FROM files")}
+    counts = {"new": 0, "changed": 0, "removed": 0, "unchanged": 0, "entries": 0}
+    seen = set()
+    with conn:
+        for folder in sorted(p for p in root.iterdir() if p.is_dir() and not p.name.endswith(".timeline")):
+            for path in sorted(folder.rglob("*")):
+                if path.suffix not in EXTENSIONS or not path.is_file() or ".timeline" in path.parent.name:
+                    continue
+                rel = path.relative_to(root).as_posix()
+                seen.add(rel)
+                st = path.stat()
+                if known.get(rel) == (st.st_size, st.st_mtime):
+                    counts["unchanged"] += 1
+                    continue
+                counts["changed" if rel in known else "new"] += 1
+                _drop_file(conn, rel)
+                sid = _session_id(conn, folder)
+                for kind, label, start, end, text in parse_file(path):
+                    cur = conn.execute(
+                        'INSERT INTO entries(session_id, file, kind, label, start, "end", text) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (sid, rel, kind, label, start, end, text))
+                    conn.execute("INSERT INTO fts(rowid, text) VALUES (?, ?)", (cur.lastrowid, text))
+                    counts["entries"] += 1
+                conn.execute("INSERT INTO files(path, session_id, size, mtime) VALUES (?, ?, ?, ?)",
+                             (rel, sid, st.st_size, st.st_mtime))
+        for rel in set(known) - seen:
+            _drop_file(conn, rel)
+            counts["removed"] += 1
+        conn.execute("DELETE FROM sessions WHERE id NOT IN (SELECT session_id FROM files)")
+    conn.close()
+    return counts
+
+
+# ---------- queries ----------
+def _filters(args, alias="e"):
+    where, params = [], []
+    for column, value in (("s.teacher", args.teacher), (f"{alias}.kind", getattr(args, "kind", None)),
+                          (f"{alias}.label", args.label)):
+        if value:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if args.since:
+        where.append("s.date >= ?")
+        params.append(args.since)
+    if args.until:
+        where.append("s.date <= ?")
+        params.append(args.until)
+    return where, params
+
+
+def search(conn, query: str, args) -> list[tuple]:
+    """(folder, date, kind, label, start, snippet) of the best matches, most relevant first."""
+    where, params = _filters(args)
+    sql = f"""
+        SELECT s.folder, s.date, e.kind, e.label, e.start, snippet(fts, 0, '[', ']', '…', 16)
+        FROM fts JOIN entries e ON e.id = fts.rowid JOIN sessions s ON s.id = e.session_id
+        WHERE fts MATCH ? {''.join(' AND ' + w for w in where)}
+        ORDER BY bm25(fts) LIMIT ?"""
+    return conn.execute(sql, [query, *params, args.limit]).fetchall()
+
+
+def trend(conn, args) -> list[tuple]:
+    """(folder, teacher, date, matching entries, entries of that kind) per session, oldest first."""
+    where, params = _filters(args)
+    match = "AND e.id IN (SELECT rowid FROM fts WHERE fts MATCH ?)" if args.query else ""
+    kind = "AND e.kind = ?" if args.kind else ""
+    sql = f"""
+        SELECT s.folder, s.teacher, s.date,
+               (SELECT count(*) FROM entries e WHERE e.session_id = s.id {match}
+                {''.join(' AND ' + w for w in where if w.startswith('e.'))}),
+               (SELECT count(*) FROM entries e WHERE e.session_id = s.id {kind})
+        FROM sessions s
+        WHERE 1 {''.join(' AND ' + w for w in where if w.startswith('s.'))}
+        ORDER BY s.date IS NULL, s.date, s.folder"""
+    e_params = [p for w, p in zip(where, params) if w.startswith("e.")]
+    s_params = [p for w, p in zip(where, params) if w.startswith("s.")]
+    return conn.execute(sql, ([args.query] if args.query else []) + e_params + ([args.kind] if args.kind else [])
+                        + s_params).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index and query transcripts, captions and feedback across sessions")
+    parser.add_argument("--db", default=str(DB_PATH), help=f"SQLite database (default: {DB_PATH.relative_to(ROOT)})")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("index", help="Ingest new or changed output files")
+    p.add_argument("root", nargs="?", default=str(OUTPUTS))
+    for name in ("search", "trend"):
+        p = sub.add_parser(name)
+        if name == "search":
+            p.add_argument("query", help="FTS5 query, e.g. 'prop*' or '\"open ended\" NEAR questions'")
+            p.add_argument("--limit", type=int, default=30)
+        else:
+            p.add_argument("--query", help="Only count entries matching this FTS5 query")
+        p.add_argument("--teacher")
+        p.add_argument("--kind", choices=["segment", "caption", "feedback"])
+        p.add_argument("--label", help="Caption prompt or feedback section, e.g. child_engagement")
+        p.add_argument("--since", help="First session date (YYYY-MM-DD)")
+        p.add_argument("--until", help="Last session date (YYYY-MM-DD)")
+    sub.add_parser("sessions", help="List indexed sessions")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.cmd == "index":
+        counts = index(args.root, args.db)
+        print(f"🗂️  {counts['new']} new, {counts['changed']} changed, {counts['removed']} removed, "
+              f"{counts['unchanged']} unchanged file(s); {counts['entries']} entries added "
+              f"({time.perf_counter() - t0:.2f}s)")
+        return
+
+    conn = connect(args.db)
+    if args.cmd == "search":
+        rows = search(conn, args.query, args)
+        for folder, date, kind, label, start, snippet in rows:
+            at = f"{start:7.1f}s" if start is not None else " " * 8
+            print(f"{folder:<28} {date or '-':<10} {at} {kind}/{label or '-':<20} {snippet}")
+        print(f"🔎 {len(rows)} match(es) in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    elif args.cmd == "trend":
+        rows = trend(conn, args)
+        print(f"{'session':<28} {'date':<10} {'hits':>5} {'of':>5}")
+        for folder, teacher, date, hits, total in rows:
+            bar = "█" * round(20 * hits / total) if total else ""
+            print(f"{folder:<28} {date or '-':<10} {hits:>5} {total:>5}  {bar}")
+        print(f"📈 {len(rows)} session(s) in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    else:
+        for folder, teacher, date, n in conn.execute(
+                "SELECT s.folder, s.teacher, s.date, count(e.id) FROM sessions s LEFT JOIN entries e "
+                "ON e.session_id = s.id GROUP BY s.id ORDER BY s.teacher, s.date"):
+            print(f"{folder:<28} {teacher:<12} {date or '-':<10} {n:>6} entries")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Persistent content-addressed cache shared by every pipeline stage.
+
+A cache key is the sha256 of the stage name, model ID, parameters and the
+*content* hashes of the inputs (files or in-memory arrays/bytes), so a re-run
+only recomputes the stages whose inputs or settings actually changed.
+Entries live under PIPELINE_CACHE_DIR (default ~/.cache/classroom_pipeline)
+and the directory is kept below PIPELINE_CACHE_MAX_GB by evicting the least
+recently used entries.  Set PIPELINE_CACHE=0 to bypass it.
+
+Usage:
+  python stage_cache.py --stats
+  python stage_cache.py --clear
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+CACHE_DIR = Path(os.getenv("PIPELINE_CACHE_DIR", Path.home() / ".cache" / "classroom_pipeline"))
+MAX_BYTES = int(float(os.getenv("PIPELINE_CACHE_MAX_GB", "20")) * 1024 ** 3)
+ENABLED = os.getenv("PIPELINE_CACHE", "1").lower() not in ("0", "false", "off", "no")
+
+_HASH_BLOCK = 1 << 20
+_file_digests: dict[tuple, str] = {}
+
+
+def file_digest(path) -> str:
+    """sha256 of a file's bytes, memoised on (path, size, mtime) for the process lifetime."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    digest = _file_digests.get(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+                h.update(block)
+        digest = _file_digests[memo_key] = h.hexdigest()
+    return digest
+
+
+def content_digest(obj) -> str:
+    """sha256 of in-memory content: bytes, str, NumPy arrays/tensors or JSON-able values."""
+    h = hashlib.sha256()
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        h.update(obj)
+    elif isinstance(obj, str):
+        h.update(obj.encode("utf-8"))
+    elif hasattr(obj, "tobytes") and hasattr(obj, "dtype"):
+        h.update(f"{obj.dtype}{tuple(obj.shape)}".encode())
+        h.update(obj.tobytes())
+    elif hasattr(obj, "numpy") and hasattr(obj, "dtype"):        # torch.Tensor
+        return content_digest(obj.detach().cpu().numpy())
+    else:
+        h.update(json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+def make_key(stage: str, model=None, params=None, files=(), data=()) -> str:
+    """Cache key for one unit of work of <stage>."""
+    desc = {
+        "stage": stage,
+        "model": model,
+        "params": params or {},
+        "files": [file_digest(p) for p in files],
+        "data": [content_digest(d) for d in data],
+    }
+    return content_digest(desc)
+
+
+class StageCache:
+    """Directory-per-entry store with atomic writes and size-bounded LRU eviction."""
+
+    def __init__(self, root=CACHE_DIR, max_bytes: int = MAX_BYTES, enabled: bool = ENABLED):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._size = None           # bytes on disk, computed lazily on first write
+
+    # ---------- entry plumbing ----------
+    def _entry(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def _lookup(self, key: str) -> Path | None:
+        if not self.enabled:
+            return None
+        entry = self._entry(key)
+        if not entry.is_dir():
+            self.misses += 1
+            return None
+        self.hits += 1
+        os.utime(entry)             # mtime doubles as the LRU clock
+        return entry
+
+    def _store(self, key: str, write) -> None:
+        """Call write(tmp_dir) and atomically publish tmp_dir as the entry for <key>."""
+        if not self.enabled:
+            return
+        entry = self._entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(prefix=".tmp-", dir=self.root))
+        try:
+            write(tmp)
+            size = _dir_size(tmp)
+            try:
+                os.replace(tmp, entry)
+            except OSError:          # another process stored it first
+                shutil.rmtree(tmp, ignore_errors=True)
+                return
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        if self._size is not None:
+            self._size += size
+        self.evict()
+
+    # ---------- typed accessors ----------
+    def get_json(self, key: str):
+        """Cached JSON value, or None on a miss."""
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        with open(entry / "value.json", "r", encoding="utf-8") as f:
+            return json.load(f)["value"]
+
+    def put_json(self, key: str, value) -> None:
+        def write(tmp):
+            with open(tmp / "value.json", "w", encoding="utf-8") as f:
+                json.dump({"value": value}, f, ensure_ascii=False)
+        self._store(key, write)
+
+    def get_array(self, key: str):
+        """Cached NumPy array, or None on a miss."""
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        import numpy as np
+        return np.load(entry / "value.npy")
+
+    def put_array(self, key: str, arr) -> None:
+        import numpy as np
+
+        def write(tmp):
+            buf = io.BytesIO()
+            np.save(buf, arr)
+            (tmp / "value.npy").write_bytes(buf.getvalue())
+        self._store(key, write)
+
+    def get_files(self, key: str, dest_dir) -> list[str] | None:
+        """Copy cached files into <dest_dir>; None on a miss."""
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        dest_dir = Path(dest_dir)
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        with open(entry / "files.json", "r", encoding="utf-8") as f:
+            names = json.load(f)
+        out = []
+        for name in names:
+            dst = dest_dir / name
+            # copied, not hard-linked: later tools overwrite outputs in place
+            shutil.copy2(entry / "files" / name, dst)
+            out.append(dst.as_posix())
+        return out
+
+    def put_files(self, key: str, paths) -> None:
+        names = [Path(p).name for p in paths]
+
+        def write(tmp):
+            (tmp / "files").mkdir()
+            for p, name in zip(paths, names):
+                shutil.copy2(p, tmp / "files" / name)
+            with open(tmp / "files.json", "w", encoding="utf-8") as f:
+                json.dump(names, f)
+        self._store(key, write)
+
+    # ---------- maintenance ----------
+    def _entries(self):
+        if not self.root.is_dir():
+            return []
+        return [e for d in self.root.iterdir() if d.is_dir() and not d.name.startswith(".")
+                for e in d.iterdir() if e.is_dir()]
+
+    def evict(self) -> None:
+        """Drop least-recently-used entries until the cache fits in max_bytes."""
+        if self._size is None:
+            self._size = sum(_dir_size(e) for e in self._entries())
+        if self._size <= self.max_bytes:
+            return
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime)
+        for e in entries:
+            if self._size <= self.max_bytes:
+                break
+            size = _dir_size(e)
+            shutil.rmtree(e, ignore_errors=True)
+            self._size -= size
+
+    def clear(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+        self._size = 0
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {
+            "root": str(self.root),
+            "entries": len(entries),
+            "bytes": sum(_dir_size(e) for e in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+cache = StageCache()
+
+
+def cached_json(stage: str, compute, *, model=None, params=None, files=(), data=()):
+    """Return compute() for this unit of work, reusing a previous run's result when inputs match."""
+    key = make_key(stage, model, params, files, data)
+    value = cache.get_json(key)
+    if value is not None:
+        print(f"♻️  [cache] {stage} hit")
+        return value
+    value = compute()
+    if value is not None:
+        cache.put_json(key, value)
+    return value
+
+
+def cached_array(stage: str, compute, *, model=None, params=None, files=(), data=()):
+    """Like cached_json, for stages that produce a NumPy array."""
+    key = make_key(stage, model, params, files, data)
+    value = cache.get_array(key)
+    if value is not None:
+        print(f"♻️  [cache] {stage} hit")
+        return value
+    value = compute()
+    cache.put_array(key, value)
+    return value
+
+
+def cached_files(stage: str, compute, dest_dir, *, model=None, params=None, files=(), data=()):
+    """Like cached_json, for stages that produce a list of files in <dest_dir>."""
+    key = make_key(stage, model, params, files, data)
+    paths = cache.get_files(key, dest_dir)
+    if paths is not None:
+        print(f"♻️  [cache] {stage} hit")
+        return paths
+    paths = compute()
+    cache.put_files(key, paths)
+    return paths
+
+
+def cached_chat(client, **request) -> str:
+    """client.chat.completions.create(**request) → message text, cached on the full request."""
+    def compute():
+        from pipeline_metrics import stage
+        with stage("llm", model=request.get("model")) as m:
+            resp = client.chat.completions.create(**request)
+            if getattr(resp, "usage", None):
+                m.add(tokens_in=resp.usage.prompt_tokens, tokens_out=resp.usage.completion_tokens)
+        return resp.choices[0].message.content.strip()
+    return cached_json("llm", compute, model=request.get("model"),
+                       params={k: v for k, v in request.items() if k != "model"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the shared pipeline cache")
+    parser.add_argument("--stats", action="store_true", help="Print entry count and size")
+    parser.add_argument("--clear", action="store_true", help="Delete every cached entry")
+    args = parser.parse_args()
+    if args.clear:
+        cache.clear()
+        print(f"Cleared {cache.root}")
+    print(json.dumps(cache.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Align timed transcript segments with timed frame records.
+
+Both sides are sorted once and merge-joined with forward-only pointers, so
+aligning N segments with M frames costs O((N + M) log(N + M)) for the sorts
+plus the size of the output – no per-segment scan of every frame and no
+exact-float key matching.
+
+Modes:
+  overlap  every frame with start <= time_s < end           (default)
+  window   every frame with start - window <= time_s < end + window
+  nearest  the single frame closest to the segment start, if within
+           <window> seconds (window=None: always the closest one)
+
+    from timeline import align
+    matches = align(segments, frames, mode="overlap")   # one list of frames per segment
+"""
+MODES = ("overlap", "window", "nearest")
+
+
+def _sorted(items, key):
+    return sorted(range(len(items)), key=lambda i: key(items[i]))
+
+
+def align(segments, frames, mode="overlap", window=None,
+          seg_start=lambda s: s.get("start") or 0.0,
+          seg_end=lambda s: s.get("end") or 0.0,
+          frame_time=lambda f: f["time_s"]):
+    """
+    For each segment (in input order) the list of frames matched to it,
+    each list in time order.
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown alignment mode {mode!r}; expected one of {MODES}")
+    times = sorted((frame_time(f), i) for i, f in enumerate(frames))
+    order = _sorted(segments, seg_start)
+    out = [[] for _ in segments]
+    if not times:
+        return out
+
+    m = len(times)
+    lo = 0
+    if mode == "nearest":
+        for si in order:
+            t = seg_start(segments[si])
+            # lo ends on the last frame at or before t (starts only grow, so lo never moves back)
+            while lo + 1 < m and times[lo + 1][0] <= t:
+                lo += 1
+            best = lo
+            if lo + 1 < m and abs(times[lo + 1][0] - t) < abs(times[lo][0] - t):
+                best = lo + 1
+            if window is None or abs(times[best][0] - t) <= window:
+                out[si].append(frames[times[best][1]])
+        return out
+
+    pad = (window or 0.0) if mode == "window" else 0.0
+    for si in order:
+        start = seg_start(segments[si]) - pad
+        end = seg_end(segments[si]) + pad
+        while lo < m and times[lo][0] < start:
+            lo += 1
+        j = lo
+        while j < m and times[j][0] < end:
+            out[si].append(frames[times[j][1]])
+            j += 1
+    return out
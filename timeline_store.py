@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Columnar, memory-mapped store for timed pipeline output.
+
+Every stage used to hand off through pretty-printed JSON that the next stage
+re-parsed in full.  A timeline store keeps the same rows as typed NumPy
+columns in a directory:
+
+  start.npy, end.npy   float64 seconds (rows sorted by start)
+  source.npy           uint8   index into meta["sources"]  (asr, caption, gcp_speech, ...)
+  prompt.npy           int16   index into meta["prompts"]  (LLaVA feature key), -1 = none
+  speaker.npy          int16   index into meta["speakers"] (diarize.py tag), -1 = none
+  key.npy              int32   string id of the row's item (frame name, segment number)
+  text.npy             int32   string id of the text
+  strings.bin          all distinct strings, UTF-8, back to back
+  offsets.npy          int64   [n_strings + 1] byte offsets into strings.bin
+  meta.json            vocabularies, row count, longest row, free-form session info
+
+Strings are interned: a caption repeated on forty near-duplicate frames is
+stored once.  Columns open with mmap, so opening a multi-hour session costs
+a few page faults; between() finds a time range with two binary searches
+and reads only the strings of the rows it returns.  JSON in the old formats
+is still one export() away.
+
+    tl = Timeline.open("session.timeline")
+    for row in tl.between(600, 660).where(source="caption", prompt="engagement").records():
+        ...
+
+Usage:
+  python timeline_store.py import session.timeline --transcript a.json --llava llava_responses.json
+  python timeline_store.py import session.timeline --combined combined_transcript.json
+  python timeline_store.py import session.timeline --gcp chunks/chunk_*.json --chunk-sec 60
+  python timeline_store.py slice session.timeline 600 660 --source caption
+  python timeline_store.py export session.timeline --format llava --out llava_responses.json
+  python timeline_store.py info session.timeline
+"""
+import argparse
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+
+SOURCES = ("asr", "caption", "gcp_speech", "gcp_label")
+SUFFIX = ".timeline"
+# non-caption fields written by run_llava_on_frames (see combine_audio_video_feedback)
+FRAME_METADATA_KEYS = ("time_s", "time_min", "dup_of", "span_s")
+_COLUMNS = {"start": np.float64, "end": np.float64, "source": np.uint8, "prompt": np.int16,
+            "speaker": np.int16, "key": np.int32, "text": np.int32}
+
+
+class _Vocab:
+    """Insertion-ordered string → id table."""
+
+    def __init__(self, items=()):
+        self.ids = {}
+        for s in items:
+            self(s)
+
+    def __call__(self, s) -> int:
+        if s is None:
+            return -1
+        return self.ids.setdefault(s, len(self.ids))
+
+    @property
+    def items(self) -> list[str]:
+        return list(self.ids)
+
+
+class TimelineWriter:
+    """Collects rows, then writes them as one sorted store."""
+
+    def __init__(self, meta: dict | None = None):
+        self.rows = []
+        self.strings = _Vocab()
+        self.sources = _Vocab(SOURCES)
+        self.prompts = _Vocab()
+        self.speakers = _Vocab()
+        self.teachers = set()
+        self.meta = dict(meta or {})
+
+    def add(self, start, end, source: str, text: str, prompt: str | None = None, key: str | None = None,
+            speaker: str | None = None, teacher: bool = False):
+        start = float(start if start is not None else (end or 0.0))
+        end = float(end if end is not None else start)
+        if speaker is not None and teacher:
+            self.teachers.add(speaker)
+        self.rows.append((start, end, self.sources(source), self.prompts(prompt), self.speakers(speaker),
+                          self.strings(str(key) if key is not None else ""), self.strings(text or "")))
+
+    def save(self, path) -> Path:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        rows = sorted(self.rows, key=lambda r: r[0])        # stable: ties keep insertion order
+        columns = list(zip(*rows)) if rows else [[] for _ in _COLUMNS]
+        for (name, dtype), values in zip(_COLUMNS.items(), columns):
+            np.save(path / f"{name}.npy", np.asarray(values, dtype=dtype))
+
+        encoded = [s.encode("utf-8") for s in self.strings.items]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        (path / "strings.bin").write_bytes(b"".join(encoded))
+        np.save(path / "offsets.npy", offsets)
+
+        spans = [r[1] - r[0] for r in rows]
+        (path / "meta.json").write_text(json.dumps({
+            "rows": len(rows), "max_span": max(spans, default=0.0),
+            "sources": self.sources.items, "prompts": self.prompts.items,
+            "speakers": self.speakers.items, "teachers": sorted(self.teachers), **self.meta}, indent=2))
+        return path
+
+
+class Timeline:
+    """Read side: memory-mapped columns plus an index selection."""
+
+    def __init__(self, path, columns: dict, blob, offsets, meta: dict, index=None):
+        self.path = Path(path)
+        self.columns = columns
+        self.blob = blob
+        self.offsets = offsets
+        self.meta = meta
+        self.index = index                  # None = every row, in start order
+
+    @classmethod
+    def open(cls, path, mmap: bool = True) -> "Timeline":
+        path = Path(path)
+        mode = "r" if mmap else None
+        columns = {name: np.load(path / f"{name}.npy", mmap_mode=mode) for name in _COLUMNS}
+        blob_path = path / "strings.bin"
+        blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if mmap and blob_path.stat().st_size \
+            else np.frombuffer(blob_path.read_bytes(), dtype=np.uint8)
+        return cls(path, columns, blob, np.load(path / "offsets.npy", mmap_mode=mode),
+                   json.loads((path / "meta.json").read_text()))
+
+    def _view(self, index) -> "Timeline":
+        return Timeline(self.path, self.columns, self.blob, self.offsets, self.meta, index)
+
+    def __len__(self):
+        return self.meta["rows"] if self.index is None else len(self.index)
+
+    def column(self, name: str) -> np.ndarray:
+        col = self.columns[name]
+        return col if self.index is None else col[self.index]
+
+    def string(self, i: int) -> str:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def between(self, t0: float, t1: float) -> "Timeline":
+        """Rows overlapping [t0, t1); point rows (start == end) count when t0 <= start < t1."""
+        start, end = self.columns["start"], self.columns["end"]
+        lo = int(np.searchsorted(start, t0 - self.meta["max_span"], side="left"))
+        hi = int(np.searchsorted(start, t1, side="left"))
+        idx = np.arange(lo, hi)
+        s, e = start[lo:hi], end[lo:hi]
+        idx = idx[(e > t0) | (s >= t0)]
+        if self.index is not None:
+            idx = np.intersect1d(idx, self.index, assume_unique=True)
+        return self._view(idx)
+
+    def where(self, source: str | None = None, prompt: str | None = None, speaker: str | None = None,
+              teacher: bool | None = None) -> "Timeline":
+        """Rows matching every given field (unknown names match nothing)."""
+        idx = np.arange(self.meta["rows"]) if self.index is None else self.index
+        mask = np.ones(len(idx), dtype=bool)
+        for name, value, vocab in (("source", source, "sources"), ("prompt", prompt, "prompts"),
+                                   ("speaker", speaker, "speakers")):
+            if value is not None:
+                code = self.meta[vocab].index(value) if value in self.meta[vocab] else -2
+                mask &= self.columns[name][idx] == code
+        if teacher is not None:
+            codes = [self.meta["speakers"].index(s) for s in self.meta["teachers"]]
+            mask &= np.isin(self.columns["speaker"][idx], codes) == teacher
+        return self._view(idx[mask])
+
+    def texts(self) -> list[str]:
+        return [self.string(i) for i in self.column("text")]
+
+    def records(self) -> list[dict]:
+        """Rows as dicts, with vocabulary codes and string ids resolved."""
+        sources, prompts, speakers = self.meta["sources"], self.meta["prompts"], self.meta["speakers"]
+        teachers = set(self.meta["teachers"])
+        out = []
+        for s, e, src, p, spk, k, t in zip(*(self.column(name).tolist() for name in _COLUMNS)):
+            row = {"start": s, "end": e, "source": sources[src], "key": self.string(k), "text": self.string(t)}
+            if p >= 0:
+                row["prompt"] = prompts[p]
+            if spk >= 0:
+                row["speaker"] = speakers[spk]
+                row["teacher"] = speakers[spk] in teachers
+            out.append(row)
+        return out
+
+
+# ---------- importers ----------
+def _frame_time(name: str, seconds_per_frame: float) -> float:
+    m = re.search(r"(\d+)", name)
+    return int(m.group(1)) * seconds_per_frame if m else 0.0
+
+
+def add_transcript(writer: TimelineWriter, segments, source: str = "asr"):
+    """[{"start", "end", "text" | "transcript", "speaker"?, "teacher"?}, ...]"""
+    for i, seg in enumerate(segments):
+        writer.add(seg.get("start"), seg.get("end"), source, (seg.get("text") or seg.get("transcript") or "").strip(),
+                   key=i, speaker=seg.get("speaker"), teacher=seg.get("teacher", False))
+
+
+def add_llava(writer: TimelineWriter, responses: dict, seconds_per_frame: float = 10.0):
+    """llava_responses.json: {frame: {"time_s", <prompt>: caption, ...}} or the older {frame: caption}."""
+    for name, val in responses.items():
+        if isinstance(val, str):
+            t = _frame_time(name, seconds_per_frame)
+            writer.add(t, t, "caption", val.strip(), prompt="description", key=name)
+            continue
+        t = float(val.get("time_s", _frame_time(name, seconds_per_frame)))
+        for prompt, caption in val.items():
+            if prompt not in FRAME_METADATA_KEYS:
+                writer.add(t, t, "caption", caption, prompt=prompt, key=name)
+
+
+def add_combined(writer: TimelineWriter, combined):
+    """combined_transcript.json: segments with "transcript" and "images" (or the older single "image")."""
+    add_transcript(writer, combined)
+    for i, seg in enumerate(combined):
+        images = seg.get("images")
+        if images is None:
+            images = [{"frame": f"segment_{i:04d}", "time_s": seg.get("start") or 0.0, **seg["image"]}] \
+                if seg.get("image") else []
+        for image in images:
+            for prompt, caption in image.items():
+                if prompt not in ("frame", "time_s"):
+                    writer.add(image.get("time_s"), image.get("time_s"), "caption", caption,
+                               prompt=prompt, key=image.get("frame"))
+
+
+def _seconds(offset) -> float:
+    """GCP duration ("12.300s" or {"seconds", "nanos"}) in seconds."""
+    if isinstance(offset, dict):
+        return float(offset.get("seconds", 0)) + offset.get("nanos", 0) / 1e9
+    return float(str(offset or "0").rstrip("s") or 0)
+
+
+def add_gcp(writer: TimelineWriter, annotation: dict, offset: float = 0.0):
+    """One MessageToDict'd Video Intelligence result (chunk_XXX.json) starting <offset> s into the video."""
+    for result in annotation.get("annotationResults", []):
+        for speech in result.get("speechTranscriptions", []):
+            for alt in speech.get("alternatives", [])[:1]:
+                words = alt.get("words", [])
+                if not alt.get("transcript"):
+                    continue
+                start = _seconds(words[0].get("startTime")) if words else 0.0
+                end = _seconds(words[-1].get("endTime")) if words else start
+                writer.add(offset + start, offset + end, "gcp_speech", alt["transcript"].strip())
+        for label in result.get("segmentLabelAnnotations", []):
+            for seg in label.get("segments", []):
+                span = seg.get("segment", {})
+                writer.add(offset + _seconds(span.get("startTimeOffset")), offset + _seconds(span.get("endTimeOffset")),
+                           "gcp_label", label["entity"]["description"], prompt="label")
+
+
+def _chunk_index(path) -> int:
+    m = re.search(r"(\d+)", Path(path).stem)
+    return int(m.group(1)) if m else 0
+
+
+def build(path, transcript=None, llava=None, combined=None, gcp=(), chunk_sec: float = 60.0,
+          seconds_per_frame: float = 10.0, meta: dict | None = None) -> Path:
+    """Write a store at <path> from any mix of JSON files (paths or already-loaded objects)."""
+    load = lambda x: json.loads(Path(x).read_text(encoding="utf-8")) if isinstance(x, (str, Path)) else x
+    writer = TimelineWriter(meta)
+    if transcript is not None:
+        add_transcript(writer, load(transcript))
+    if llava is not None:
+        add_llava(writer, load(llava), seconds_per_frame)
+    if combined is not None:
+        add_combined(writer, load(combined))
+    for chunk in gcp:
+        add_gcp(writer, load(chunk), _chunk_index(chunk) * chunk_sec)
+    return writer.save(path)
+
+
+def is_store(path) -> bool:
+    return Path(path).is_dir() and (Path(path) / "meta.json").exists()
+
+
+# ---------- exporters (the JSON formats the stages used to exchange) ----------
+def transcript_json(tl: Timeline, source: str = "asr") -> list[dict]:
+    out = []
+    for r in tl.where(source=source).records():
+        seg = {"start": r["start"], "end": r["end"], "text": r["text"]}
+        if "speaker" in r:
+            seg["speaker"], seg["teacher"] = r["speaker"], r["teacher"]
+        out.append(seg)
+    return out
+
+
+def llava_json(tl: Timeline) -> dict:
+    frames = {}
+    for r in tl.where(source="caption").records():
+        entry = frames.setdefault(r["key"], {"time_s": r["start"], "time_min": r["start"] / 60.0})
+        entry[r.get("prompt", "description")] = r["text"]
+    return frames
+
+
+def combined_json(tl: Timeline, mode: str = "overlap", window=None) -> list[dict]:
+    from combine_audio_video_feedback import combine_transcript
+    frames = [{"frame": name, "time_s": val["time_s"],
+               "captions": {k: v for k, v in val.items() if k not in FRAME_METADATA_KEYS}}
+              for name, val in llava_json(tl).items()]
+    frames.sort(key=lambda fr: fr["time_s"])
+    return combine_transcript(transcript_json(tl), frames, mode=mode, window=window)
+
+
+EXPORTS = {"transcript": transcript_json, "llava": llava_json, "combined": combined_json}
+
+
+def export(path, fmt: str, out=None):
+    """Write (or return, without <out>) the store at <path> in one of the JSON formats in EXPORTS."""
+    data = EXPORTS[fmt](Timeline.open(path))
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, slice and export columnar timeline stores")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("import", help="Build a store from pipeline JSON")
+    p.add_argument("store")
+    p.add_argument("--transcript", help="Timed transcript JSON ([{start, end, text}])")
+    p.add_argument("--llava", help="llava_responses.json")
+    p.add_argument("--combined", help="combined_transcript.json")
+    p.add_argument("--gcp", nargs="*", default=[], help="GCP chunk_XXX.json annotation dumps")
+    p.add_argument("--chunk-sec", type=float, default=60.0, help="Length of the GCP chunks (default: 60)")
+    p.add_argument("--seconds-per-frame", type=float, default=10.0,
+                   help="Frame spacing for captions without time_s (default: 10)")
+    p = sub.add_parser("slice", help="Print the rows overlapping [t0, t1)")
+    p.add_argument("store")
+    p.add_argument("t0", type=float)
+    p.add_argument("t1", type=float)
+    p.add_argument("--source", choices=SOURCES)
+    p.add_argument("--prompt")
+    p = sub.add_parser("export", help="Write the store back out as JSON")
+    p.add_argument("store")
+    p.add_argument("--format", choices=EXPORTS, default="combined")
+    p.add_argument("--out", required=True)
+    p = sub.add_parser("info", help="Row counts per source and prompt")
+    p.add_argument("store")
+    args = parser.parse_args()
+
+    if args.cmd == "import":
+        path = build(args.store, args.transcript, args.llava, args.combined, args.gcp,
+                     args.chunk_sec, args.seconds_per_frame)
+        meta = json.loads((path / "meta.json").read_text())
+        print(f"🗂️  {meta['rows']} rows → {path}")
+    elif args.cmd == "slice":
+        for r in Timeline.open(args.store).between(args.t0, args.t1).where(args.source, args.prompt).records():
+            label = f"{r['source']}/{r['prompt']}" if "prompt" in r else r["source"]
+            print(f"{r['start']:8.1f} – {r['end']:8.1f}  {label:<24} {r['text']}")
+    elif args.cmd == "export":
+        export(args.store, args.format, args.out)
+        print(f"📝 {args.format} JSON → {args.out}")
+    else:
+        tl = Timeline.open(args.store)
+        print(f"🗂️  {len(tl)} rows, {len(tl.offsets) - 1} distinct strings ({len(tl.blob) / 1e6:.2f} MB)")
+        for src in tl.meta["sources"]:
+            rows = tl.where(source=src)
+            if len(rows):
+                prompts = np.bincount(rows.column("prompt")[rows.column("prompt") >= 0],
+                                      minlength=len(tl.meta["prompts"]))
+                detail = ", ".join(f"{tl.meta['prompts'][i]} {n}" for i, n in enumerate(prompts) if n)
+                print(f"   {src:<12} {len(rows):>7}  {detail}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Token budgeting shared by the GPT-4o summarisers.
+
+message_tokens() counts tokens with tiktoken (encodings are built once per
+model and counts are memoised per text), and pack() splits an ordered list of
+items into the fewest contiguous chunks whose input stays under a token
+ceiling.  chunk_ceiling() derives that ceiling from the org's TPM tier: one
+request (input + reply + safety buffer) must never exceed the per-minute
+quota or the model's context window, or it is rejected outright.
+
+    ceiling = chunk_ceiling(tpm=28_000, reply_tokens=1200, prompt_tokens=message_tokens(SYSTEM))
+    chunks = pack(lines, ceiling)                     # → [[line, ...], ...]
+"""
+from functools import lru_cache
+
+DEFAULT_MODEL = "gpt-4o"
+MESSAGE_OVERHEAD = 4            # role + JSON framing per chat message
+SAFETY_BUFFER = 3000
+CONTEXT_WINDOW = {"gpt-4o": 128_000, "gpt-4o-mini": 128_000}
+
+_encodings = {}
+
+
+def encoding(model: str = DEFAULT_MODEL):
+    """tiktoken encoding for <model>, built once; None when tiktoken is unavailable."""
+    if model not in _encodings:
+        try:
+            import tiktoken
+        except ImportError:
+            _encodings[model] = None
+        else:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("o200k_base")
+    return _encodings[model]
+
+
+@lru_cache(maxsize=65536)
+def message_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    """Tokens <text> costs as one chat message (len/4 estimate without tiktoken)."""
+    enc = encoding(model)
+    n = len(text) // 4 if enc is None else len(enc.encode(text))
+    return n + MESSAGE_OVERHEAD
+
+
+def chunk_ceiling(tpm: int, reply_tokens: int, prompt_tokens: int = 0,
+                  model: str = DEFAULT_MODEL, safety: int = SAFETY_BUFFER,
+                  max_input_tokens: int | None = None) -> int:
+    """Largest chunk (in tokens) one request can carry without breaching TPM or the context window."""
+    limit = min(tpm, CONTEXT_WINDOW.get(model, 128_000))
+    ceiling = limit - reply_tokens - safety - prompt_tokens
+    if max_input_tokens:
+        ceiling = min(ceiling, max_input_tokens)
+    if ceiling <= 0:
+        raise ValueError(f"no room for input: TPM {tpm} ≤ reply {reply_tokens} + prompt {prompt_tokens} + buffer {safety}")
+    return ceiling
+
+
+def _greedy(costs, ceiling, max_items=None):
+    bounds, start, total = [], 0, 0
+    for i, c in enumerate(costs):
+        full = max_items is not None and i - start >= max_items
+        if i > start and (total + c > ceiling or full):
+            bounds.append((start, i))
+            start, total = i, 0
+        total += c
+    if costs:
+        bounds.append((start, len(costs)))
+    return bounds
+
+
+def pack(items, ceiling: int, cost=None, max_items: int | None = None, balance: bool = True):
+    """
+    Split <items> (order kept) into the fewest chunks of at most <ceiling>
+    tokens – greedy filling is optimal for contiguous packing.  With
+    <balance>, the same number of chunks is then evened out so the last call
+    is not a tiny remainder.  An item larger than the ceiling gets a chunk of
+    its own.  <cost> defaults to message_tokens(str(item)).
+    """
+    cost = cost or (lambda item: message_tokens(str(item)))
+    costs = [cost(item) for item in items]
+    bounds = _greedy(costs, ceiling, max_items)
+    if balance and len(bounds) > 1:
+        # smallest ceiling that still needs no more chunks than the greedy pass
+        lo, hi = min(max(costs), ceiling), ceiling
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if len(_greedy(costs, mid, max_items)) <= len(bounds):
+                hi = mid
+            else:
+                lo = mid + 1
+        bounds = _greedy(costs, lo, max_items)
+    return [items[a:b] for a, b in bounds]
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Hierarchical map-reduce for partial summaries.
+
+Instead of one synthesis prompt that grows with the number of chunks, the
+partial notes are merged <fan_out> at a time, level by level, until one
+remains – so no prompt ever holds more than <fan_out> notes, however long the
+lesson.  Groups are formed left to right in fixed positions and every merge
+goes through AsyncLLMClient, whose stage cache is keyed on the exact request:
+a merge whose inputs did not change is a cache hit.  Appending minutes to a
+session (or editing one chunk) therefore only re-runs the merges on the path
+from the changed leaves to the root, O(log_fan_out N) calls.
+
+    top = asyncio.run(tree_reduce(notes, merge_request, llm, fan_out=4))
+    final = synthesise(top)          # at most fan_out notes, whatever len(notes) was
+
+Leaves must be cut stably for this to pay off: pack(..., balance=False)
+keeps every chunk but the last unchanged when content is appended.
+"""
+import json
+from pathlib import Path
+
+FAN_OUT = 4
+
+
+async def tree_reduce(leaves, merge_request, llm, fan_out: int = FAN_OUT, top: int | None = None,
+                      save_to=None) -> list[str]:
+    """
+    Reduce <leaves> (texts, chronological) level by level until at most <top>
+    (default: fan_out) remain, and return those, still in order – the
+    caller's final synthesis call then sees a bounded prompt.
+    merge_request(texts, level) builds the chat request that merges a group
+    of consecutive texts.  With <save_to>, every level is written there as JSON.
+    """
+    top = fan_out if top is None else max(1, top)
+    if fan_out < 2:
+        raise ValueError("fan_out must be at least 2")
+    levels = [list(leaves)]
+    while len(levels[-1]) > top:
+        nodes = levels[-1]
+        level = len(levels)
+        groups = [nodes[i:i + fan_out] for i in range(0, len(nodes), fan_out)]
+        todo = [i for i, g in enumerate(groups) if len(g) > 1]   # a lone node moves up unchanged
+        print(f"🌲 Level {level}: merging {len(nodes)} notes into {len(groups)}")
+        merged = await llm.complete_many(
+            [merge_request(groups[i], level) for i in todo],
+            labels=[f"merge L{level} {i + 1}/{len(groups)}" for i in todo])
+        parents = [g[0] for g in groups]
+        for i, text in zip(todo, merged):
+            parents[i] = text
+        levels.append(parents)
+
+    if save_to is not None:
+        Path(save_to).parent.mkdir(parents=True, exist_ok=True)
+        with open(save_to, "w", encoding="utf-8") as f:
+            json.dump({"fan_out": fan_out, "levels": levels}, f, ensure_ascii=False, indent=2)
+    return levels[-1]
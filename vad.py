@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Energy-based voice activity detection over a whole PCM buffer.
+
+Classroom recordings are mostly silence, transitions and children's
+activity noise; Demucs and Whisper cost the same per second whether anyone
+is talking or not.  speech_regions() finds the stretches worth sending to
+them, gather() packs those stretches into one compact buffer, and TimeMap
+maps timestamps in that buffer back to the original recording.
+
+Every 30 ms frame (10 ms hop) gets two features, computed for all frames at
+once with a strided view and a blockwise rFFT:
+
+  energy    RMS level in dB; the threshold adapts to the recording's noise
+            floor (a low percentile of all frames) plus MARGIN_DB
+  flatness  spectral flatness in the speech band; voiced speech is harmonic
+            (low flatness) while chairs, clapping and hiss are broadband
+
+A frame is speech when it is loud enough *and* not flat.  The frame mask is
+then cleaned up (gaps under MIN_SILENCE_S bridged, bursts under
+MIN_SPEECH_S dropped) and each region padded by PAD_S on both sides.
+
+    regions = speech_regions(audio, 16000)
+    compact, tmap = gather(audio, regions, 16000)
+    segs = whisper.transcribe(compact)["segments"]
+    starts = tmap.to_original([s["start"] for s in segs])
+
+Usage:
+  python vad.py recording.wav            # print regions and the kept fraction
+"""
+import argparse
+import json
+
+import numpy as np
+
+FRAME_MS = 30
+HOP_MS = 10
+MARGIN_DB = 12.0          # above the noise floor
+MIN_LEVEL_DB = -50.0      # never call anything quieter than this speech
+FLOOR_PERCENTILE = 10
+MAX_FLATNESS = 0.45       # 0 = pure tone, 1 = white noise
+SPEECH_BAND_HZ = (150, 4000)
+MIN_SPEECH_S = 0.25
+MIN_SILENCE_S = 0.6
+PAD_S = 0.3
+_FFT_BLOCK = 8192         # frames per rFFT block (bounds memory on long recordings)
+
+
+def _frames(audio: np.ndarray, sr: int, frame_ms=FRAME_MS, hop_ms=HOP_MS) -> np.ndarray:
+    """[n_frames, frame_len] strided view of <audio> (no copy)."""
+    frame, hop = int(sr * frame_ms / 1000), int(sr * hop_ms / 1000)
+    if len(audio) < frame:
+        audio = np.pad(audio, (0, frame - len(audio)))
+    n = 1 + (len(audio) - frame) // hop
+    return np.lib.stride_tricks.as_strided(
+        audio, shape=(n, frame), strides=(audio.strides[0] * hop, audio.strides[0]), writeable=False)
+
+
+def frame_features(audio: np.ndarray, sr: int) -> tuple[np.ndarray, np.ndarray]:
+    """(energy_db, flatness) per hop for a float32 mono buffer."""
+    audio = np.ascontiguousarray(audio, dtype=np.float32)
+    frames = _frames(audio, sr)
+    energy_db = 10 * np.log10(np.mean(np.square(frames, dtype=np.float64), axis=1) + 1e-10)
+
+    window = np.hanning(frames.shape[1]).astype(np.float32)
+    freqs = np.fft.rfftfreq(frames.shape[1], 1 / sr)
+    band = (freqs >= SPEECH_BAND_HZ[0]) & (freqs <= SPEECH_BAND_HZ[1])
+    flatness = np.empty(len(frames), dtype=np.float32)
+    for i in range(0, len(frames), _FFT_BLOCK):
+        power = np.abs(np.fft.rfft(frames[i:i + _FFT_BLOCK] * window, axis=1)[:, band]) ** 2 + 1e-12
+        flatness[i:i + _FFT_BLOCK] = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+    return energy_db, flatness
+
+
+def _runs(mask: np.ndarray) -> np.ndarray:
+    """[k, 2] start/stop indices of the True runs in <mask>."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.stack([np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)], axis=1)
+
+
+def speech_mask(audio: np.ndarray, sr: int, margin_db: float = MARGIN_DB,
+                max_flatness: float = MAX_FLATNESS) -> np.ndarray:
+    """Boolean speech decision per 10 ms hop, before smoothing."""
+    energy_db, flatness = frame_features(audio, sr)
+    floor = np.percentile(energy_db, FLOOR_PERCENTILE)
+    threshold = max(floor + margin_db, MIN_LEVEL_DB)
+    return (energy_db > threshold) & (flatness < max_flatness)
+
+
+def speech_regions(audio: np.ndarray, sr: int, pad: float = PAD_S,
+                   min_speech: float = MIN_SPEECH_S, min_silence: float = MIN_SILENCE_S,
+                   margin_db: float = MARGIN_DB, max_flatness: float = MAX_FLATNESS) -> list[tuple[float, float]]:
+    """Sorted, non-overlapping (start_s, end_s) speech regions of <audio>, padded by <pad>."""
+    if not len(audio):
+        return []
+    hop = HOP_MS / 1000
+    frame = FRAME_MS / 1000
+    runs = _runs(speech_mask(audio, sr, margin_db, max_flatness))
+    if not len(runs):
+        return []
+    starts, ends = runs[:, 0] * hop, runs[:, 1] * hop + (frame - hop)
+
+    # bridge short pauses, then drop short bursts (a cough, a dropped block)
+    keep = np.concatenate(([True], starts[1:] - ends[:-1] >= min_silence))
+    starts = starts[keep]
+    ends = np.maximum.reduceat(ends, np.flatnonzero(keep))
+    long_enough = ends - starts >= min_speech
+    starts, ends = starts[long_enough], ends[long_enough]
+
+    total = len(audio) / sr
+    starts = np.maximum(starts - pad, 0.0)
+    ends = np.minimum(ends + pad, total)
+    regions = []
+    for s, e in zip(starts, ends):          # padding can make neighbours touch
+        if regions and s <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], max(regions[-1][1], round(float(e), 3)))
+        else:
+            regions.append((round(float(s), 3), round(float(e), 3)))
+    return regions
+
+
+class TimeMap:
+    """Maps times in a gather()ed buffer back onto the original recording."""
+
+    def __init__(self, compact_starts, original_starts, lengths, offset: float = 0.0):
+        self.compact_starts = np.asarray(compact_starts, dtype=np.float64)
+        self.original_starts = np.asarray(original_starts, dtype=np.float64)
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        self.offset = offset
+
+    def to_original(self, t):
+        """Original-timeline seconds for compact time(s) <t> (scalar or array)."""
+        t = np.asarray(t, dtype=np.float64)
+        if not len(self.compact_starts):
+            return t + self.offset
+        i = np.clip(np.searchsorted(self.compact_starts, t, side="right") - 1, 0, len(self.compact_starts) - 1)
+        within = np.clip(t - self.compact_starts[i], 0, self.lengths[i])
+        out = self.original_starts[i] + within + self.offset
+        return float(out) if out.ndim == 0 else out
+
+    def shift(self, offset: float) -> "TimeMap":
+        """Same map for a buffer that itself starts <offset> s into the recording."""
+        return TimeMap(self.compact_starts, self.original_starts, self.lengths, self.offset + offset)
+
+
+def gather(audio: np.ndarray, regions, sr: int) -> tuple[np.ndarray, TimeMap]:
+    """Concatenate the <regions> of <audio> into one buffer, plus its TimeMap."""
+    bounds = [(int(s * sr), int(round(e * sr))) for s, e in regions]
+    bounds = [(a, b) for a, b in bounds if b > a]
+    if not bounds:
+        return np.zeros(0, dtype=np.float32), TimeMap([], [], [])
+    lengths = np.array([b - a for a, b in bounds])
+    compact_starts = np.concatenate(([0], np.cumsum(lengths)[:-1])) / sr
+    compact = np.concatenate([audio[a:b] for a, b in bounds]).astype(np.float32, copy=False)
+    return compact, TimeMap(compact_starts, [a / sr for a, _ in bounds], lengths / sr)
+
+
+def speech_fraction(regions, total_s: float) -> float:
+    return sum(e - s for s, e in regions) / total_s if total_s else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the speech regions of a WAV file")
+    parser.add_argument("wav_path")
+    parser.add_argument("--pad", type=float, default=PAD_S)
+    parser.add_argument("--margin-db", type=float, default=MARGIN_DB)
+    parser.add_argument("--json", action="store_true", help="Print regions as JSON")
+    args = parser.parse_args()
+
+    from scipy.io import wavfile
+    sr, audio = wavfile.read(args.wav_path)
+    if audio.dtype == np.int16:
+        audio = audio.astype(np.float32) / 32768.0
+    if audio.ndim == 2:
+        audio = audio.mean(axis=1)
+    regions = speech_regions(audio, sr, pad=args.pad, margin_db=args.margin_db)
+    if args.json:
+        print(json.dumps([{"start": round(s, 2), "end": round(e, 2)} for s, e in regions]))
+        return
+    for s, e in regions:
+        print(f"{s:8.2f} – {e:8.2f}  ({e - s:.2f}s)")
+    total = len(audio) / sr
+    print(f"🗣️  {len(regions)} region(s), {speech_fraction(regions, total):.0%} of {total:.1f}s kept")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,22 @@ import os
 import subprocess
 import tempfile
 
-# === Step 0: Set your OpenAI API Key ===
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# === Step 0: Clients are created on first use, so importing this module is cheap ===
+_client = None
+_model = None
 
-# === Step 1: Get the input file path ===
-input_file = sys.argv[1]  # e.g. python transcribe_and_evaluate.py path/to/video.mp4
-model = whisper.load_model("base")
+def get_client():
+    global _client
+    if _client is None:
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
+
+# === Step 1: Whisper weights are loaded once per process ===
+def get_model(name="base"):
+    global _model
+    if _model is None:
+        _model = whisper.load_model(name)
+    return _model
 
 # === Step 2: Chunk video into 1-minute segments ===
 def split_video(input_path, output_dir, chunk_length=60):
@@ -33,7 +43,7 @@ def transcribe_chunks(chunk_paths):
     full_transcript = ""
     for i, chunk_path in enumerate(chunk_paths):
         print(f"Transcribing chunk {i+1}/{len(chunk_paths)}: {chunk_path}")
-        result = model.transcribe(chunk_path)
+        result = get_model().transcribe(chunk_path)
         full_transcript += result["text"].strip() + " "
     return full_transcript.strip()
 
@@ -56,7 +66,7 @@ Return your evaluation as:
 - Areas for Improvement (bullet points)
 - Overall Summary (2-3 lines)
 """
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="gpt-4o",
         messages=[
             {"role": "system", "content": "You are an expert classroom evaluator."},
@@ -66,17 +76,23 @@ Return your evaluation as:
     )
     return response.choices[0].message.content
 
+def run(input_file):
+    """Chunk, transcribe and evaluate one video; returns (transcript, analysis)."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        chunk_paths = split_video(input_file, tmpdir)
+        full_transcript = transcribe_chunks(chunk_paths)
+    analysis = evaluate_transcript(full_transcript)
+    return full_transcript, analysis
+
 # === MAIN ===
 if __name__ == "__main__":
-    with tempfile.TemporaryDirectory() as tmpdir:
-        try:
-            chunk_paths = split_video(input_file, tmpdir)
-            full_transcript = transcribe_chunks(chunk_paths)
-            print("\n--- FULL TRANSCRIPTION ---\n")
-            print(full_transcript)
+    input_file = sys.argv[1]  # e.g. python transcribe_and_evaluate.py path/to/video.mp4
+    try:
+        full_transcript, analysis = run(input_file)
+        print("\n--- FULL TRANSCRIPTION ---\n")
+        print(full_transcript)
 
-            analysis = evaluate_transcript(full_transcript)
-            print("\n--- TEACHER PERFORMANCE ANALYSIS ---\n")
-            print(analysis)
-        except Exception as e:
-            print("❌ Error during processing:", e)
+        print("\n--- TEACHER PERFORMANCE ANALYSIS ---\n")
+        print(analysis)
+    except Exception as e:
+        print("❌ Error during processing:", e)
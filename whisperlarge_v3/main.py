@@ -4,8 +4,14 @@ Audio transcription pipeline:
   - Extracts audio from input MP4 and splits into 10-second WAV chunks using ffmpeg
   - Transcribes each chunk using Hugging Face's whisper-large-v3 model
   - Outputs JSON with start/end times and transcription text for each chunk
+  - --batched decodes the audio once into memory and feeds the windows to the
+    pipeline in batches (no chunk WAVs, no ffprobe), optionally with word or
+    segment timestamps
 Usage:
   python main.py path/to/video.mp4
+  python main.py path/to/video.mp4 --batched --batch-size 16 --timestamps word
+  python main.py path/to/video.mp4 --batched --chunk-sec 30 --overlap-sec 5   # stitched 30 s windows
+  python main.py path/to/video.mp4 --batched --backend onnx --threads 8     # CPU
 Output:
   Creates an 'outputs' directory containing chunked WAVs and a JSON transcript
 """
@@ -14,12 +20,26 @@ import os
 import subprocess
 import glob
 import json
+import sys
+import wave
+from pathlib import Path
 
+import numpy as np
 import torch
-from transformers import pipeline
 from tqdm import tqdm
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repo root
+from stage_cache import cache, cached_json, make_key
+from pipeline_metrics import add_cli_args, metrics, stage
+from overlap_stitch import bucket, plan_windows, stitch
+from inference_backends import HF_ASR_BACKEND, HF_ASR_BACKENDS, load_hf_asr, set_threads
 
+SR = 16000
+CHUNK_SEC = 10.0
+BACKEND = HF_ASR_BACKEND  # hf | hf-int8 | onnx (see inference_backends.py)
+
+
+@stage("ffmpeg split")
 def split_video(video_path, output_dir):
     os.makedirs(output_dir, exist_ok=True)
     chunk_pattern = os.path.join(output_dir, "chunk%03d.wav")
@@ -39,7 +59,26 @@ def split_video(video_path, output_dir):
     return files
 
 
+@stage("audio extract")
+def load_audio(video_path, sr=SR):
+    """Decode the audio track once into a float32 mono array at <sr> Hz."""
+    cmd = [
+        "ffmpeg", "-loglevel", "error",
+        "-i", video_path,
+        "-vn", "-ac", "1", "-ar", str(sr),
+        "-f", "f32le", "pipe:1",
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
 def get_duration(file_path):
+    # PCM WAV chunks carry their length in the header; only fall back to ffprobe for anything else
+    try:
+        with wave.open(file_path, "rb") as w:
+            return w.getnframes() / float(w.getframerate())
+    except (wave.Error, EOFError, OSError):
+        pass
     cmd = [
         "ffprobe",
         "-v", "error",
@@ -54,15 +93,36 @@ def get_duration(file_path):
         return 0.0
 
 
-def transcribe_chunks(chunk_files, model_name="openai/whisper-large-v3", device=None):
+_recognizers = {}
+
+
+def get_recognizer(model_name="openai/whisper-large-v3", device=None, backend=None):
+    """HF ASR pipeline, built once per (model, device, backend) and reused across calls."""
     device = device if device is not None else (0 if torch.cuda.is_available() else -1)
-    recognizer = pipeline("automatic-speech-recognition", model=model_name, device=device)
+    backend = backend or BACKEND
+    key = (model_name, device, backend)
+    if key not in _recognizers:
+        _recognizers[key] = load_hf_asr(model_name, backend, device)
+    return _recognizers[key]
+
+
+def _model_key(model_name):
+    """Cache identity of the model: quantised / exported backends transcribe slightly differently."""
+    return model_name if BACKEND == "hf" else f"{model_name}@{BACKEND}"
+
+
+@stage("asr")
+def transcribe_chunks(chunk_files, model_name="openai/whisper-large-v3", device=None):
+    def recognize(chunk):
+        # only load the model once a chunk actually misses the cache
+        return get_recognizer(model_name, device)(chunk).get("text", "").strip()
+
     transcripts = []
     for idx, chunk in enumerate(tqdm(chunk_files, desc="Transcribing chunks")):
         # compute start time based on 10-second segments
         start_time = idx * 10.0
-        result = recognizer(chunk)
-        text = result.get("text", "").strip()
+        text = cached_json("hf_asr", lambda: recognize(chunk),
+                           model=_model_key(model_name), files=[chunk])
         duration = get_duration(chunk)
         end_time = start_time + duration
         transcripts.append({
@@ -73,36 +133,167 @@ def transcribe_chunks(chunk_files, model_name="openai/whisper-large-v3", device=
     return transcripts
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Transcribe audio from an MP4 video into JSON chunks")
-    parser.add_argument("video_path", help="Path to input MP4 video")
-    args = parser.parse_args()
+def _offset_chunks(chunks, offset):
+    """Shift pipeline timestamps (relative to the window) onto the recording timeline."""
+    shifted = []
+    for c in chunks or []:
+        st, en = c.get("timestamp", (None, None))
+        shifted.append({
+            "start": None if st is None else round(offset + st, 3),
+            "end": None if en is None else round(offset + en, 3),
+            "text": c.get("text", "").strip(),
+        })
+    return shifted
 
-    video_path = args.video_path
-    if not os.path.isfile(video_path):
-        print(f"Error: File not found: {video_path}")
-        exit(1)
 
+def transcribe_batched(audio, model_name="openai/whisper-large-v3", device=None,
+                       batch_size=8, chunk_sec=CHUNK_SEC, timestamps="none", sr=SR, overlap_sec=0.0):
+    """
+    Transcribe an in-memory waveform in <chunk_sec> windows, <batch_size>
+    windows per forward pass.  Start/end come from sample counts.  With
+    timestamps="word" / "segment" each entry also carries a "words" /
+    "segments" list on the recording timeline.
+
+    With <overlap_sec> > 0 neighbouring windows share that much audio; they
+    are decoded with word timestamps and stitched (overlap_stitch.py), and
+    the output has one entry per chunk_sec - overlap_sec of recording.
+    """
+    if overlap_sec:
+        return _transcribe_overlapped(audio, model_name, device, batch_size, chunk_sec,
+                                      overlap_sec, timestamps, sr)
+    step = int(chunk_sec * sr)
+    windows = [audio[i:i + step] for i in range(0, len(audio), step)]
+    transcripts = []
+    for idx, (window, out) in enumerate(zip(windows, _decode_windows(
+            windows, model_name, device, batch_size, timestamps, sr))):
+        start_time = idx * step / sr
+        entry = {
+            "start": start_time,
+            "end": start_time + len(window) / sr,
+            "text": out["text"],
+        }
+        if timestamps != "none":
+            entry["words" if timestamps == "word" else "segments"] = _offset_chunks(out["chunks"], start_time)
+        transcripts.append(entry)
+    return transcripts
+
+
+def _transcribe_overlapped(audio, model_name, device, batch_size, chunk_sec, overlap_sec, timestamps, sr):
+    if timestamps == "segment":
+        raise ValueError("overlapping windows are stitched word by word; use timestamps='word' or 'none'")
+    total = len(audio) / sr
+    plan = plan_windows(total, chunk_sec, overlap_sec)
+    windows = [audio[int(start * sr):int(start * sr) + int(length * sr)] for start, length in plan]
+    outputs = _decode_windows(windows, model_name, device, batch_size, "word", sr)
+    words = stitch([_offset_chunks(out["chunks"], start) for out, (start, _) in zip(outputs, plan)], plan)
+    print(f"🧵 {len(windows)} overlapping window(s) stitched into {len(words)} word(s)")
+
+    transcripts = []
+    for entry in bucket(words, chunk_sec - overlap_sec, total):
+        out = {"start": entry["start"], "end": entry["end"],
+               "text": " ".join(w["text"] for w in entry["words"] if w["text"])}
+        if timestamps == "word":
+            out["words"] = entry["words"]
+        transcripts.append(out)
+    return transcripts
+
+
+@stage("asr")
+def _decode_windows(windows, model_name, device, batch_size, timestamps, sr):
+    """Pipeline output ({"text", "chunks"}) per window, cached per window content."""
+    params = {"timestamps": timestamps, "sr": sr}
+    keys = [make_key("hf_asr_batched", _model_key(model_name), params, data=[w]) for w in windows]
+    outputs = [cache.get_json(k) for k in keys]
+
+    todo = [i for i, out in enumerate(outputs) if out is None]
+    if todo:
+        recognizer = get_recognizer(model_name, device)
+        kwargs = {"batch_size": batch_size, "chunk_length_s": 30}
+        if timestamps == "word":
+            kwargs["return_timestamps"] = "word"
+        elif timestamps == "segment":
+            kwargs["return_timestamps"] = True
+        # a generator makes the pipeline stream results back batch by batch
+        inputs = ({"raw": windows[i], "sampling_rate": sr} for i in todo)
+        results = recognizer(inputs, **kwargs)
+        for i, res in tqdm(zip(todo, results), total=len(todo), desc="Transcribing windows"):
+            out = {"text": res.get("text", "").strip(), "chunks": res.get("chunks")}
+            cache.put_json(keys[i], out)
+            outputs[i] = out
+    print(f"{len(windows) - len(todo)}/{len(windows)} window(s) reused from cache")
+    return outputs
+
+
+def run(video_path, output_dir="outputs", batched=False, batch_size=8,
+        chunk_sec=CHUNK_SEC, timestamps="none", overlap_sec=0.0):
+    """
+    Transcribe one video into <output_dir>/<name>_transcription.json; returns
+    that path.  Raises FileNotFoundError / RuntimeError instead of exiting, so
+    batch_runner can carry on with the next video.
+    """
+    if not os.path.isfile(video_path):
+        raise FileNotFoundError(f"File not found: {video_path}")
     base_name = os.path.splitext(os.path.basename(video_path))[0]
-    output_dir = os.path.join("outputs")
     os.makedirs(output_dir, exist_ok=True)
 
-    print("Extracting audio and splitting into 10-second WAV chunks...")
-    chunk_files = split_video(video_path, output_dir)
-    if not chunk_files:
-        print("No chunks were created; aborting.")
-        exit(1)
+    if batched:
+        print("Decoding audio into memory...")
+        audio = load_audio(video_path)
+        if not len(audio):
+            raise RuntimeError(f"No audio decoded from {video_path}")
+        print(f"Decoded {len(audio) / SR:.1f}s of audio")
+        print("Starting transcription on GPU" if torch.cuda.is_available() else "Starting transcription on CPU")
+        transcripts = transcribe_batched(audio, batch_size=batch_size, chunk_sec=chunk_sec,
+                                         timestamps=timestamps, overlap_sec=overlap_sec)
+    else:
+        print("Extracting audio and splitting into 10-second WAV chunks...")
+        # one chunk folder per video, so several videos can share an output dir
+        chunk_files = split_video(video_path, os.path.join(output_dir, f"{base_name}_chunks"))
+        if not chunk_files:
+            raise RuntimeError(f"No chunks were created from {video_path}")
 
-    print(f"Created {len(chunk_files)} chunk(s) in '{output_dir}'")
-    print("Starting transcription on GPU" if torch.cuda.is_available() else "Starting transcription on CPU")
-    transcripts = transcribe_chunks(chunk_files)
+        print(f"Created {len(chunk_files)} chunk(s) in '{output_dir}'")
+        print("Starting transcription on GPU" if torch.cuda.is_available() else "Starting transcription on CPU")
+        transcripts = transcribe_chunks(chunk_files)
 
     output_json = os.path.join(output_dir, f"{base_name}_transcription.json")
     with open(output_json, "w") as f:
         json.dump(transcripts, f, indent=2)
 
     print(f"Transcription complete. JSON output saved to: {output_json}")
+    return output_json
+
+
+def main():
+    global BACKEND
+    parser = argparse.ArgumentParser(description="Transcribe audio from an MP4 video into JSON chunks")
+    parser.add_argument("video_path", help="Path to input MP4 video")
+    parser.add_argument("--batched", action="store_true",
+                        help="Decode audio once in memory and transcribe windows in batches")
+    parser.add_argument("--batch-size", type=int, default=8, help="Windows per forward pass (--batched)")
+    parser.add_argument("--chunk-sec", type=float, default=CHUNK_SEC, help="Window length in seconds (--batched)")
+    parser.add_argument("--timestamps", choices=["none", "segment", "word"], default="none",
+                        help="Also emit segment- or word-level timestamps (--batched)")
+    parser.add_argument("--overlap-sec", type=float, default=0.0,
+                        help="Seconds shared by neighbouring windows, stitched word by word (--batched; "
+                             "e.g. --chunk-sec 30 --overlap-sec 5)")
+    parser.add_argument("--backend", choices=HF_ASR_BACKENDS, default=BACKEND,
+                        help="Inference runtime: hf (default), hf-int8 (CPU dynamic int8) or onnx (onnxruntime)")
+    parser.add_argument("--threads", type=int, help="Intra-op CPU threads (default: torch's choice)")
+    add_cli_args(parser)
+    args = parser.parse_args()
+    metrics.configure(args.metrics, args.metrics_port)
+
+    BACKEND = args.backend
+    set_threads(args.threads)
+
+    try:
+        run(args.video_path, os.path.join("outputs"), batched=args.batched, batch_size=args.batch_size,
+            chunk_sec=args.chunk_sec, timestamps=args.timestamps, overlap_sec=args.overlap_sec)
+    except (FileNotFoundError, RuntimeError) as err:
+        print(f"Error: {err}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()